@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# Peak and retained memory of turning an album response into an ImmichAlbum, streamed a chunk at
+# a time against loading the whole payload with json.loads as it used to be.
+#   python3 benchmarks/album_parse.py [--assets 1000 10000 50000]
+# --check parses an album with immich's string orientations, and some that are missing or bad, and
+# exits non-zero if the photos dont come out the way the exif says
+#   python3 benchmarks/album_parse.py --check
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from immich_data import ImmichAlbum
+
+CHUNK_SIZE = 65536
+
+def make_payload(count, orientations = ("1",)):
+    # roughly what immich sends for every asset of an album
+    assets = []
+    for i in range(count):
+        orientation = orientations[i % len(orientations)]
+        assets.append({
+            "id": f"{i:08d}-1111-4000-8000-000000000000", "type": "IMAGE",
+            "deviceAssetId": f"IMG_{i:04d}.JPG-123456", "ownerId": "00000000-2222-4000-8000-000000000000",
+            "deviceId": "phone", "libraryId": None, "originalPath": f"upload/library/admin/2024/IMG_{i:04d}.JPG",
+            "originalFileName": f"IMG_{i:04d}.JPG", "originalMimeType": "image/jpeg",
+            "thumbhash": "1QcSHQRnh493V4dIh4eXh1h4kJUI", "fileCreatedAt": "2024-05-01T10:00:00.000Z",
+            "fileModifiedAt": "2024-05-01T10:00:00.000Z", "localDateTime": "2024-05-01T12:00:00.000Z",
+            "updatedAt": "2024-05-02T10:00:00.000Z", "isFavorite": False, "isArchived": False, "isTrashed": False,
+            "duration": "0:00:00.00000", "checksum": "v3d1hbnxQv8VZl8eXG8mHnQvT5E=", "isOffline": False,
+            "hasMetadata": True, "duplicateId": None, "resized": True, "people": [], "tags": [],
+            "exifInfo": {"make": "Google", "model": "Pixel 7", "exifImageWidth": 4080, "exifImageHeight": 3072,
+                         "fileSizeInByte": 2500000 + i, "orientation": orientation, "dateTimeOriginal": "2024-05-01T10:00:00.000Z",
+                         "modifyDate": "2024-05-01T10:00:00.000Z", "timeZone": "Europe/London", "lensModel": None,
+                         "fNumber": 1.9, "focalLength": 6.8, "iso": 50, "exposureTime": "1/120",
+                         "latitude": 51.5, "longitude": -0.12, "city": "London", "state": "England",
+                         "country": "United Kingdom", "description": "", "projectionType": None, "rating": None},
+        })
+    album = {"albumName": "Frame", "description": "", "albumThumbnailAssetId": assets[0]["id"] if assets else None,
+             "createdAt": "2024-01-01T00:00:00.000Z", "updatedAt": "2024-06-01T00:00:00.000Z",
+             "id": "00000000-3333-4000-8000-000000000000", "ownerId": "00000000-2222-4000-8000-000000000000",
+             "albumUsers": [], "shared": False, "hasSharedLink": False, "assets": assets, "assetCount": count,
+             "isActivityEnabled": True, "order": "desc", "lastModifiedAssetTimestamp": "2024-06-01T00:00:00.000Z"}
+    return json.dumps(album).encode('utf-8')
+
+def chunks(payload):
+    for i in range(0, len(payload), CHUNK_SIZE):
+        yield payload[i:i + CHUNK_SIZE]
+
+def load_whole(payload):
+    # the old way.  the whole response is decoded and every asset dict stays referenced
+    album_dict = json.loads(payload.decode('utf-8'))
+    return {asset["id"]: asset for asset in album_dict["assets"] if asset["type"] == "IMAGE"}
+
+def load_stream(payload):
+    return ImmichAlbum.from_stream(chunks(payload)).image_assets
+
+def measure(name, parse, payload):
+    tracemalloc.start()
+    start = time.perf_counter()
+    assets = parse(payload)
+    elapsed = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  {name:7} {elapsed:.3f}s  peak={peak / 1e6:.1f}MB  retained={retained / 1e6:.1f}MB  images={len(assets)}")
+
+def check():
+    from helpers import Orientation
+    from image_database import ImageData
+    # immich sends strings.  ints, gaps and junk shouldnt fall over either
+    expected = [("1", Orientation.LANDSCAPE), ("3", Orientation.LANDSCAPE), ("6", Orientation.PORTRAIT),
+                ("8", Orientation.PORTRAIT), (6, Orientation.PORTRAIT), (None, None), ("", None), ("9", None)]
+    payload = make_payload(len(expected), [orientation for orientation, _ in expected])
+    assets = list(load_stream(payload).values())
+    failed = 0
+    for asset, (orientation, wanted) in zip(assets, expected):
+        got = ImageData.get_exif_orientation(asset)
+        if got != wanted:
+            print(f"  orientation {orientation!r} gave {got!r}, expected {wanted!r}")
+            failed += 1
+    if failed > 0 or len(assets) != len(expected):
+        print("Orientations dont match the exif")
+        sys.exit(1)
+    print(f"  {len(expected)} orientations ok")
+
+def main(args):
+    if args.check:
+        check()
+        return
+    for count in args.assets:
+        payload = make_payload(count)
+        print(f"{count} assets, {len(payload) / 1e6:.1f}MB payload")
+        measure("whole", load_whole, payload)
+        measure("stream", load_stream, payload)
+
+parser = argparse.ArgumentParser(description='Benchmark memory used parsing an album response.')
+parser.add_argument('--assets', type=int, nargs='+', default=[1000, 10000, 50000])
+parser.add_argument('--check', action='store_true', help='check the orientations come through instead of benchmarking')
+
+if __name__ == "__main__":
+    main(parser.parse_args())
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# Button press latency and idle cost against a fake sysfs directory.  Presses are written to
+# plain files, which never wake poll, so this measures the polling fallback; a driver that
+# notifies is only faster.  Reports how long after a write a press is seen, how long until the
+# daemon has shown the next photo for it, that bouncing contacts give one press, and the cpu an
+# idle listener uses next to the old shell monitor (cat and tr for every button once a second).
+#   python3 benchmarks/buttons.py [--presses 20] [--idle 5]
+import os
+import sys
+import time
+import signal
+import tempfile
+import argparse
+import resource
+import threading
+import subprocess
+
+BENCHMARK_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_PATH, "..", "src"))
+from buttons import ButtonListener
+from daemon import PhotoDaemon
+
+BUTTONS = ["btn_a", "btn_b", "btn_c", "btn_d"]
+SHELL_MONITOR = """
+while true; do
+    for filepath in "$@"; do
+        value=$(cat $filepath | tr -d '\\n')
+    done
+    sleep 1
+done
+"""
+
+def make_sysfs(directory):
+    for button in BUTTONS:
+        write_button(directory, button, "0")
+
+def write_button(directory, button, value):
+    # sysfs attributes change in place
+    with open(os.path.join(directory, button), 'w') as file:
+        file.write(f"{value}\n")
+
+def press(directory, button, hold = 0.15):
+    write_button(directory, button, "1")
+    pressed_at = time.monotonic()
+    time.sleep(hold)
+    write_button(directory, button, "0")
+    return pressed_at
+
+def percentiles(values):
+    values = sorted(values)
+    return (f"p50={values[len(values) // 2] * 1000:.1f}ms p95={values[int(len(values) * 0.95)] * 1000:.1f}ms "
+            f"max={values[-1] * 1000:.1f}ms")
+
+def measure_detection(directory, presses):
+    seen = []
+    listener = ButtonListener(directory, BUTTONS, lambda button, detected_at: seen.append(time.monotonic()))
+    listener.start()
+    latencies = []
+    for index in range(presses):
+        count = len(seen)
+        pressed_at = press(directory, BUTTONS[index % len(BUTTONS)])
+        while len(seen) == count:
+            time.sleep(0.001)
+        latencies.append(seen[-1] - pressed_at)
+        # land the next press at a different point of the poll interval
+        time.sleep(0.05 + (index * 0.037) % 0.1)
+    listener.stop()
+    print(f"press seen      {percentiles(latencies)}  (poll interval {listener.poll_interval * 1000:.0f}ms)")
+
+def measure_bounce(directory):
+    seen = []
+    listener = ButtonListener(directory, ["btn_a"], lambda button, detected_at: seen.append(button))
+    listener.start()
+    # a contact that chatters for 150ms, then a real second press after the debounce window
+    for _ in range(10):
+        write_button(directory, "btn_a", "1")
+        time.sleep(0.015)
+        write_button(directory, "btn_a", "0")
+    time.sleep(listener.debounce + 0.1)
+    press(directory, "btn_a")
+    time.sleep(listener.poll_interval * 2)
+    listener.stop()
+    print(f"bounce          {len(seen)} presses acted on from 11 (expect 2)")
+
+def measure_daemon(directory, presses):
+    # the scheduler owns the main thread, the same as --daemon
+    shown = []
+    refresh = [0.2]
+    def display():
+        shown.append(time.monotonic())
+        # an e-ink refresh, so presses land while the last one is still showing
+        time.sleep(refresh[0])
+
+    daemon = PhotoDaemon(os.path.join(directory, "daemon.sock"), display, display_interval=3600)
+    listener = ButtonListener(directory, ["btn_a"], lambda button, detected_at: daemon.post("next", detected_at))
+    latencies = []
+
+    def run_presses():
+        time.sleep(0.2)
+        for index in range(presses):
+            count = len(shown)
+            pressed_at = press(directory, "btn_a", hold=0.1)
+            while len(shown) == count:
+                time.sleep(0.001)
+            latencies.append(shown[-1] - pressed_at)
+            time.sleep(0.3 + (index * 0.037) % 0.1)
+        # five presses during a slow refresh show the photo for the first and one more, not five
+        refresh[0] = 3.0
+        count = len(shown)
+        for _ in range(5):
+            press(directory, "btn_a", hold=0.1)
+            time.sleep(listener.debounce)
+        time.sleep(refresh[0] * 2 + 0.5)
+        latencies.append(len(shown) - count)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    listener.start()
+    threading.Thread(target=run_presses, daemon=True).start()
+    try:
+        daemon.run()
+    except SystemExit:
+        pass
+    listener.stop()
+    stacked = latencies.pop()
+    print(f"photo started   {percentiles(latencies)}")
+    print(f"rapid presses   5 presses during a refresh showed {stacked} photos (expect 2)")
+
+def measure_idle(directory, seconds):
+    listener = ButtonListener(directory, BUTTONS, lambda button, detected_at: None)
+    listener.start()
+    start = time.process_time()
+    time.sleep(seconds)
+    listener_cpu = time.process_time() - start
+    listener.stop()
+
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    monitor = subprocess.Popen(["bash", "-c", SHELL_MONITOR, "monitor"] + [os.path.join(directory, button) for button in BUTTONS])
+    time.sleep(seconds)
+    monitor.terminate()
+    monitor.wait()
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    shell_cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+
+    print(f"idle cpu        listener {listener_cpu / seconds * 100:.2f}%  shell monitor {shell_cpu / seconds * 100:.2f}% "
+          f"({len(BUTTONS) * 2} forks a second, press seen up to 1000ms late)")
+
+def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        make_sysfs(directory)
+        measure_detection(directory, args.presses)
+        measure_bounce(directory)
+        measure_daemon(directory, args.presses)
+        measure_idle(directory, args.idle)
+
+parser = argparse.ArgumentParser(description='Benchmark the button listener against a fake sysfs directory.')
+parser.add_argument('--presses', type=int, default=20)
+parser.add_argument('--idle', type=float, default=5, help='seconds to measure idle cpu over')
+
+if __name__ == "__main__":
+    main(parser.parse_args())
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# Load, save and pick times and memory of the image database at several sizes.  Each size runs in
+# its own process against a generated photos.db so memory is measured from a clean start.
+#   python3 benchmarks/database.py [--rows 10000 100000 1000000] [--picks N]
+import os
+import sys
+import json
+import time
+import random
+import resource
+import argparse
+import tempfile
+import subprocess
+
+SRC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+ALBUMS = 20
+
+def generate(database_file, count):
+    # ImageStore makes the tables and the rows go straight in with sql, so the file looks the same
+    # whatever ImageData does in memory
+    sys.path.insert(0, SRC_PATH)
+    from image_store import ImageStore
+    store = ImageStore(database_file)
+    random.seed(count)
+    rows = []
+    for i in range(count):
+        album_id = f"{i % ALBUMS:08d}-0000-4000-8000-000000000000"
+        date = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time() - random.uniform(0, 90 * 86400)))
+        rows.append((album_id, f"{i:08d}-1111-4000-8000-000000000000", f"/photos/{i:08x}.jpg", date,
+                     random.randint(0, 20), random.choice([1, 2]), 0))
+    with store.connection:
+        store.connection.executemany(
+            "INSERT INTO images (album_id, asset_id, file_path, last_used_date, use_count, orientation, evicted) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    store.close()
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def measure(directory, picks):
+    # runs in the child process
+    sys.path.insert(0, SRC_PATH)
+    from settings import Settings
+    from screen import ScreenResolution
+    from image_database import ImageDatabase
+
+    settings = Settings(os.path.join(directory, "config.json"))
+    base_rss = max_rss_mb()
+    results = {}
+
+    start = time.perf_counter()
+    database = ImageDatabase(settings, ScreenResolution([800, 480]))
+    results['load'] = time.perf_counter() - start
+    results['memory'] = max_rss_mb() - base_rss
+
+    # showing photos, with the usage held back and written in one go
+    start = time.perf_counter()
+    for _ in range(picks):
+        database.use_image(database.pick_random_image())
+    results['pick'] = (time.perf_counter() - start) / picks
+
+    # worst case save, every row changed
+    database.dirty.update(database.data.keys())
+    start = time.perf_counter()
+    database.save_changes()
+    results['save'] = time.perf_counter() - start
+
+    database.store.close()
+    return results
+
+def run(count, picks):
+    with tempfile.TemporaryDirectory() as directory:
+        settings = {'Settings': {'DataPath': directory, 'ImageCachePath': os.path.join(directory, "photos"),
+                                 'ImageDatabaseFile': os.path.join(directory, "photos.db"), 'SaveInterval': 3600}}
+        with open(os.path.join(directory, "config.json"), 'w') as file:
+            json.dump(settings, file)
+        generate(settings['Settings']['ImageDatabaseFile'], count)
+
+        result = subprocess.run([sys.executable, __file__, "--child", directory, "--picks", str(picks)],
+                                check=True, stdout=subprocess.PIPE, text=True)
+        results = json.loads(result.stdout.splitlines()[-1])
+        print(f"{count:8} rows  load={results['load']:.3f}s  save={results['save']:.3f}s  "
+              f"pick={results['pick'] * 1e6:.0f}us  memory={results['memory']:.0f}MB")
+
+def main(args):
+    if args.child is not None:
+        print(json.dumps(measure(args.child, args.picks)))
+        return
+    for count in args.rows:
+        run(count, args.picks)
+
+parser = argparse.ArgumentParser(description='Benchmark loading, saving and picking from the image database.')
+parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000])
+parser.add_argument('--picks', type=int, default=1000)
+parser.add_argument('--child', help=argparse.SUPPRESS)
+
+if __name__ == "__main__":
+    main(parser.parse_args())
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# A stand-in immich server with a generated library, for benchmarks and for trying photo-display
+# without a real server.  Serves the album, asset, thumbnail, original and archive download
+# endpoints we use.
+#   python3 benchmarks/fake_immich.py [--port 2283] [--albums N] [--assets N]
+# then point ImmichServerUrl at http://127.0.0.1:2283 and run photo-display.py --no-screen.
+#
+# There is no heic encoder in pillow, so "heic" assets are jpeg data sent as image/heic.  That still
+# takes the same force to jpg path through the database as the real thing.
+import io
+import json
+import base64
+import random
+import hashlib
+import zipfile
+import argparse
+import threading
+from urllib.parse import parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from PIL import Image
+
+# share of each kind of asset in the library.  videos are there to be ignored
+ASSET_KINDS = [("jpeg", 0.7), ("png", 0.15), ("heic", 0.1), ("video", 0.05)]
+MIME_TYPES = {"jpeg": "image/jpeg", "png": "image/png", "heic": "image/heic", "video": "video/mp4"}
+EXTENSIONS = {"jpeg": "JPG", "png": "PNG", "heic": "HEIC", "video": "MP4"}
+
+# longest edge of each rendition, as immich makes them out of the box
+RENDITION_SIZES = {"thumbnail": 250, "preview": 1440}
+
+def make_image(kind, width, height, seed):
+    # noise over a gradient compresses about as badly as a photo does
+    generator = random.Random(seed)
+    gradient = Image.linear_gradient('L').resize((width, height)).rotate(generator.choice([0, 90, 180, 270]))
+    bands = [Image.blend(gradient, Image.frombytes('L', (width, height), generator.randbytes(width * height)),
+                         generator.uniform(0.1, 0.3))
+             for _ in range(3)]
+    image = Image.merge('RGB', bands)
+    data = io.BytesIO()
+    if kind == "png":
+        image.save(data, 'PNG', compress_level=1)
+    else:
+        image.save(data, 'JPEG', quality=85)
+    return data.getvalue()
+
+class FakeLibrary:
+    """
+    Albums of generated assets.  Pixel data comes from a small pool per kind, but every asset
+    gets its own checksum so the cache treats each one as a separate photo.  A share of the
+    assets is in more than one album.  Everything is seeded so a library is the same every run.
+    """
+
+    def __init__(self, album_count = 3, assets_per_album = 200, width = 1600, height = 1200, pool_size = 8,
+                 shared = 0.1, seed = 1):
+        self.random = random.Random(seed)
+        self.width = width
+        self.height = height
+        self.lock = threading.Lock()
+        self.pool = {kind: [make_image(kind, width, height, seed * 1000 + i) for i in range(pool_size)]
+                     for kind, _ in ASSET_KINDS if kind != "video"}
+        self.pool["video"] = [b"\x00" * 1024]
+        self.assets = {}     # asset id -> asset dict
+        self.contents = {}   # asset id -> bytes
+        self.albums = {}     # album id -> {'assets': [ids], 'revision': n}
+        self.renditions = {} # (id of the content, size) -> bytes.  assets share content so this stays small
+        self.next_asset = 0
+        self.requests = {}   # endpoint -> count
+        self.bytes_sent = 0
+
+        for index in range(album_count):
+            album_id = f"{index:08d}-0000-4000-8000-000000000000"
+            self.albums[album_id] = {'assets': [], 'revision': 0}
+            self.add_assets(album_id, assets_per_album, shared)
+
+    def new_asset(self):
+        kind = self.random.choices([kind for kind, _ in ASSET_KINDS], [share for _, share in ASSET_KINDS])[0]
+        number = self.next_asset
+        self.next_asset += 1
+        asset_id = f"{number:08d}-1111-4000-8000-000000000000"
+        content = self.random.choice(self.pool[kind])
+        self.contents[asset_id] = content
+        self.assets[asset_id] = {
+            "id": asset_id, "type": "VIDEO" if kind == "video" else "IMAGE",
+            "originalFileName": f"IMG_{number:05d}.{EXTENSIONS[kind]}", "originalMimeType": MIME_TYPES[kind],
+            "checksum": base64.b64encode(hashlib.sha1(asset_id.encode()).digest()).decode(),
+            "fileCreatedAt": "2024-05-01T10:00:00.000Z", "updatedAt": "2024-05-02T10:00:00.000Z",
+            "isFavorite": False, "isArchived": False, "isTrashed": False, "duration": "0:00:00.00000",
+            "exifInfo": {"make": "Fake", "model": "Benchmark", "exifImageWidth": self.width, "exifImageHeight": self.height,
+                         "fileSizeInByte": len(content), "orientation": self.random.choice([None, "1", "1", "6", "8"]),
+                         "dateTimeOriginal": "2024-05-01T10:00:00.000Z", "city": "Nowhere", "country": "Benchmark"},
+        }
+        return asset_id
+
+    def add_assets(self, album_id, count, shared = 0.0):
+        # shared is the chance an added asset is one another album already has
+        with self.lock:
+            album = self.albums[album_id]
+            others = [asset_id for other_id, other in self.albums.items() if other_id != album_id
+                      for asset_id in other['assets'] if asset_id not in album['assets']]
+            for _ in range(count):
+                if len(others) > 0 and self.random.random() < shared:
+                    album['assets'].append(others.pop(self.random.randrange(len(others))))
+                else:
+                    album['assets'].append(self.new_asset())
+            album['revision'] += 1
+
+    def remove_assets(self, album_id, count):
+        with self.lock:
+            album = self.albums[album_id]
+            del album['assets'][:count]
+            album['revision'] += 1
+
+    def get_album(self, album_id, with_assets = True):
+        album = self.albums[album_id]
+        updated = f"2024-06-01T00:00:{album['revision'] % 60:02d}.{album['revision']:03d}Z"
+        payload = {"albumName": f"Album {album_id[:8]}", "id": album_id, "ownerId": "owner", "albumUsers": [],
+                   "shared": False, "createdAt": "2024-01-01T00:00:00.000Z", "updatedAt": updated,
+                   "lastModifiedAssetTimestamp": updated, "assetCount": len(album['assets'])}
+        if with_assets:
+            payload["assets"] = [self.assets[asset_id] for asset_id in album['assets']]
+        return payload, f'"{album_id}-{album["revision"]}"'
+
+    def build_archive(self, asset_ids):
+        # stored rather than deflated, photos dont compress and immich does the same
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, 'w', zipfile.ZIP_STORED) as archive:
+            for asset_id in asset_ids:
+                if asset_id in self.assets:
+                    archive.writestr(self.assets[asset_id]["originalFileName"], self.contents[asset_id])
+        return data.getvalue()
+
+    def get_rendition(self, asset_id, size):
+        # a jpeg no bigger than size on its longest edge, like immich's previews.  thumbnails are webp there
+        # but pillow may be built without it
+        content = self.contents[asset_id]
+        with self.lock:
+            rendition = self.renditions.get((id(content), size))
+        if rendition is None:
+            image = Image.open(io.BytesIO(content)).convert('RGB')
+            image.thumbnail((RENDITION_SIZES[size], RENDITION_SIZES[size]))
+            data = io.BytesIO()
+            image.save(data, 'JPEG', quality=80)
+            rendition = data.getvalue()
+            with self.lock:
+                self.renditions[(id(content), size)] = rendition
+        return rendition
+
+    def count_request(self, endpoint, size):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            self.bytes_sent += size
+
+class FakeImmichHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body = b'', content_type = 'application/json', headers = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        library = self.server.library
+        path, _, query = self.path.partition('?')
+        parts = path.strip('/').split('/')
+        if len(parts) == 3 and parts[:2] == ["api", "albums"] and parts[2] in library.albums:
+            payload, etag = library.get_album(parts[2], with_assets='withoutAssets=true' not in query)
+            if 'assets' in payload and self.headers.get('If-None-Match') == etag:
+                library.count_request("album_not_modified", 0)
+                return self.send(304, headers={'ETag': etag})
+            body = json.dumps(payload).encode('utf-8')
+            library.count_request("album" if 'assets' in payload else "album_version", len(body))
+            return self.send(200, body, headers={'ETag': etag})
+        if len(parts) == 4 and parts[:2] == ["api", "assets"] and parts[2] in library.assets:
+            if parts[3] == "original":
+                body = library.contents[parts[2]]
+                library.count_request("original", len(body))
+                return self.send(200, body, library.assets[parts[2]]["originalMimeType"])
+            if parts[3] == "thumbnail":
+                size = parse_qs(query).get('size', ["thumbnail"])[0]
+                if size in RENDITION_SIZES and library.assets[parts[2]]["type"] == "IMAGE":
+                    body = library.get_rendition(parts[2], size)
+                    library.count_request(size, len(body))
+                    return self.send(200, body, 'image/jpeg')
+        if len(parts) == 3 and parts[:2] == ["api", "assets"] and parts[2] in library.assets:
+            body = json.dumps(library.assets[parts[2]]).encode('utf-8')
+            library.count_request("asset", len(body))
+            return self.send(200, body)
+        self.send(404, b'{"message": "not found"}')
+
+    def do_POST(self):
+        library = self.server.library
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self.path.split('?')[0] == "/api/download/archive":
+            body = library.build_archive(request.get("assetIds", []))
+            library.count_request("archive", len(body))
+            return self.send(200, body, 'application/zip')
+        self.send(404, b'{"message": "not found"}')
+
+def start_server(library, port = 0):
+    server = ThreadingHTTPServer(('127.0.0.1', port), FakeImmichHandler)
+    server.daemon_threads = True
+    server.library = library
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main(args):
+    print("Generating library...")
+    library = FakeLibrary(args.albums, args.assets)
+    server = start_server(library, args.port)
+    print(f"Serving on http://127.0.0.1:{server.server_port} with albums:")
+    for album_id in library.albums:
+        print(f"  {album_id}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+parser = argparse.ArgumentParser(description='Run a fake immich server with a generated library.')
+parser.add_argument('--port', type=int, default=2283)
+parser.add_argument('--albums', type=int, default=3)
+parser.add_argument('--assets', type=int, default=200, help='assets per album')
+
+if __name__ == "__main__":
+    main(parser.parse_args())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# Import time regression check for the cold start paths.  Runs photo-display.py under -X importtime,
+# fails if a path loads a module it has no use for or if its imports take longer than the budget.
+# Modules the interpreter loads on its own (site, .pth files) are measured once and left out.
+# The offline path shows a photo, so point it at a synced install you dont mind advancing.
+#   python3 benchmarks/importtime.py --config config.json [--budget-ms N] [--runs N] [--top N]
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+SRC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+SCRIPT_PATH = os.path.join(SRC_PATH, "photo-display.py")
+
+NETWORK = ["requests", "urllib3"]
+PROCESSING = ["tqdm", "zipfile", "csv", "pillow_heif", "image_transform", "image_pipeline", "zip_stream"]
+DRIVER = ["inky"]
+
+# name, photo-display.py arguments, modules that path should never import
+SCENARIOS = [
+    ("offline", ["--offline", "--no-screen"], NETWORK + PROCESSING + DRIVER),
+    ("command", ["--command", "status"], NETWORK + PROCESSING + DRIVER + ["PIL", "sqlite3", "image_database", "frame_cache"]),
+]
+
+def parse_importtime(output):
+    # returns [(module, self_us, cumulative_us, depth)] in import order
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return imports
+
+def run_importtime(arguments):
+    result = subprocess.run([sys.executable, "-X", "importtime"] + arguments,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    return parse_importtime(result.stderr)
+
+def write_config(config, directory):
+    with open(config, 'r') as file:
+        settings = json.load(file)
+    # one frame and out, and never talk to a daemon that might be running
+    settings['Settings']['SleepTime'] = 0
+    settings['Settings']['SocketPath'] = os.path.join(directory, "photo_display.sock")
+    path = os.path.join(directory, "config.json")
+    with open(path, 'w') as file:
+        json.dump(settings, file)
+    return path
+
+def measure(arguments, baseline, runs):
+    # best of runs, only counting the top level imports the interpreter didnt already do
+    best = None
+    for _ in range(runs):
+        imports = [entry for entry in run_importtime(arguments) if entry[0] not in baseline]
+        total = sum(cumulative for _, _, cumulative, depth in imports if depth == 0)
+        if best is None or total < best[0]:
+            best = (total, imports)
+    return best
+
+def main(args):
+    baseline = {entry[0] for entry in run_importtime(["-c", "pass"])}
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        config = write_config(args.config, directory)
+        for name, arguments, forbidden in SCENARIOS:
+            total, imports = measure([SCRIPT_PATH, "--config", config] + arguments, baseline, args.runs)
+            modules = {module for module, _, _, _ in imports}
+            loaded = sorted(module for module in modules if module.split('.')[0] in forbidden)
+            over_budget = total / 1000 > args.budget_ms
+            failed = failed or len(loaded) > 0 or over_budget
+
+            status = "FAIL" if len(loaded) > 0 or over_budget else "ok"
+            print(f"{name:8} {status:4} imports={total / 1000:.1f}ms (budget {args.budget_ms}ms) modules={len(modules)}")
+            if len(loaded) > 0:
+                print(f"         should not import: {', '.join(loaded)}")
+            for module, self_us, cumulative_us, depth in sorted(imports, key=lambda x: -x[1])[:args.top]:
+                print(f"         {self_us / 1000:7.1f}ms self {cumulative_us / 1000:7.1f}ms total  {module}")
+
+    return 1 if failed else 0
+
+parser = argparse.ArgumentParser(description='Check the import time of the photo-display start up paths.')
+parser.add_argument('--config', help='config json file of an already synced install', default="./config.json")
+parser.add_argument('--budget-ms', type=float, default=100,
+                    help='most time a path may spend importing.  the default suits a desktop, raise it on a pi')
+parser.add_argument('--runs', type=int, default=3, help='take the best of this many runs')
+parser.add_argument('--top', type=int, default=5, help='show the slowest imports of each path')
+
+if __name__ == "__main__":
+    sys.exit(main(parser.parse_args()))
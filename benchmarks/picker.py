@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# Compares the fenwick based WeightedPicker against the original linear scan picker.  Exits
+# non-zero when the fenwick picks dont fit the original weighting, judged by chi-square at --alpha.
+#   python3 benchmarks/picker.py [--images N] [--samples N] [--seed N] [--alpha 0.001]
+import os
+import sys
+import time
+import random
+import argparse
+from statistics import NormalDist
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from weighted_picker import WeightedPicker, to_hours
+
+def make_images(count, now):
+    images = []
+    for i in range(count):
+        last_used = now - timedelta(hours=random.uniform(0, 24 * 90))
+        images.append((f"asset-{i}", last_used, random.randint(0, 20)))
+    return images
+
+def linear_weight(image, now):
+    hours = (now - image[1]).total_seconds() / 3600
+    return (1 + hours) / (1 + image[2])
+
+def linear_pick(images, now):
+    # the original get_random_image algorithm, without the side effects
+    images = sorted(images, key=lambda x: linear_weight(x, now))
+    weights = [linear_weight(image, now) for image in images]
+    rand_num = random.uniform(0, sum(weights))
+    cumulative_weight = 0
+    for image, weight in zip(images, weights):
+        cumulative_weight += weight
+        if rand_num <= cumulative_weight:
+            return image[0]
+
+def fenwick_pick(picker, now_hours):
+    return picker.pick(now_hours, random.uniform(0, picker.total_weight(now_hours)))
+
+def chi_square(counts, expected):
+    return sum((counts.get(key, 0) - value) ** 2 / value for key, value in expected.items())
+
+def chi_square_critical(dof, alpha):
+    # wilson-hilferty, within a fraction of a percent of the table value at these sizes
+    z = NormalDist().inv_cdf(1 - alpha)
+    return dof * (1 - 2 / (9 * dof) + z * (2 / (9 * dof)) ** 0.5) ** 3
+
+def main(args):
+    random.seed(args.seed)
+    now = datetime.now()
+    now_hours = to_hours(now)
+    images = make_images(args.images, now)
+
+    # built from placeholder values and brought to the real ones with single entry updates, so the
+    # check covers the tree updates mark_used relies on as well as the construction
+    picker = WeightedPicker()
+    picker.build((key, now_hours, 0) for key, _, _ in images)
+    for key, last_used, use_count in images:
+        picker.set(key, to_hours(last_used), use_count)
+
+    # exact distribution from the original weighting
+    weights = {image[0]: linear_weight(image, now) for image in images}
+    total_weight = sum(weights.values())
+    expected = {key: args.samples * weight / total_weight for key, weight in weights.items()}
+
+    dof = args.images - 1
+    critical = chi_square_critical(dof, args.alpha)
+    results = {}
+    for name, pick in [("linear", lambda: linear_pick(images, now)),
+                       ("fenwick", lambda: fenwick_pick(picker, now_hours))]:
+        counts = {}
+        start = time.perf_counter()
+        for _ in range(args.samples):
+            key = pick()
+            counts[key] = counts.get(key, 0) + 1
+        elapsed = time.perf_counter() - start
+        results[name] = chi_square(counts, expected)
+        print(f"{name:8} {args.samples} picks in {elapsed:.3f}s "
+              f"({elapsed / args.samples * 1e6:.1f}us/pick) "
+              f"chi2={results[name]:.1f} (dof={dof}, critical={critical:.1f} at p={args.alpha})")
+
+    # single entry updates, as done by mark_used
+    start = time.perf_counter()
+    for i in range(args.samples):
+        key = images[i % len(images)][0]
+        picker.set(key, now_hours, i % 20)
+    elapsed = time.perf_counter() - start
+    print(f"update   {args.samples} updates in {elapsed:.3f}s ({elapsed / args.samples * 1e6:.1f}us/update)")
+
+    if results["fenwick"] > critical:
+        print(f"FAIL: fenwick picks dont match the original weighting (chi2 {results['fenwick']:.1f} > {critical:.1f})")
+        sys.exit(1)
+    print("OK: fenwick picks match the original weighting")
+
+parser = argparse.ArgumentParser(description='Benchmark and compare the weighted image picker.')
+parser.add_argument('--images', type=int, default=200)
+parser.add_argument('--samples', type=int, default=20000)
+parser.add_argument('--seed', type=int, default=1)
+parser.add_argument('--alpha', type=float, default=0.001, help='significance level for the chi-square check')
+
+if __name__ == "__main__":
+    main(parser.parse_args())
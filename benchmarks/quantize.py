@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# Time and quality of mapping a frame onto the panel colours: the inky driver's own conversion,
+# which is what a full colour image sent to set_image goes through, against the Quantizer modes.
+# Quality is the mean difference between the original and the quantized frame after a blur,
+# roughly what the eye sees from a step back, and stray is pixels put on an index the panel
+# doesnt have.
+#   python3 benchmarks/quantize.py [--images N] [--screen WxH] [--saturation 0.5]
+# --check quantizes a fixed synthetic image in every mode and compares the palette indices to the
+# hashes in GOLDEN, exiting non-zero on a mismatch.  after a deliberate change to the output, put
+# the hashes it prints in GOLDEN.  pillow does the nearest colour search, so a new pillow can move
+# them too
+#   python3 benchmarks/quantize.py --check
+import os
+import sys
+import time
+import hashlib
+import argparse
+
+import numpy
+from PIL import Image, ImageFilter
+
+BENCHMARK_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_PATH, "..", "src"))
+sys.path.insert(0, BENCHMARK_PATH)
+from quantizer import Quantizer, DITHER_MODES
+from fake_immich import make_image
+
+# sha1 of the palette indices of golden_image() at saturation 0.5
+GOLDEN = {
+    "floyd-steinberg": "d711de9d153c167c66503701b627aaeb5ebdb28a",
+    "ordered": "57a43ddcef897dc5f0796d05349ee27e34ccdb28",
+    "none": "e5c0dfc3b1e2c3b97cc42384ff88cd6ebdf7a381",
+}
+
+class Settings:
+    def __init__(self, saturation):
+        self.saturation = saturation
+
+    def get_setting(self, name, default):
+        return self.saturation if name == "Saturation" else default
+
+def driver_path(image, palette):
+    # what inky's set_image does with anything that isnt already a "P" image
+    palette_image = Image.new("P", (1, 1))
+    palette_image.putpalette(palette + [0, 0, 0] * 248)
+    image.load()
+    converted = image.im.convert("P", True, palette_image.im)
+    return numpy.array(converted, dtype=numpy.uint8).reshape((image.height, image.width))
+
+def quantizer_path(image, quantizer):
+    # frames come out as "P" images, which the driver turns into its buffer the same way
+    return numpy.array(quantizer.quantize(image), dtype=numpy.uint8)
+
+def blur(image):
+    return numpy.asarray(image.filter(ImageFilter.GaussianBlur(2)), dtype=numpy.float32)
+
+def golden_image():
+    # sweeps across and down with no jpeg in the way, so it is the same everywhere.  the odd size
+    # leaves part of a bayer tile at the edges
+    y, x = numpy.mgrid[0:66, 0:98]
+    red = x * 255 // 97
+    green = y * 255 // 65
+    blue = (x * 3 + y * 5) % 256
+    return Image.fromarray(numpy.stack([red, green, blue], axis=2).astype(numpy.uint8), 'RGB')
+
+def check():
+    from screen import Screen
+    palette = Screen(Settings(0.5)).get_palette()
+    image = golden_image()
+    failed = False
+    for mode in DITHER_MODES:
+        indices = quantizer_path(image, Quantizer(palette, mode))
+        digest = hashlib.sha1(indices.tobytes()).hexdigest()
+        stray = int((indices >= 7).sum())
+        matches = digest == GOLDEN[mode] and stray == 0
+        failed = failed or not matches
+        print(f"  {mode:16} {digest}  stray={stray}  {'ok' if matches else 'MISMATCH'}")
+    if failed:
+        print("Quantizer output differs from the golden image")
+        sys.exit(1)
+
+def main(args):
+    if args.check:
+        check()
+        return
+
+    from io import BytesIO
+    from screen import Screen
+    screen = Screen(Settings(args.saturation))
+    palette = screen.get_palette()
+    size = tuple(map(int, args.screen.split('x')))
+
+    images = [Image.open(BytesIO(make_image("jpeg", size[0] * 2, size[1] * 2, seed))).convert('RGB').resize(size)
+              for seed in range(args.images)]
+    # a smooth sweep shows banding that noise hides
+    sweep = numpy.linspace(0, 255, size[0], dtype=numpy.float32)
+    images.append(Image.fromarray(numpy.stack([numpy.tile(sweep, (size[1], 1)),
+                                               numpy.tile(sweep[::-1], (size[1], 1)),
+                                               numpy.full((size[1], size[0]), 128, numpy.float32)], axis=2).astype(numpy.uint8)))
+
+    engines = [("driver", lambda image: driver_path(image, palette))]
+    for mode in DITHER_MODES:
+        quantizer = Quantizer(palette, mode)
+        engines.append((mode, lambda image, quantizer=quantizer: quantizer_path(image, quantizer)))
+
+    print(f"{len(images)} images at {args.screen}")
+    for name, quantize in engines:
+        elapsed, error, stray = 0.0, 0.0, 0
+        for image in images:
+            start = time.perf_counter()
+            indices = quantize(image)
+            elapsed += time.perf_counter() - start
+            stray += int((indices >= 7).sum())
+            shown = Image.fromarray(numpy.minimum(indices, 7), 'P')
+            shown.putpalette(palette)
+            shown = shown.convert('RGB')
+            error += float(numpy.abs(blur(shown) - blur(image)).mean())
+        print(f"  {name:16} {elapsed / len(images) * 1000:7.2f}ms/frame  error={error / len(images):6.2f}  stray={stray}")
+
+parser = argparse.ArgumentParser(description='Benchmark mapping frames onto the panel colours.')
+parser.add_argument('--images', type=int, default=5)
+parser.add_argument('--screen', default="600x448")
+parser.add_argument('--saturation', type=float, default=0.5)
+parser.add_argument('--check', action='store_true', help='compare against the golden image instead of benchmarking')
+
+if __name__ == "__main__":
+    main(parser.parse_args())
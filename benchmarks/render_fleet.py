@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# A room of panels syncing from one render server, all on this machine.  Starts the fake immich
+# server (see fake_immich.py) and a render server in this process, syncs the server once, then
+# starts --panels client processes together, each with its own data directory, and reports how
+# long they took to get every frame.  Panels are spread over --profiles different settings.
+#   python3 benchmarks/render_fleet.py [--panels 8] [--profiles 2] [--albums 2] [--assets 50]
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+BENCHMARK_PATH = os.path.dirname(os.path.abspath(__file__))
+SRC_PATH = os.path.join(BENCHMARK_PATH, "..", "src")
+LETTERBOX_COLORS = ["white", "black", "red", "blue", "green", "yellow"]
+
+def write_config(directory, settings):
+    os.makedirs(directory, exist_ok=True)
+    settings = {'DataPath': directory, 'ImageCachePath': os.path.join(directory, "photos"),
+                'ImageDatabaseFile': os.path.join(directory, "photos.db"), 'SleepTime': 0, 'Saturation': 0.5,
+                'PreferredOrientation': "landscape", 'ForceOrientation': False, 'PreserveAspect': True, **settings}
+    config_file = os.path.join(directory, "config.json")
+    with open(config_file, 'w') as file:
+        json.dump({'Settings': settings}, file)
+    return config_file
+
+def run_panel(config_file):
+    # runs in the child process.  the same as a panel's sync less the ping
+    sys.path.insert(0, SRC_PATH)
+    from settings import Settings
+    from screen import Screen
+    from frame_cache import FrameCache
+    from image_database import ImageDatabase
+    from panel_profile import PanelProfile
+    from render_client import RenderClient
+
+    start = time.perf_counter()
+    settings = Settings(config_file)
+    screen = Screen(settings)
+    frame_cache = FrameCache(os.path.join(settings.DataPath, "frames"), screen.resolution, screen.get_palette(), screen.saturation)
+    database = ImageDatabase(settings, screen.resolution, frame_cache)
+    client = RenderClient(settings.RenderServerUrl, PanelProfile.from_settings(settings, screen),
+                          os.path.join(settings.DataPath, "render_client.json"))
+    complete = client.sync(database)
+    database.close()
+    return {'seconds': time.perf_counter() - start, 'complete': complete, 'frames': len(os.listdir(frame_cache.directory))}
+
+def run_panels(configs):
+    processes = [subprocess.Popen([sys.executable, __file__, "--child", config_file],
+                                  stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True) for config_file in configs]
+    results = []
+    for process in processes:
+        output, _ = process.communicate()
+        results.append(json.loads(output.splitlines()[-1]))
+    return results
+
+def report(name, results, elapsed):
+    seconds = sorted(result['seconds'] for result in results)
+    complete = sum(1 for result in results if result['complete'])
+    print(f"{name:12} {elapsed:7.2f}s wall  panel p50={seconds[len(seconds) // 2]:.2f}s max={seconds[-1]:.2f}s  "
+          f"complete={complete}/{len(results)}  frames={results[0]['frames']}")
+
+def main(args):
+    if args.child is not None:
+        print(json.dumps(run_panel(args.child)))
+        return
+
+    sys.path.insert(0, SRC_PATH)
+    sys.path.insert(0, BENCHMARK_PATH)
+    from fake_immich import FakeLibrary, start_server
+    from settings import Settings
+    from immich_data import ImmichConnection
+    from render_server import MasterDatabase, RenderServer
+
+    print(f"Generating {args.albums} albums of {args.assets} assets...")
+    library = FakeLibrary(args.albums, args.assets)
+    immich_server = start_server(library)
+
+    with tempfile.TemporaryDirectory() as directory:
+        server_directory = os.path.join(directory, "server")
+        settings = Settings(write_config(server_directory, {
+            'ImmichServerUrl': f"http://127.0.0.1:{immich_server.server_port}", 'ApiKey': "benchmark",
+            'Albums': list(library.albums)}))
+
+        start = time.perf_counter()
+        database = MasterDatabase(settings)
+        immich = ImmichConnection(settings.ImmichServerUrl, settings.ApiKey)
+        immich.sync_albums(settings.Albums, database.load_album_manifest())
+        database.process_albums(immich)
+        server = RenderServer(os.path.join(server_directory, "render"), args.workers)
+        server.publish(database)
+        server.start("127.0.0.1", 0)
+        print(f"Server synced {len(database.data)} images in {time.perf_counter() - start:.2f}s")
+
+        configs = []
+        for panel in range(args.panels):
+            color = LETTERBOX_COLORS[panel % args.profiles % len(LETTERBOX_COLORS)]
+            configs.append(write_config(os.path.join(directory, f"panel{panel}"), {
+                'RenderServerUrl': f"http://127.0.0.1:{server.http.server_port}", 'Letterbox': True, 'LetterboxColor': color}))
+
+        # the first panels of each profile wait on renders, the rest on the frames those left behind
+        start = time.perf_counter()
+        report("first sync", run_panels(configs), time.perf_counter() - start)
+        start = time.perf_counter()
+        report("no change", run_panels(configs), time.perf_counter() - start)
+
+        server.http.shutdown()
+        server.http.server_close()
+        server.executor.shutdown()
+        database.close()
+    immich_server.shutdown()
+
+parser = argparse.ArgumentParser(description='Benchmark many panels syncing frames from one render server.')
+parser.add_argument('--panels', type=int, default=8)
+parser.add_argument('--profiles', type=int, default=2, help='how many different panel settings the panels are spread over')
+parser.add_argument('--albums', type=int, default=2)
+parser.add_argument('--assets', type=int, default=50, help='assets per album')
+parser.add_argument('--workers', type=int, default=os.cpu_count(), help='render threads on the server')
+parser.add_argument('--child', help=argparse.SUPPRESS)
+
+if __name__ == "__main__":
+    main(parser.parse_args())
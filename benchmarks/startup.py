@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# Compares time to the first frame for a cold start against a "next" sent to a running daemon.
+# Runs offline and without a screen against an already synced config.
+#   python3 benchmarks/startup.py --config config.json [--runs N]
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+SRC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+SCRIPT_PATH = os.path.join(SRC_PATH, "photo-display.py")
+sys.path.insert(0, SRC_PATH)
+from daemon import send_command
+
+def write_config(config, directory, socket_path):
+    with open(config, 'r') as file:
+        settings = json.load(file)
+    # run once and exit for the cold start, the daemon ignores it
+    settings['Settings']['SleepTime'] = 0
+    settings['Settings']['SocketPath'] = socket_path
+    path = os.path.join(directory, "config.json")
+    with open(path, 'w') as file:
+        json.dump(settings, file)
+    return path
+
+def summarize(name, times):
+    times = sorted(times)
+    print(f"{name:8} {len(times)} runs  median={times[len(times) // 2] * 1000:.0f}ms  "
+          f"min={times[0] * 1000:.0f}ms  max={times[-1] * 1000:.0f}ms")
+
+def run_cold(config, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, SCRIPT_PATH, "--config", config, "--offline", "--no-screen"],
+                       check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+def run_daemon(config, socket_path, runs):
+    process = subprocess.Popen([sys.executable, SCRIPT_PATH, "--config", config, "--offline", "--no-screen", "--daemon"],
+                               stdout=subprocess.DEVNULL)
+    try:
+        while not os.path.exists(socket_path):
+            if process.poll() is not None:
+                raise RuntimeError("daemon exited before it started listening")
+            time.sleep(0.05)
+
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            reply = send_command(socket_path, "next")
+            times.append(time.perf_counter() - start)
+            if not reply.startswith("ok"):
+                raise RuntimeError(f"daemon replied {reply}")
+        return times
+    finally:
+        process.terminate()
+        process.wait()
+
+def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        socket_path = os.path.join(directory, "photo_display.sock")
+        config = write_config(args.config, directory, socket_path)
+        summarize("cold", run_cold(config, args.runs))
+        summarize("daemon", run_daemon(config, socket_path, args.runs))
+
+parser = argparse.ArgumentParser(description='Benchmark time to the first frame, cold start against daemon.')
+parser.add_argument('--config', help='config json file of an already synced install', default="./config.json")
+parser.add_argument('--runs', type=int, default=10)
+
+if __name__ == "__main__":
+    main(parser.parse_args())
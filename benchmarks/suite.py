@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# End to end timings against a fake immich server (see fake_immich.py) with a generated library.
+# Runs the same steps as photo-display.py --no-screen, each scenario in its own process so the
+# memory figures start clean, and reports throughput, latency percentiles and peak memory.
+#   python3 benchmarks/suite.py [--albums 3] [--assets 200] [--ticks 10000] [--download-mode preview] [--output results.json]
+#   python3 benchmarks/suite.py --compare before.json after.json
+#
+# Scenarios run in order against the same data directory, each one starting from where the last
+# left it:
+#   first_sync        empty cache, every album downloaded, transformed and rendered
+#   noop_sync         nothing changed on the server
+#   incremental_sync  new assets added to an album
+#   purge             assets taken out of an album
+#   refit_sync        the letterbox colour changed, every cached photo refitted from its master
+#   picker            --ticks picks with the usage written at the end
+#   display_render    frames rendered again from the cached photos
+#   display_cached    frames loaded from the frame cache the way the display loop does
+# The sync scenarios skip the ping, on localhost it only adds a fixed few seconds.
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import argparse
+import tempfile
+import subprocess
+
+BENCHMARK_PATH = os.path.dirname(os.path.abspath(__file__))
+SRC_PATH = os.path.join(BENCHMARK_PATH, "..", "src")
+SCENARIOS = ["first_sync", "noop_sync", "incremental_sync", "purge", "refit_sync", "picker", "display_render", "display_cached"]
+# how many photos the display scenarios go through
+DISPLAY_COUNT = 50
+
+def read_memory_mb(field):
+    with open("/proc/self/status", 'r') as file:
+        for line in file:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    return None
+
+def reset_peak_rss():
+    # linux keeps ru_maxrss across exec, so a child would start out with the parent's peak.
+    # writing 5 to clear_refs resets VmHWM instead
+    try:
+        with open("/proc/self/clear_refs", 'w') as file:
+            file.write("5")
+    except OSError:
+        pass
+
+def max_rss_mb():
+    try:
+        return read_memory_mb("VmHWM")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def percentile(values, share):
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+def asset_latencies(events_file):
+    # seconds each asset spent being prepared, from the profiler events.  convert, identify and
+    # resize happen inside these so arent added again
+    latencies = {}
+    if not os.path.exists(events_file):
+        return []
+    with open(events_file, 'r') as file:
+        for line in file:
+            event = json.loads(line)
+            if event.get('stage') in ("transform", "transform_imagemagick", "refit", "render_frame") and 'asset' in event:
+                latencies[event['asset']] = latencies.get(event['asset'], 0.0) + event['seconds']
+    return list(latencies.values())
+
+def run_sync(settings, database):
+    # sync() from photo-display.py, less the ping
+    from immich_data import ImmichConnection
+    immich = ImmichConnection(settings.ImmichServerUrl, settings.ApiKey)
+    immich.sync_albums(settings.Albums, database.load_album_manifest())
+    database.purge_missing(immich)
+    database.refresh_renders()
+    database.process_albums(immich)
+    database.enforce_cache_budget()
+    database.prepare_frames()
+
+def run_scenario(name, directory, ticks):
+    # runs in the child process
+    sys.path.insert(0, SRC_PATH)
+    from settings import Settings
+    from screen import Screen
+    from profiler import profiler
+    from frame_cache import FrameCache
+    from image_database import ImageDatabase
+    from prefetcher import FramePrefetcher
+
+    events_file = os.path.join(directory, f"{name}.jsonl")
+    profiler.enable(json_file=events_file)
+    settings = Settings(os.path.join(directory, "config.json"))
+    screen = Screen(settings)
+    frame_cache = FrameCache(os.path.join(settings.DataPath, "frames"), screen.resolution, screen.get_palette(), screen.saturation,
+                             settings.get_setting("Dither", "floyd-steinberg"))
+    database = ImageDatabase(settings, screen.resolution, frame_cache)
+    cached = [image_data.file_path for image_data in database.data.values()
+              if image_data.file_path is not None and os.path.exists(image_data.file_path)]
+
+    reset_peak_rss()
+    base_rss = max_rss_mb()
+    latencies = []
+    start = time.perf_counter()
+    if name.endswith("sync"):
+        run_sync(settings, database)
+        latencies = asset_latencies(events_file)
+        items = len(latencies)
+    elif name == "purge":
+        before = len(database.data)
+        run_sync(settings, database)
+        items = before - len(database.data)
+    elif name == "picker":
+        for _ in range(ticks):
+            tick_start = time.perf_counter()
+            database.use_image(database.pick_random_image())
+            latencies.append(time.perf_counter() - tick_start)
+        database.save_changes()
+        items = ticks
+    elif name == "display_render":
+        for file_path in cached[:DISPLAY_COUNT]:
+            tick_start = time.perf_counter()
+            frame_cache.remove(file_path)
+            frame_cache.get(file_path)
+            latencies.append(time.perf_counter() - tick_start)
+        items = len(latencies)
+    elif name == "display_cached":
+        prefetcher = FramePrefetcher(database, frame_cache, 0)
+        for _ in range(min(DISPLAY_COUNT, len(cached))):
+            tick_start = time.perf_counter()
+            prefetcher.next()
+            latencies.append(time.perf_counter() - tick_start)
+        prefetcher.close()
+        items = len(latencies)
+    elapsed = time.perf_counter() - start
+    database.close()
+
+    return {
+        'items': items, 'seconds': round(elapsed, 6),
+        'throughput': round(items / elapsed, 3) if elapsed > 0 and items > 0 else None,
+        'p50_ms': percentile(latencies, 0.5), 'p90_ms': percentile(latencies, 0.9), 'p99_ms': percentile(latencies, 0.99),
+        'memory_mb': round(max_rss_mb() - base_rss, 1), 'peak_memory_mb': round(max_rss_mb(), 1),
+    }
+
+def milliseconds(result):
+    for field in ('p50_ms', 'p90_ms', 'p99_ms'):
+        if result[field] is not None:
+            result[field] = round(result[field] * 1000, 3)
+    return result
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARK_PATH, check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def change_library(name, library, args, config_file):
+    # what happens on the server, or to the settings, before each scenario
+    album_ids = list(library.albums)
+    if name == "incremental_sync":
+        library.add_assets(album_ids[0], max(1, args.assets // 10), shared=0.1)
+    elif name == "purge":
+        library.remove_assets(album_ids[-1], max(1, args.assets // 10))
+    elif name == "refit_sync":
+        with open(config_file, 'r') as file:
+            settings = json.load(file)
+        settings['Settings']['LetterboxColor'] = "black"
+        with open(config_file, 'w') as file:
+            json.dump(settings, file)
+
+def format_value(value, width, precision):
+    return f"{'-':>{width}}" if value is None else f"{value:{width}.{precision}f}"
+
+def print_results(results):
+    print(f"{'scenario':18} {'items':>7} {'seconds':>9} {'per sec':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} "
+          f"{'mem MB':>8} {'peak MB':>8} {'sent MB':>8} requests")
+    for name, result in results['scenarios'].items():
+        requests = " ".join(f"{endpoint}={count}" for endpoint, count in sorted(result['requests'].items()))
+        print(f"{name:18} {result['items']:7} {format_value(result['seconds'], 9, 3)} {format_value(result['throughput'], 9, 1)} "
+              f"{format_value(result['p50_ms'], 9, 2)} {format_value(result['p90_ms'], 9, 2)} {format_value(result['p99_ms'], 9, 2)} "
+              f"{format_value(result['memory_mb'], 8, 1)} {format_value(result['peak_memory_mb'], 8, 1)} "
+              f"{format_value(result.get('sent_mb'), 8, 2)} {requests}")
+
+def compare(before_file, after_file):
+    with open(before_file, 'r') as file:
+        before = json.load(file)
+    with open(after_file, 'r') as file:
+        after = json.load(file)
+    print(f"{before.get('commit')} -> {after.get('commit')}")
+    fields = ['seconds', 'p50_ms', 'p99_ms', 'peak_memory_mb', 'sent_mb']
+    print(f"{'scenario':18} " + " ".join(f"{field:>16}" for field in fields))
+    for name, result in after['scenarios'].items():
+        if name not in before['scenarios']:
+            continue
+        changes = []
+        for field in fields:
+            old, new = before['scenarios'][name].get(field), result.get(field)
+            if old is None or new is None or old == 0:
+                changes.append(f"{'-':>16}")
+            else:
+                changes.append(f"{(new - old) / old * 100:+15.1f}%")
+        print(f"{name:18} " + " ".join(changes))
+
+def main(args):
+    if args.child is not None:
+        print(json.dumps(milliseconds(run_scenario(args.child, args.workdir, args.ticks))))
+        return
+    if args.compare is not None:
+        compare(*args.compare)
+        return
+
+    sys.path.insert(0, BENCHMARK_PATH)
+    from fake_immich import FakeLibrary, start_server
+
+    print(f"Generating {args.albums} albums of {args.assets} assets...")
+    library = FakeLibrary(args.albums, args.assets, args.width, args.height)
+    server = start_server(library)
+    results = {'commit': get_commit(), 'python': platform.python_version(), 'platform': platform.platform(),
+               'albums': args.albums, 'assets': args.assets, 'ticks': args.ticks, 'download_mode': args.download_mode,
+               'scenarios': {}}
+
+    with tempfile.TemporaryDirectory() as directory:
+        settings = {'Settings': {
+            'ImmichServerUrl': f"http://127.0.0.1:{server.server_port}", 'ApiKey': "benchmark",
+            'Albums': list(library.albums), 'SleepTime': 0, 'SaveInterval': 3600, 'DataPath': directory,
+            'ImageCachePath': os.path.join(directory, "photos"), 'ImageDatabaseFile': os.path.join(directory, "photos.db"),
+            'PreferredOrientation': "landscape", 'ForceOrientation': False, 'PreserveAspect': True,
+            'Letterbox': True, 'LetterboxColor': "white", 'DownloadMode': args.download_mode}}
+        with open(os.path.join(directory, "config.json"), 'w') as file:
+            json.dump(settings, file)
+
+        for name in args.scenarios:
+            change_library(name, library, args, os.path.join(directory, "config.json"))
+            requests_before = dict(library.requests)
+            bytes_before = library.bytes_sent
+            print(f"Running {name}...")
+            output = subprocess.run([sys.executable, __file__, "--child", name, "--workdir", directory, "--ticks", str(args.ticks)],
+                                    check=True, stdout=subprocess.PIPE, text=True).stdout
+            result = json.loads(output.splitlines()[-1])
+            result['requests'] = {endpoint: count - requests_before.get(endpoint, 0)
+                                  for endpoint, count in library.requests.items() if count != requests_before.get(endpoint, 0)}
+            result['sent_mb'] = round((library.bytes_sent - bytes_before) / 1024 / 1024, 2)
+            results['scenarios'][name] = result
+
+    server.shutdown()
+    print_results(results)
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"Results written to {args.output}")
+
+parser = argparse.ArgumentParser(description='Benchmark syncing, picking and display preparation against a fake immich server.')
+parser.add_argument('--albums', type=int, default=3)
+parser.add_argument('--assets', type=int, default=200, help='assets per album')
+parser.add_argument('--width', type=int, default=1600)
+parser.add_argument('--height', type=int, default=1200)
+parser.add_argument('--download-mode', choices=['original', 'preview'], default='original', help='the DownloadMode setting for the syncs')
+parser.add_argument('--ticks', type=int, default=10000, help='picks in the picker scenario')
+parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+parser.add_argument('--output', help='write the results as json, to compare against later')
+parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files')
+parser.add_argument('--child', help=argparse.SUPPRESS)
+parser.add_argument('--workdir', help=argparse.SUPPRESS)
+
+if __name__ == "__main__":
+    main(parser.parse_args())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# Compares the in process pillow transform against the imagemagick subprocess path.
+#   python3 benchmarks/transform.py [--images N] [--size WxH] [--screen WxH]
+import os
+import sys
+import time
+import shutil
+import resource
+import argparse
+import tempfile
+import subprocess
+
+SRC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_PATH)
+
+def parse_size(value):
+    width, height = map(int, value.split('x'))
+    return (width, height)
+
+def make_images(directory, count, size):
+    from PIL import Image, ImageDraw
+    for i in range(count):
+        image = Image.new('RGB', size, (i * 37 % 255, 120, 200))
+        draw = ImageDraw.Draw(image)
+        for j in range(0, size[0], 64):
+            draw.line([(j, 0), (size[0] - j, size[1])], fill=(j % 255, 255 - j % 255, 80), width=9)
+        image.save(os.path.join(directory, f"image_{i}.jpg"), quality=92)
+
+def run_pillow(files, screen):
+    from screen import ScreenResolution
+    from image_transform import transform_image
+    target = ScreenResolution(list(screen))
+    for file in files:
+        transform_image(file, file, target, lambda resolution: None, preserve_aspect=True, letterbox_color="white")
+
+def run_imagemagick(files, screen):
+    resolution = f"{screen[0]}x{screen[1]}"
+    for file in files:
+        # the same three subprocesses that ImageDatabase runs per image
+        subprocess.check_output(['convert', file, "-auto-orient", "-strip", file])
+        subprocess.check_output(['identify', '-format', '%w %h', file])
+        subprocess.run(['convert', file, '-strip', '-auto-orient', '-resize', resolution + '>',
+                        '-background', 'white', '-gravity', 'center', '-extent', resolution, file], check=True)
+
+def run_child(args):
+    files = sorted(os.path.join(args.dir, name) for name in os.listdir(args.dir))
+    start = time.perf_counter()
+    if args.run == "pillow":
+        run_pillow(files, parse_size(args.screen))
+    else:
+        run_imagemagick(files, parse_size(args.screen))
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss is in KiB on linux.  children covers the imagemagick processes
+    own_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    print(f"{args.run:12} {len(files)} images in {elapsed:.2f}s ({elapsed / len(files) * 1000:.0f}ms/image) "
+          f"peak rss self={own_rss / 1024:.1f}MiB children={child_rss / 1024:.1f}MiB")
+
+def main(args):
+    if args.run is not None:
+        run_child(args)
+        return
+
+    work_dir = tempfile.mkdtemp(prefix="photo-display-bench-")
+    try:
+        source_dir = os.path.join(work_dir, "source")
+        os.mkdir(source_dir)
+        make_images(source_dir, args.images, parse_size(args.size))
+
+        engines = ["pillow"]
+        if shutil.which("convert") is not None:
+            engines.append("imagemagick")
+        else:
+            print("ImageMagick not found, skipping the subprocess path")
+
+        # each engine gets a fresh copy and a fresh process so peak rss is its own
+        for engine in engines:
+            engine_dir = os.path.join(work_dir, engine)
+            shutil.copytree(source_dir, engine_dir)
+            subprocess.run([sys.executable, __file__, "--run", engine, "--dir", engine_dir, "--screen", args.screen], check=True)
+    finally:
+        shutil.rmtree(work_dir)
+
+parser = argparse.ArgumentParser(description='Benchmark the pillow and imagemagick transform paths.')
+parser.add_argument('--images', type=int, default=10)
+parser.add_argument('--size', default="4032x3024")
+parser.add_argument('--screen', default="600x448")
+parser.add_argument('--run', choices=["pillow", "imagemagick"], default=None, help=argparse.SUPPRESS)
+parser.add_argument('--dir', default=None, help=argparse.SUPPRESS)
+
+if __name__ == "__main__":
+    main(parser.parse_args())
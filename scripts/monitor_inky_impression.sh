@@ -21,11 +21,36 @@ PHOTO_CHANGE_NAME="photo-display-update" # btn_a
 PHOTO_SYNC_NAME="photo-display-sync" # btn_b
 NETWORKING_NAME="NetworkManager" # btn_b
 
+# socket of photo-display running with --daemon.  the daemon reads the buttons itself (see Buttons
+# in the readme), so when it is there the buttons are left to it.  taken from SocketPath in the
+# config given as the first argument, ./config.json by default, the same as the daemon does
+CONFIG_FILE="${1:-./config.json}"
+DAEMON_SOCKET=$(python3 - "$CONFIG_FILE" <<'END'
+import sys, json
+try:
+    with open(sys.argv[1]) as file:
+        print(json.load(file).get('Settings', {}).get('SocketPath') or "/tmp/photo_display.sock")
+except (OSError, ValueError):
+    print("/tmp/photo_display.sock")
+END
+)
+
+daemon_handles_buttons() {
+    if [ -S "$DAEMON_SOCKET" ]; then
+        echo "The photo display daemon handles the buttons"
+        return 0
+    fi
+    return 1
+}
+
 handle_btn_a() {
     local value=$1
     echo "Button A value is $value."
 
     if [ "$value" -eq 1 ]; then
+        if daemon_handles_buttons; then
+            return
+        fi
         if ! systemctl is-active --quiet "$PHOTO_CHANGE_NAME" && ! systemctl is-active --quiet "$PHOTO_SYNC_NAME"; then
             echo "Starting $PHOTO_CHANGE_NAME because btn_a value is 1"
             systemctl start "$PHOTO_CHANGE_NAME"
@@ -40,6 +65,9 @@ handle_btn_b() {
     echo "Button B value is $value."
 
     if [ "$value" -eq 1 ]; then
+        if daemon_handles_buttons; then
+            return
+        fi
         if ! systemctl is-active --quiet "$PHOTO_CHANGE_NAME" && ! systemctl is-active --quiet "$PHOTO_SYNC_NAME"; then
             echo "Starting $PHOTO_SYNC_NAME because btn_b value is 1"
             systemctl start "$PHOTO_SYNC_NAME"
@@ -54,6 +82,7 @@ handle_btn_c() {
     echo "Button C value is $value."
 
     # TODO: add custom logic here
+    # e.g. pause the slideshow with a Buttons entry when running with --daemon
 }
 
 handle_btn_d() {
@@ -61,6 +90,9 @@ handle_btn_d() {
     echo "Button D value is $value."
     
     if [ "$value" -eq 1 ]; then
+        if daemon_handles_buttons; then
+            return
+        fi
         if ! systemctl is-active --quiet "$NETWORKING_NAME"; then
             echo "Starting $NETWORKING_NAME because btn_d value is 1"
             systemctl start "$NETWORKING_NAME"
@@ -25,6 +25,10 @@ hourly_unit_file="$systemd_directory/photo-display-update.service"
 daily_unit_file="$systemd_directory/photo-display-sync.service"
 hourly_timer_file="$systemd_directory/photo-display-update.timer"
 daily_timer_file="$systemd_directory/photo-display-sync.timer"
+daemon_unit_file="$systemd_directory/photo-display-daemon.service"
+daemon_script="$current_directory/run.sh --daemon"
+network_service="NetworkManager"
+network_rule_file="/etc/polkit-1/rules.d/50-photo-display-network.rules"
 
 install_driver() {
     
@@ -111,6 +115,7 @@ install_application() {
     # Install dependencies
     pip3 install inky[rpi,example-depends] >> /dev/null
     pip3 install Pillow >> /dev/null
+    pip3 install pillow-heif >> /dev/null
     pip3 install requests >> /dev/null
     pip3 install tqdm >> /dev/null
     pip3 install wheel >> /dev/null
@@ -231,6 +236,48 @@ WantedBy=timers.target
     #sudo systemctl start photo-display-sync.service
 }
 
+generate_daemon_service() {
+
+    daemon_unit_content="[Unit]
+Description=Photo Display daemon that keeps running and changes and syncs photos on a schedule
+After=network.target
+
+[Service]
+WorkingDirectory=$current_directory
+ExecStart=$daemon_script
+Type=simple
+Restart=on-failure
+User=$current_user
+
+[Install]
+WantedBy=multi-user.target
+"
+
+    # Write the unit content to the unit file
+    echo "Creating systemd service"
+    echo "$daemon_unit_content" | sudo tee "$daemon_unit_file" > /dev/null
+
+    echo "Reloading systemd daemon"
+    sudo systemctl daemon-reload
+
+    # the daemon isnt root, so let it start the network for the btn_d "network" action the way
+    # the root button monitor used to
+    network_rule_content="polkit.addRule(function(action, subject) {
+    if (action.id == \"org.freedesktop.systemd1.manage-units\" &&
+        action.lookup(\"unit\") == \"$network_service.service\" &&
+        action.lookup(\"verb\") == \"start\" &&
+        subject.user == \"$current_user\") {
+        return polkit.Result.YES;
+    }
+});
+"
+    echo "Allowing $current_user to start $network_service"
+    echo "$network_rule_content" | sudo tee "$network_rule_file" > /dev/null
+
+    echo "Starting daemon"
+    sudo systemctl enable --now photo-display-daemon.service
+}
+
 remove_systemd_service() {
 
     echo "Removing systemd services and timers"
@@ -238,16 +285,20 @@ remove_systemd_service() {
     sudo systemctl stop button-monitor.service
     sudo systemctl stop photo-display-update.timer
     sudo systemctl stop photo-display-sync.timer
+    sudo systemctl stop photo-display-daemon.service
 
     sudo systemctl disable button-monitor.service
     sudo systemctl disable photo-display-update.timer
     sudo systemctl disable photo-display-sync.timer
+    sudo systemctl disable photo-display-daemon.service
 
     sudo rm -f $monitor_file
     sudo rm -f $hourly_timer_file
     sudo rm -f $daily_timer_file
     sudo rm -f $hourly_unit_file
     sudo rm -f $daily_unit_file
+    sudo rm -f $daemon_unit_file
+    sudo rm -f $network_rule_file
 
     echo "Reloading systemd daemon"
     systemctl daemon-reload
@@ -265,10 +316,17 @@ if [[ "$1" == "install" ]]; then
         generate_systemd_service
         echo "Systemd service created."
         echo "Make sure to edit your config to have a SleepTime of 0!"
+    elif [[ "$2" == "daemon" ]]; then
+        generate_daemon_service
+        echo "Daemon service created."
+        echo "SleepTime sets how often the photo changes and SyncInterval how often it syncs with immich."
     fi
 
-    generate_monitor_service
-    echo "Button Monitor service created."
+    # the daemon listens for the buttons itself
+    if [[ "$2" != "daemon" ]]; then
+        generate_monitor_service
+        echo "Button Monitor service created."
+    fi
 
     sleep 3
     echo "Setup complete."
@@ -283,5 +341,6 @@ else
     echo "Usage: $0 [install|uninstall]"
     echo "          optionally [install cron] to setup as a cron job"
     echo "          optionally [install systemd] to setup as a systemd service"
+    echo "          optionally [install daemon] to setup as a long running systemd service"
     exit 1
 fi
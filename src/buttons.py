@@ -0,0 +1,131 @@
+import os
+import time
+import select
+import threading
+import subprocess
+
+# where inky-impression-btn-driver puts its attributes
+DEFAULT_BUTTON_PATH = "/sys/kernel/inky-impression"
+DEFAULT_BUTTONS = {'btn_a': "next", 'btn_b': "sync", 'btn_d': "network"}
+
+# seconds between reading every button when the driver doesnt notify on a change.  a tap shorter
+# than this can be missed that way
+POLL_INTERVAL = 0.05
+# once the driver has shown it notifies, reading every button is only a safety net
+NOTIFIED_POLL_INTERVAL = 5.0
+# presses of the same button closer together than this are contact bounce
+DEBOUNCE = 0.3
+
+class ButtonListener:
+    """
+    Watches the button attributes in a sysfs directory and calls on_press(button, detected_at) on
+    a button going to 1.  detected_at is time.monotonic() when the change was seen.
+
+    The attributes stay open and are waited on with poll, which wakes the moment a driver that
+    calls sysfs_notify changes one.  Nothing says whether a driver does, and plain files (a fake
+    directory in a benchmark) never wake poll, so every button is also read each poll_interval.
+    Runs on its own thread.  on_press is called from it and should hand the work off rather than
+    do it there.
+    """
+
+    def __init__(self, directory, buttons, on_press, poll_interval = POLL_INTERVAL, debounce = DEBOUNCE):
+        self.directory = directory
+        self.on_press = on_press
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.files = {}       # fd -> button
+        self.values = {}      # button -> last value read
+        self.last_press = {}  # button -> monotonic time of the last press acted on
+        self.notified = False
+        self.thread = None
+        # stop writes to this so it doesnt wait out a poll
+        self.wake_read, self.wake_write = os.pipe()
+
+        for button in buttons:
+            try:
+                fd = os.open(os.path.join(directory, button), os.O_RDONLY | os.O_NONBLOCK)
+            except OSError as e:
+                print(f"Unable to watch button {button}: {e}")
+                continue
+            self.files[fd] = button
+            self.values[button] = self.read(fd)
+
+    @staticmethod
+    def read(fd):
+        # pread from the start is a fresh read of a sysfs attribute and rearms its notification
+        try:
+            return os.pread(fd, 16, 0).strip()
+        except OSError:
+            return None
+
+    def check(self, fd, detected_at):
+        button = self.files[fd]
+        value = self.read(fd)
+        if value is None or value == self.values[button]:
+            return
+        self.values[button] = value
+        if value != b"1":
+            return
+        last_press = self.last_press.get(button)
+        if last_press is not None and detected_at - last_press < self.debounce:
+            return
+        self.last_press[button] = detected_at
+        try:
+            self.on_press(button, detected_at)
+        except Exception as e:
+            print(f"Button {button} failed: {e}")
+
+    def run(self):
+        poller = select.poll()
+        for fd in self.files:
+            poller.register(fd, select.POLLPRI | select.POLLERR)
+        poller.register(self.wake_read, select.POLLIN)
+
+        while True:
+            interval = NOTIFIED_POLL_INTERVAL if self.notified else self.poll_interval
+            events = poller.poll(interval * 1000)
+            detected_at = time.monotonic()
+            if any(fd == self.wake_read for fd, _ in events):
+                return
+            if len(events) > 0:
+                self.notified = True
+                for fd, _ in events:
+                    self.check(fd, detected_at)
+            else:
+                for fd in self.files:
+                    self.check(fd, detected_at)
+
+    def start(self):
+        if len(self.files) == 0:
+            return False
+        self.thread = threading.Thread(target=self.run, name="buttons", daemon=True)
+        self.thread.start()
+        print(f"Listening for {', '.join(self.values)} in {self.directory}")
+        return True
+
+    def stop(self):
+        if self.thread is not None:
+            os.write(self.wake_write, b"x")
+            self.thread.join()
+            self.thread = None
+        for fd in list(self.files) + [self.wake_read, self.wake_write]:
+            os.close(fd)
+        self.files = {}
+
+def start_network(service = "NetworkManager"):
+    # runs on its own thread so bringing the network up doesnt hold up the other buttons.  the
+    # daemon isnt root, so this needs the polkit rule setup.sh installs with it
+    def run():
+        try:
+            if subprocess.run(["systemctl", "is-active", "--quiet", service]).returncode == 0:
+                print(f"{service} is already running")
+                return
+            print(f"Starting {service}")
+            result = subprocess.run(["systemctl", "start", "--no-ask-password", service],
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        except OSError as e:
+            print(f"Unable to start {service}: {e}")
+            return
+        if result.returncode != 0:
+            print(f"Unable to start {service}: {result.stderr.strip() or f'systemctl exited with {result.returncode}'}")
+    threading.Thread(target=run, name="network", daemon=True).start()
@@ -0,0 +1,193 @@
+import os
+import sys
+import time
+import signal
+import queue
+import socket
+import threading
+import socketserver
+
+from profiler import profiler
+
+# longest the main thread blocks before checking for signals
+MAX_WAIT = 1.0
+
+class Scheduler:
+    """
+    Runs named jobs on fixed intervals.  Jobs can be paused, resumed or run early.
+    Everything happens on the thread calling run_pending.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+
+    def add_job(self, name, interval, callback, delay = 0):
+        self.jobs[name] = {'interval': interval, 'callback': callback, 'next_run': time.monotonic() + delay, 'paused': False}
+
+    def pause(self, name):
+        self.jobs[name]['paused'] = True
+
+    def resume(self, name):
+        job = self.jobs[name]
+        if job['paused']:
+            job['paused'] = False
+            job['next_run'] = time.monotonic() + job['interval']
+
+    def is_paused(self, name):
+        return self.jobs[name]['paused']
+
+    def time_until_next(self):
+        now = time.monotonic()
+        waits = [job['next_run'] - now for job in self.jobs.values() if not job['paused']]
+        if len(waits) == 0:
+            return None
+        return max(0, min(waits))
+
+    def run_job(self, name):
+        # runs even when paused.  returns False if the job raised
+        job = self.jobs[name]
+        succeeded = True
+        try:
+            job['callback']()
+        except Exception as e:
+            print(f"Job {name} failed: {e}")
+            succeeded = False
+        # the interval counts from when the job finished so a slow sync doesnt pile up runs
+        job['next_run'] = time.monotonic() + job['interval']
+        return succeeded
+
+    def run_pending(self):
+        for name, job in self.jobs.items():
+            if not job['paused'] and job['next_run'] <= time.monotonic():
+                self.run_job(name)
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        command = self.rfile.readline().decode('utf-8').strip()
+        if len(command) == 0:
+            return
+        reply = self.server.daemon.submit(command)
+        self.wfile.write(f"{reply}\n".encode('utf-8'))
+
+class CommandServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class PhotoDaemon:
+    """
+    Keeps everything loaded between photos and runs display and sync as scheduled jobs.
+
+    Commands ("next", "sync", "pause", "resume", "status") arrive over a unix socket, or from the
+    buttons through post, and are handed to the scheduler thread, so the database and screen are
+    only ever used from one thread.
+    """
+
+    COMMANDS = ["next", "sync", "pause", "resume", "status"]
+
+    def __init__(self, socket_path, display, sync = None, display_interval = 3600, sync_interval = 86400):
+        self.socket_path = socket_path
+        self.commands = queue.Queue()
+        self.posted = set()    # commands posted and not yet run
+        self.posted_lock = threading.Lock()
+        # the first frame and sync have already happened at startup
+        self.scheduler = Scheduler()
+        self.scheduler.add_job("display", display_interval, display, delay=display_interval)
+        if sync is not None:
+            self.scheduler.add_job("sync", sync_interval, sync, delay=sync_interval)
+
+    def submit(self, command):
+        # called from socket threads.  waits for the scheduler thread to run the command
+        reply_queue = queue.Queue(maxsize=1)
+        self.commands.put((command, reply_queue, time.monotonic()))
+        return reply_queue.get()
+
+    def post(self, command, received = None):
+        # called from the button thread.  doesnt wait for the command, and a command already
+        # waiting to run isnt queued again, so presses during a long refresh dont stack up
+        with self.posted_lock:
+            if command in self.posted:
+                return False
+            self.posted.add(command)
+        self.commands.put((command, None, time.monotonic() if received is None else received))
+        return True
+
+    def handle_command(self, command, received):
+        if command == "next" or command == "sync":
+            job = "display" if command == "next" else "sync"
+            if job not in self.scheduler.jobs:
+                return "error running offline"
+            # running a job early restarts its interval
+            if not self.scheduler.run_job(job):
+                return f"error {command} failed"
+            # time from the command arriving to the job finishing, for "next" that is the frame on screen
+            elapsed = time.monotonic() - received
+            profiler.record(f"command_{command}", elapsed)
+            return f"ok {elapsed:.3f}s"
+        elif command == "pause":
+            self.scheduler.pause("display")
+            return "ok"
+        elif command == "resume":
+            self.scheduler.resume("display")
+            return "ok"
+        elif command == "status":
+            paused = self.scheduler.is_paused("display")
+            return f"ok {'paused' if paused else 'running'}"
+        return f"error unknown command {command}"
+
+    def start_server(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server = CommandServer(self.socket_path, CommandHandler)
+        server.daemon = self
+        os.chmod(self.socket_path, 0o660)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Listening for commands on {self.socket_path}")
+        return server
+
+    def stop(self, signum = None, frame = None):
+        # systemd stops us with SIGTERM.  exiting through the main thread cleans up the socket and lock
+        sys.exit(0)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        server = self.start_server()
+        try:
+            while True:
+                try:
+                    # a signal that lands as the wait starts is only handled once the wait ends, so keep waits short
+                    wait = self.scheduler.time_until_next()
+                    timeout = MAX_WAIT if wait is None else min(wait, MAX_WAIT)
+                    command, reply_queue, received = self.commands.get(timeout=timeout)
+                    print(f"Received command {command}")
+                    if reply_queue is None:
+                        # posted, so a press now can queue it again
+                        with self.posted_lock:
+                            self.posted.discard(command)
+                    try:
+                        reply = self.handle_command(command, received)
+                    except Exception as e:
+                        reply = f"error {e}"
+                    if reply_queue is not None:
+                        reply_queue.put(reply)
+                    else:
+                        print(f"Command {command}: {reply}")
+                except queue.Empty:
+                    pass
+                self.scheduler.run_pending()
+        finally:
+            server.shutdown()
+            server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+def send_command(socket_path, command, timeout = 600):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(socket_path)
+        client.sendall(f"{command}\n".encode('utf-8'))
+        reply = b''
+        while not reply.endswith(b'\n'):
+            data = client.recv(4096)
+            if len(data) == 0:
+                break
+            reply += data
+    return reply.decode('utf-8').strip()
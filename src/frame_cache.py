@@ -0,0 +1,96 @@
+import os
+import struct
+import hashlib
+from PIL import Image
+
+from screen import ScreenResolution
+from quantizer import Quantizer
+
+FRAME_MAGIC = b'PDF1'
+FRAME_HEADER = struct.Struct('<4sHH')
+FRAME_EXTENSION = ".frame"
+
+class FrameCache:
+    """
+    Display ready frames for the panel.
+
+    A frame is the cached image resized to the exact panel resolution and quantized to the
+    panel palette, stored as packed 4 bit palette indices.  The inky driver takes a "P" image
+    as is, so showing a frame is a file read and a push to the screen.  Frame names carry the
+    resolution, saturation, dither mode and palette so changing any of them misses the old frames.
+    """
+
+    def __init__(self, directory, resolution : ScreenResolution, palette, saturation, dither = "floyd-steinberg"):
+        self.directory = directory
+        self.resolution = resolution
+        self.palette = list(palette)
+        self.saturation = saturation
+        self.quantizer = Quantizer(self.palette, dither)
+
+        palette_hash = hashlib.sha1(bytes(self.palette)).hexdigest()[:8]
+        self.key = f"{resolution.resolution_string}-s{saturation:g}-{dither}-{palette_hash}"
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get_frame_path(self, image_path):
+        return os.path.join(self.directory, f"{os.path.basename(image_path)}.{self.key}{FRAME_EXTENSION}")
+
+    def render(self, image_path, image : Image = None) -> Image:
+        # image, when given, is used in place of reading image_path.  the frame is still named after image_path
+        if image is None:
+            with Image.open(image_path) as source:
+                image = source.convert('RGB')
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        image = image.resize(tuple(self.resolution.resolution))
+        frame = self.quantizer.quantize(image)
+
+        data = FRAME_HEADER.pack(FRAME_MAGIC, frame.width, frame.height) + frame.tobytes('raw', 'P;4')
+        frame_path = self.get_frame_path(image_path)
+        temp_path = f"{frame_path}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, frame_path)
+        return frame
+
+    def load(self, image_path) -> Image:
+        frame_path = self.get_frame_path(image_path)
+        try:
+            with open(frame_path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+
+        magic, width, height = FRAME_HEADER.unpack_from(data)
+        if magic != FRAME_MAGIC or (width, height) != tuple(self.resolution.resolution):
+            print(f"Ignoring invalid frame {frame_path}")
+            return None
+
+        frame = Image.frombytes('P', (width, height), data[FRAME_HEADER.size:], 'raw', 'P;4')
+        frame.putpalette(self.palette)
+        return frame
+
+    def get(self, image_path) -> Image:
+        frame = self.load(image_path)
+        if frame is None:
+            print(f"Rendering frame for {image_path}")
+            frame = self.render(image_path)
+        return frame
+
+    def remove(self, image_path):
+        # frames for other keys are left to remove_stale
+        frame_path = self.get_frame_path(image_path)
+        if os.path.exists(frame_path):
+            os.remove(frame_path)
+
+    def remove_stale(self):
+        # frames rendered for another resolution, saturation or palette
+        suffix = f".{self.key}{FRAME_EXTENSION}"
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(suffix):
+                os.remove(os.path.join(self.directory, filename))
+                print(f"Removed stale frame {filename}")
+
+    def clear(self):
+        for filename in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, filename))
@@ -13,4 +13,25 @@ class Orientation(Enum):
             raise ValueError(f"Unknown orientation: {s}")
 
     def __str__(self):
-        return self.value
\ No newline at end of file
+        return self.value
+
+def get_rotation(asset_orientation : Orientation, target_orientation : Orientation, preferred_orientation : Orientation, force_orientation):
+    # the imagemagick rotation needed to bring an image of asset_orientation onto a screen of target_orientation
+    if force_orientation:
+        if preferred_orientation == Orientation.LANDSCAPE and target_orientation == Orientation.PORTRAIT:
+            if asset_orientation == Orientation.LANDSCAPE:
+                return "-90"
+            if asset_orientation == Orientation.PORTRAIT:
+                return "-90"
+        elif preferred_orientation == Orientation.PORTRAIT and target_orientation == Orientation.LANDSCAPE:
+            if asset_orientation == Orientation.LANDSCAPE:
+                return "-90"
+            if asset_orientation == Orientation.PORTRAIT:
+                return "-90"
+    else:
+        # Rotate based on current and target orientation
+        if target_orientation == Orientation.LANDSCAPE and asset_orientation == Orientation.PORTRAIT:
+            return "90"
+        elif target_orientation == Orientation.PORTRAIT and asset_orientation == Orientation.LANDSCAPE:
+            return "-90"
+    return None
@@ -1,35 +1,67 @@
+import gc
 import os
-import csv
+import sys
+import time
+import calendar
+import base64
 import random
-import zipfile
-import tempfile
+import shutil
 import subprocess
-from tqdm import tqdm
 from datetime import datetime
 
-from immich_data import ImmichConnection, ImmichAlbum, ImmichAssetData
+from immich_data import ImmichConnection, ImmichAlbum, ImmichAssetData, RENDITION_SIZES
+from image_store import ImageStore
+from frame_cache import FrameCache
+from weighted_picker import WeightedPicker, EPOCH_SECONDS, to_hours, seconds_to_hours
 from settings import Settings
 from screen import ScreenResolution
-from helpers import Orientation
+from helpers import Orientation, get_rotation
+from profiler import profiler
+
+# how many times pick_random_image rerolls when it lands on an excluded image
+PICK_ATTEMPTS = 8
+
+ORIENTATIONS = {orientation.value: orientation for orientation in Orientation}
+
+def local_seconds():
+    # the database keeps local times, counted as if they were utc so they match what sqlite hands back
+    return calendar.timegm(time.localtime())
 
 class ImageData:
-    def __init__(self, album_id, asset_id, file_path = None, last_used_date = '1993-12-29 00:00:00', use_count = '0'):
+    # there is one of these for every photo in every album and all of them stay loaded
+    __slots__ = ['album_id', 'asset_id', 'file_path', 'last_used', 'use_count', 'orientation', 'evicted', 'render_key']
+
+    def __init__(self, album_id, asset_id, file_path = None, last_used = EPOCH_SECONDS, use_count = 0, orientation = None, evicted = 0,
+                 render_key = None):
         self.album_id = album_id
         self.asset_id = asset_id
         self.file_path = file_path
-        self.last_used_date = datetime.strptime(last_used_date, '%Y-%m-%d %H:%M:%S')
-        self.use_count = int(use_count)
+        # seconds, see local_seconds.  the store turns it into date text and back
+        self.last_used = last_used
+        self.use_count = use_count
+        self.orientation = ORIENTATIONS.get(orientation)
+        # known but not cached.  the file was removed to keep the cache in budget
+        self.evicted = bool(evicted)
+        # the screen settings file_path was made for, see ImageDatabase.get_render_key
+        self.render_key = render_key
 
     def to_list(self):
         return [self.album_id, 
                 self.asset_id, 
                 self.file_path, 
-                self.last_used_date.strftime('%Y-%m-%d %H:%M:%S'), 
-                self.use_count]
+                self.last_used, 
+                self.use_count,
+                self.orientation.value if self.orientation is not None else None,
+                int(self.evicted),
+                self.render_key]
 
     @classmethod
     def from_list(cls, data):
-        return cls(*data)
+        # album ids repeat across every row of the album, so share one string between them
+        album_id, asset_id, file_path, last_used, use_count, orientation, evicted, render_key = data
+        # every row made for the same settings has the same key, so that is shared too
+        return cls(sys.intern(album_id), asset_id, file_path, last_used, use_count, orientation, evicted,
+                   sys.intern(render_key) if render_key is not None else None)
     
     def enforce_exif_rotation(self, force_jpg):
 
@@ -40,7 +72,9 @@ class ImageData:
             command.append(self.file_path + ".jpg")
         else:
             command.append(self.file_path)
-        command_output = subprocess.check_output(command, universal_newlines=True)
+        profiler.count("subprocesses")
+        with profiler.stage("convert", asset=self.asset_id):
+            command_output = subprocess.check_output(command, universal_newlines=True)
 
         if force_jpg:
             os.remove(self.file_path) # remove the old file type because it wasnt replaced during the command
@@ -51,54 +85,127 @@ class ImageData:
     def get_resolution(self) -> ScreenResolution:
         # Use the identify command to get image dimensions
         identify_command = ['identify', '-format', '%w %h', self.file_path]
-        identify_output = subprocess.check_output(identify_command, universal_newlines=True)
+        profiler.count("subprocesses")
+        with profiler.stage("identify", asset=self.asset_id):
+            identify_output = subprocess.check_output(identify_command, universal_newlines=True)
         width, height = map(int, identify_output.split())
         return ScreenResolution([width, height])
 
     def calculate_weight(self, now : datetime):
-        time_difference = now - self.last_used_date
-        hours = time_difference.total_seconds() / 3600 
+        hours = to_hours(now) - seconds_to_hours(self.last_used)
         weight = (1 + hours) / (1 + self.use_count) 
         return weight
    
     # mark the image as used so we can track it
     def mark_used(self):
-        current_datetime = datetime.now()
-        self.last_used_date = current_datetime
+        self.last_used = local_seconds()
         self.use_count = self.use_count + 1
 
-    def get_orientation(self, asset_info : ImmichAssetData) -> Orientation:
-
-        if asset_info is not None:
-            exif_info = asset_info.asset_dict["exifInfo"]
-            if exif_info is not None:
-                value = exif_info["orientation"]
-                if value is not None:
-                    if value in [1, 2, 3, 4]:
-                        return Orientation.LANDSCAPE
-                    elif value in [5, 6, 7, 8]:
-                        return Orientation.PORTRAIT
+    # resolved once and then kept in the database so we never have to look it up again
+    def get_orientation(self, asset_info : ImmichAssetData, resolution : ScreenResolution = None) -> Orientation:
+        if self.orientation is None:
+            self.orientation = ImageData.get_exif_orientation(asset_info)
 
         # if not part of the asset data, return based on the resolution
-        resolution = self.get_resolution()
-        return resolution.orientation
+        if self.orientation is None:
+            if resolution is None:
+                resolution = self.get_resolution()
+            self.orientation = resolution.orientation
+        return self.orientation
+
+    @staticmethod
+    def get_exif_orientation(asset_info : ImmichAssetData) -> Orientation:
+        if asset_info is None:
+            return None
+
+        # immich sends the exif orientation as a string, and manifests keep it as it came
+        try:
+            value = int(asset_info.orientation)
+        except (TypeError, ValueError):
+            return None
+        if value in [1, 2, 3, 4]:
+            return Orientation.LANDSCAPE
+        elif value in [5, 6, 7, 8]:
+            return Orientation.PORTRAIT
+        return None
 
 
 class ImageDatabase:
-    def __init__(self, settings : Settings, target_resolution : ScreenResolution):
+    # subclasses whose photos are masters already turn this off
+    KEEP_MASTERS = True
+
+    def __init__(self, settings : Settings, target_resolution : ScreenResolution, frame_cache : FrameCache = None):
         self.settings = settings
+        self.frame_cache = frame_cache
         self.database_file = settings.ImageDatabaseFile
         self.image_directory = settings.ImageCachePath
-        self.data = []
+
+        # images keyed by (album_id, asset_id).  dirty/deleted track what save_changes needs to write
+        self.data = {}
+        self.dirty = set()
+        self.deleted = set()
+
+        # cached images the display picks from, and evicted ones that only get picked to be fetched again
+        self.picker = WeightedPicker()
+        self.evicted_picker = WeightedPicker()
+
+        # album_id -> asset ids we have rows for, and the rows still waiting on a file.  these let a
+        # sync work on just what changed instead of scanning every image
+        self.album_index = {}
+        self.pending = set()
+        # albums with images that failed in this sync, see save_album_manifest
+        self.incomplete_albums = set()
+
+        # several rows can share one cached file when a photo is in more than one album.
+        # file_path -> keys of the rows using it, and key -> the file_path it is counted under.
+        # almost every file has a single row so the keys are a list, a set per file costs far more
+        self.file_rows = {}
+        self.row_files = {}
 
         self.target_resolution = target_resolution
+        # how photos are fitted to target_resolution
+        self.preserve_aspect = settings.PreserveAspect
+        self.letterbox_color = settings.LetterboxColor if settings.Letterbox else None
+
+        # an upright copy of every cached photo no bigger than MasterResolution, so a change to the
+        # screen settings refits photos from here instead of downloading them again
+        self.master_directory = None
+        if self.KEEP_MASTERS and settings.get_setting("KeepMasters", True):
+            self.master_directory = os.path.join(self.image_directory, "masters")
+        self.master_resolution = ScreenResolution(settings.get_setting("MasterResolution", [1600, 1600]))
+        if self.master_directory is not None:
+            os.makedirs(self.master_directory, exist_ok=True)
+
+        # showing a photo only changes its usage, so those saves are held back and written together
+        self.save_interval = settings.get_setting("SaveInterval", 900)
+        self.last_save = time.monotonic()
 
-        # If the file doesn't exist, create an empty DataFrame as our header using ImageData members 
         if not os.path.exists(self.database_file):
             print("Creating database at ", self.database_file)
-            self.save_changes()
-        else:
-            self.load_data()
+        self.store = ImageStore(self.database_file)
+        self.load_data()
+
+    # everything that decides how a cached photo is fitted to the screen.  rows made with another key are stale
+    def get_render_key(self):
+        return (f"{self.target_resolution.resolution_string}-{self.settings.get_preferred_orientation().name.lower()}-"
+                f"{int(bool(self.settings.ForceOrientation))}-{int(bool(self.preserve_aspect))}-{self.letterbox_color}")
+
+    def get_master_path(self, file_path):
+        # masters are always jpeg.  None when masters arent kept
+        if self.master_directory is None:
+            return None
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        return os.path.join(self.master_directory, name + ".jpg")
+
+    def get_master_edge(self):
+        # masters are never smaller than the screen, or refitting them would lose detail
+        return max(self.master_resolution.width, self.master_resolution.height,
+                   self.target_resolution.width, self.target_resolution.height)
+
+    # the imagemagick rotation needed to bring an image of asset_orientation onto the screen
+    def get_rotation(self, asset_orientation : Orientation):
+        return get_rotation(asset_orientation, self.target_resolution.orientation,
+                            self.settings.get_preferred_orientation(), self.settings.ForceOrientation)
 
     def get_resize_command(self, image_data : ImageData, asset_info : ImmichAssetData = None):
         command = [
@@ -109,39 +216,19 @@ class ImageDatabase:
         ]
 
         # handle needed rotations
-        asset_orientation = image_data.get_orientation(asset_info)
-        preferred_orientation = self.settings.get_preferred_orientation()
-        target_orientation = self.target_resolution.orientation
-
-
-        if self.settings.ForceOrientation:
-            
-            if preferred_orientation == Orientation.LANDSCAPE and target_orientation == Orientation.PORTRAIT:
-                if asset_orientation == Orientation.LANDSCAPE:
-                    command.extend(['-rotate', "-90"])
-                if asset_orientation == Orientation.PORTRAIT:
-                    command.extend(['-rotate', "-90"])
-            elif preferred_orientation == Orientation.PORTRAIT and target_orientation == Orientation.LANDSCAPE:
-                if asset_orientation == Orientation.LANDSCAPE:
-                    command.extend(['-rotate', "-90"])
-                if asset_orientation == Orientation.PORTRAIT:
-                    command.extend(['-rotate', "-90"])
-        else:
-            # Rotate based on current and target orientation
-            if target_orientation == Orientation.LANDSCAPE and asset_orientation == Orientation.PORTRAIT:
-                command.extend(['-rotate', "90"])
-            elif target_orientation == Orientation.PORTRAIT and asset_orientation == Orientation.LANDSCAPE:
-                command.extend(['-rotate', "-90"])
+        rotation = self.get_rotation(image_data.get_orientation(asset_info))
+        if rotation is not None:
+            command.extend(['-rotate', rotation])
 
         # set the resolution
         resolution = self.target_resolution.resolution_string
-        if self.settings.PreserveAspect:
+        if self.preserve_aspect:
             resolution+= '>'
         command.extend(['-resize', resolution])
 
         # handle if we need to use a letterbox
-        if self.settings.Letterbox:
-            command.extend(['-background', self.settings.LetterboxColor])
+        if self.letterbox_color is not None:
+            command.extend(['-background', self.letterbox_color])
             command.extend(['-gravity', 'center'])
             command.extend(['-extent', self.target_resolution.resolution_string])
 
@@ -149,120 +236,722 @@ class ImageDatabase:
         return command
                         
     def get_image(self, album_id, asset_id) -> ImageData:
-        for image_data in self.data:
-            if image_data.album_id == album_id and image_data.asset_id == asset_id:
-                return image_data
-        return None
+        return self.data.get((album_id, asset_id))
+
+    def add_image(self, image_data : ImageData):
+        key = (image_data.album_id, image_data.asset_id)
+        self.data[key] = image_data
+        self.deleted.discard(key)
+        self.album_index.setdefault(image_data.album_id, set()).add(image_data.asset_id)
+        self.update_image(image_data)
+
+    def update_image(self, image_data : ImageData):
+        key = (image_data.album_id, image_data.asset_id)
+        self.dirty.add(key)
+        hours = seconds_to_hours(image_data.last_used)
+        if image_data.file_path is not None:
+            self.picker.set(key, hours, image_data.use_count)
+            self.evicted_picker.remove(key)
+            self.pending.discard(key)
+        elif image_data.evicted:
+            self.picker.remove(key)
+            self.evicted_picker.set(key, hours, image_data.use_count)
+            self.pending.discard(key)
+        else:
+            self.picker.remove(key)
+            self.evicted_picker.remove(key)
+            self.pending.add(key)
+        self.index_file(key, image_data.file_path)
+
+    def index_file(self, key, file_path):
+        old_path = self.row_files.get(key)
+        if old_path == file_path:
+            return
+        if old_path is not None:
+            self.file_rows[old_path].remove(key)
+            if len(self.file_rows[old_path]) == 0:
+                del self.file_rows[old_path]
+        if file_path is None:
+            self.row_files.pop(key, None)
+        else:
+            self.row_files[key] = file_path
+            self.file_rows.setdefault(file_path, []).append(key)
+
+    def is_file_used(self, file_path):
+        return file_path in self.file_rows
+
+    def remove_image(self, image_data : ImageData):
+        key = (image_data.album_id, image_data.asset_id)
+        self.data.pop(key, None)
+        self.dirty.discard(key)
+        self.deleted.add(key)
+        self.picker.remove(key)
+        self.evicted_picker.remove(key)
+        self.pending.discard(key)
+        self.index_file(key, None)
+        album_assets = self.album_index.get(image_data.album_id)
+        if album_assets is not None:
+            album_assets.discard(image_data.asset_id)
+            if len(album_assets) == 0:
+                del self.album_index[image_data.album_id]
+
+    def load_album_manifest(self):
+        # album_id -> ImmichAlbum as of the last finished sync
+        manifest = {}
+        for album_id, (version, etag, asset_rows) in self.store.load_albums().items():
+            manifest[album_id] = ImmichAlbum.from_manifest(album_id, version, etag, asset_rows)
+        return manifest
+
+    def save_album_manifest(self, immich : ImmichConnection, incomplete = ()):
+        # albums in incomplete have images that didnt make it, so they stay changed for the next sync
+        for album_id, album in immich.albums.items():
+            if album.changed and album_id not in incomplete:
+                self.store.write_album(album_id, album.version, album.etag, album.to_manifest())
+                # the manifest now matches so a later pass over the same albums doesnt write it again
+                album.changed = False
+        self.store.prune_albums(list(immich.albums.keys()))
     
+    def get_cache_path(self, asset : ImmichAssetData, extension = None):
+        # files are named by content so a photo in several albums is one file and two photos that
+        # happen to share a file name never collide.  immich checksums are base64 sha1
+        name = asset.id
+        if asset.checksum:
+            try:
+                name = base64.b64decode(asset.checksum, validate=True).hex()
+            except ValueError:
+                pass
+        if extension is None:
+            extension = os.path.splitext(asset.original_file_name)[1].lower()
+        return os.path.join(self.image_directory, name + extension)
+
+    def get_processed_path(self, asset : ImmichAssetData):
+        # renditions are jpeg or webp and are saved as jpeg once processed
+        if self.get_rendition(asset) is not None:
+            return self.get_cache_path(asset, ".jpg")
+        # HACK: heic ends up as a jpg next to the download
+        file_path = self.get_cache_path(asset)
+        return file_path + ".jpg" if asset.original_mime_type == 'image/heic' else file_path
+
+    def get_needed_edge(self, asset : ImmichAssetData):
+        # longest edge a download needs to fill the screen in any rotation.  nothing is gained
+        # past the size of the original
+        needed = max(self.target_resolution.width, self.target_resolution.height)
+        if asset.width and asset.height:
+            needed = min(needed, max(int(asset.width), int(asset.height)))
+        return needed
+
+    def get_rendition(self, asset : ImmichAssetData):
+        # with DownloadMode "preview", the smallest rendition immich makes that still fills the
+        # screen.  None when the original is needed
+        if self.settings.get_setting("DownloadMode", "original") != "preview":
+            return None
+        sizes = dict(RENDITION_SIZES, preview=self.settings.get_setting("PreviewSize", RENDITION_SIZES["preview"]))
+        needed = self.get_needed_edge(asset)
+        for rendition, size in sorted(sizes.items(), key=lambda item: item[1]):
+            if size >= needed:
+                return rendition
+        return None
+
+    # runs on a pipeline worker thread so it must not touch the database
+    def prepare_image(self, job, asset_info : ImmichAssetData):
+        image_data = job['image_data']
+
+        # HACK: Force heic to be jpg.  a heic fetched as a preview fallback is already headed for a .jpg
+        force_jpg = False
+        if job['asset'].original_mime_type == 'image/heic' and not image_data.file_path.endswith(".jpg"):
+            force_jpg = True
+
+        # a single decode and encode in process.  imagemagick handles anything pillow cant read
+        try:
+            with profiler.stage("transform", asset=image_data.asset_id):
+                self.transform_image(image_data, asset_info, force_jpg)
+        except (OSError, ValueError) as e:
+            print(f"\tPillow could not process {image_data.file_path} ({e}).  Using ImageMagick")
+            with profiler.stage("transform_imagemagick", asset=image_data.asset_id):
+                self.transform_image_imagemagick(image_data, asset_info, force_jpg)
+
+        # prepare the panel frame now so displaying it later is just a read
+        if self.frame_cache is not None:
+            with profiler.stage("render_frame", asset=image_data.asset_id):
+                self.frame_cache.render(image_data.file_path)
+        return image_data
+
+    def transform_image(self, image_data : ImageData, asset_info : ImmichAssetData, force_jpg):
+        from image_transform import transform_image
+        output_path = image_data.file_path + ".jpg" if force_jpg else image_data.file_path
+        transform_image(image_data.file_path, output_path, self.target_resolution,
+                        lambda resolution: self.get_rotation(image_data.get_orientation(asset_info, resolution)),
+                        preserve_aspect=self.preserve_aspect,
+                        letterbox_color=self.letterbox_color,
+                        master_path=self.get_master_path(output_path),
+                        master_edge=self.get_master_edge())
+
+        if force_jpg:
+            os.remove(image_data.file_path)
+            image_data.file_path = output_path
+
+    def transform_image_imagemagick(self, image_data : ImageData, asset_info : ImmichAssetData, force_jpg):
+        output_path = image_data.file_path + ".jpg" if force_jpg else image_data.file_path
+        master_path = self.get_master_path(output_path)
+        if master_path is not None:
+            # imagemagick only makes the master, pillow can read that and fits it like any other
+            from image_transform import transform_image
+            edge = self.get_master_edge()
+            command = ['convert', image_data.file_path, '-auto-orient', '-strip', '-resize', f"{edge}x{edge}>", master_path]
+            profiler.count("subprocesses")
+            with profiler.stage("convert", asset=image_data.asset_id):
+                subprocess.run(command, check=True)
+            transform_image(master_path, output_path, self.target_resolution,
+                            lambda resolution: self.get_rotation(image_data.get_orientation(asset_info, resolution)),
+                            preserve_aspect=self.preserve_aspect,
+                            letterbox_color=self.letterbox_color)
+            if force_jpg:
+                os.remove(image_data.file_path)
+                image_data.file_path = output_path
+            return
+
+        image_data.enforce_exif_rotation(force_jpg) # apply exif rotation and then wipe exif
+
+        # ensure the image is the proper size
+        cur_resolution = image_data.get_resolution()
+        if cur_resolution != self.target_resolution:
+            resize_command = self.get_resize_command(image_data, asset_info)
+            profiler.count("subprocesses")
+            with profiler.stage("resize", asset=image_data.asset_id):
+                subprocess.run(resize_command, check=True)
+
+    @profiler.timed("process_albums")
     def process_albums(self, immich : ImmichConnection):
 
-        assets_to_download = []
+        # only new assets of changed albums and rows that never got a file need any work
+        self.incomplete_albums = set()
+        requested = set(self.pending)
+        pending_by_album = {}
+        for album_id, asset_id in self.pending:
+            pending_by_album.setdefault(album_id, []).append(asset_id)
+
+        # processed path -> jobs.  every row wanting the same photo shares one download
+        downloads = {}
         for album_id, album in immich.albums.items():
-            for asset_id, asset in album.image_assets.items():
+            candidates = pending_by_album.get(album_id, [])
+            if album.changed:
+                known = self.album_index.get(album_id, set())
+                candidates = candidates + [asset_id for asset_id in album.image_assets if asset_id not in known]
+
+            for asset_id in candidates:
+                asset = album.get_asset(asset_id)
+                if asset is None:
+                    continue
 
                 # check if an image exists
                 image_data = self.get_image(album_id, asset_id)
                 if image_data is None:
                     image_data = ImageData(album_id, asset_id)
-                    self.data.append(image_data)
+                    self.add_image(image_data)
 
                 if image_data.file_path is not None and os.path.exists(image_data.file_path):
                     continue
 
-                output_file = os.path.join(self.image_directory, asset.originalFileName)
-                if os.path.exists(output_file):
-                    print(f"Asset already exists {asset.originalFileName}")
+                # another album already has this photo ready
+                processed_path = self.get_processed_path(asset)
+                if self.is_file_used(processed_path) and os.path.exists(processed_path):
+                    print(f"Sharing {processed_path} with album {album_id}")
+                    image_data.file_path = processed_path
+                    image_data.render_key = self.data[self.file_rows[processed_path][0]].render_key
+                    self.update_image(image_data)
                     continue
 
-                assets_to_download.append({'asset':asset, 'album_id':album_id, 'asset_id':asset_id})
+                job = downloads.get(processed_path)
+                if job is None:
+                    downloads[processed_path] = {'asset':asset, 'album_id':album_id, 'asset_id':asset_id, 
+                                                 'rows':[image_data]}
+                else:
+                    job['rows'].append(image_data)
 
-        if len(assets_to_download) == 0:
+        jobs = self.limit_to_budget(list(downloads.values()), requested)
+        if len(jobs) == 0:
             print("No new Assets to download")
+            self.save_changes()
+            self.save_album_manifest(immich)
             return
-        
-        # Create a temporary file
-        temp_file_name = ""
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            temp_file_name = temp_file.name  
-
-        download_success = immich.download_assets(assets_to_download, temp_file_name, False)
-        if not download_success:
-            print("Failed to download assets")
+
+        for job in jobs:
+            job['rendition'] = self.get_rendition(job['asset'])
+            # the workers fill in a copy of the row.  the rows only get the file in on_job_done, once it is there
+            row = job['rows'][0]
+            job['image_data'] = ImageData(row.album_id, row.asset_id,
+                                          self.get_cache_path(job['asset'], ".jpg" if job['rendition'] is not None else None))
+            job['image_data'].orientation = row.orientation
+
+        # batches keep each request small enough to survive a flaky connection.  every batch is 
+        # saved as soon as it is processed so an interrupted sync only fetches what is left
+        batches = self.get_download_batches(jobs)
+
+        if self.settings.get_setting("DownloadMode", "original") == "preview":
+            # one request per photo at the size the screen needs, several at once on the pipeline's fetch workers
+            renditions = sum(1 for job in jobs if job['rendition'] is not None)
+            print(f"Downloading {renditions} previews and {len(jobs) - renditions} originals")
+            self.process_jobs([job for batch in batches for job in batch['jobs']],
+                              fetch=lambda job: self.fetch_asset(immich, job),
+                              fetch_workers=self.settings.get_setting("HttpPoolSize", 8))
+        # streaming hands each file to the pipeline as soon as it is out of the archive
+        elif self.settings.get_setting("StreamDownloads", True):
+            print(f"Downloading {len(jobs)} new assets in {len(batches)} batches")
+            self.process_jobs(self.stream_jobs(immich, batches))
         else:
-            print(f"Extracting new assets to {self.image_directory}")
-            with zipfile.ZipFile(temp_file_name, 'r') as zip_ref:
-                
-                file_list = zip_ref.namelist()
-                with tqdm(total=len(file_list), 
-                          desc=f"Extracting to {self.image_directory}", 
-                          unit='file') as progress_bar:
-                    for file in file_list:
-                        zip_ref.extract(file, self.image_directory)
-                        progress_bar.update(1)
-
-            for asset in assets_to_download:
-                print(f"Processing new image {asset['asset'].originalFileName}")
-                image_data = self.get_image(asset['album_id'], asset['asset_id'])
-                if image_data is None:
-                    image_data = ImageData(asset['album_id'], asset['asset_id'])
-                    self.data.append(image_data)
-                image_data.file_path = f"{self.image_directory}/{asset['asset'].originalFileName}"
+            print(f"Downloading {len(jobs)} new assets in {len(batches)} batches")
+            self.process_jobs(self.download_jobs(immich, batches))
+
+        self.save_changes()
+
+        # only now is everything in the albums recorded, so the next sync can trust the manifest
+        if len(self.incomplete_albums) > 0:
+            print(f"{len(self.incomplete_albums)} albums will be checked again on the next sync")
+        self.save_album_manifest(immich, self.incomplete_albums)
+
+    def get_asset_size(self, asset : ImmichAssetData):
+        if asset.file_size:
+            return asset.file_size
+        return self.settings.get_setting("DownloadAssetSizeEstimate", 8 * 1024 * 1024)
 
-                # HACK: Force heic to be jpg
-                force_jpg = False
-                if asset['asset'].originalMimeType == 'image/heic':
-                    force_jpg = True
+    def get_download_batches(self, jobs):
+        max_bytes = self.settings.get_setting("DownloadBatchBytes", 256 * 1024 * 1024)
+        max_count = self.settings.get_setting("DownloadBatchCount", 100)
 
-                image_data.enforce_exif_rotation(force_jpg) # apply exif rotation and then wipe exif
+        batches = []
+        batch = None
+        for job in jobs:
+            size = self.get_asset_size(job['asset'])
+            # immich renames clashing names inside an archive, so keep every name in a batch unique
+            name = job['asset'].original_file_name
+            if (batch is None or len(batch['jobs']) >= max_count or name in batch['names'] or
+                (batch['bytes'] + size > max_bytes and len(batch['jobs']) > 0)):
+                batch = {'jobs': [], 'bytes': 0, 'finished': 0, 'names': set()}
+                batches.append(batch)
+            batch['jobs'].append(job)
+            batch['names'].add(name)
+            batch['bytes'] += size
+            job['batch'] = batch
+        return batches
 
-                # ensure the image is the proper size
-                asset_info = immich.get_asset_info(asset['asset_id'])
-                cur_resolution = image_data.get_resolution()
-                if cur_resolution != self.target_resolution:
-                    resize_command = self.get_resize_command(image_data, asset_info)
-                    print(f"Resizing {image_data.file_path} to {self.target_resolution.resolution_string}")
-                    subprocess.run(resize_command)
+    def download_batch(self, batch, download):
+        # runs download(jobs) until every job in the batch has come back, retrying what is missing.
+        # download is a generator of received jobs.  jobs we gave up on come back with an error, see
+        # fetch_received, and the error is returned
+        from zip_stream import ZipStreamError
+        retries = self.settings.get_setting("DownloadRetries", 3)
+        remaining = list(batch['jobs'])
+        error = None
+        for attempt in range(retries + 1):
+            if attempt > 0:
+                delay = min(60, 2 ** attempt)
+                print(f"Retrying {len(remaining)} assets in {delay} seconds")
+                time.sleep(delay)
+            try:
+                for job in download(remaining):
+                    remaining.remove(job)
+                    yield job
+            except (IOError, ZipStreamError) as e:
+                print(f"Download interrupted: {e}")
+                error = IOError(f"Download failed: {e}")
+                continue
+            if len(remaining) == 0:
+                return None
+            # the archive came through whole but left some out
+            print(f"{len(remaining)} assets were missing from the download")
+            error = IOError("Missing from the download")
+
+        print(f"Giving up on {len(remaining)} assets until the next sync")
+        for job in remaining:
+            job['error'] = error
+            yield job
+        return error
+
+    def download_batches(self, batches, download):
+        # once a batch is given up on the server is likely out of reach, so the batches after it fail
+        # without being tried.  they stay pending for the next sync
+        error = None
+        for batch in batches:
+            if error is None:
+                error = yield from self.download_batch(batch, download)
+                continue
+            for job in batch['jobs']:
+                job['error'] = error
+                yield job
+
+    @staticmethod
+    def fetch_received(job):
+        # the fetch stage for downloaded jobs.  a job the download gave up on fails here so the
+        # pipeline hands it to on_job_failed
+        if job.get('error') is not None:
+            raise job['error']
+        return job['asset']
+
+    def get_incoming_directory(self):
+        # archives are unpacked here under their original names and then moved to their cache path
+        incoming_directory = os.path.join(self.image_directory, ".incoming")
+        os.makedirs(incoming_directory, exist_ok=True)
+        return incoming_directory
+
+    def receive_file(self, jobs_by_name, incoming_directory, file_path):
+        job = jobs_by_name.pop(os.path.relpath(file_path, incoming_directory), None)
+        if job is None:
+            print(f"Ignoring unexpected file {file_path}")
+            os.remove(file_path)
+            return None
+        os.replace(file_path, job['image_data'].file_path)
+        return job
+
+    def stream_jobs(self, immich : ImmichConnection, batches):
+        from zip_stream import ZipStreamExtractor
+
+        def download(jobs):
+            jobs_by_name = {job['asset'].original_file_name: job for job in jobs}
+            incoming_directory = self.get_incoming_directory()
+            extractor = ZipStreamExtractor(incoming_directory)
+            for file_path in extractor.extract(immich.stream_assets(jobs)):
+                job = self.receive_file(jobs_by_name, incoming_directory, file_path)
+                if job is not None:
+                    yield job
+
+        print(f"Streaming new assets to {self.image_directory}")
+        yield from self.download_batches(batches, download)
+
+    def download_jobs(self, immich : ImmichConnection, batches):
+        import zipfile
+        import tempfile
+        from tqdm import tqdm
+
+        def download(jobs):
+            # Create a temporary file
+            temp_file_name = ""
+            with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+                temp_file_name = temp_file.name  
+
+            try:
+                if not immich.download_assets(jobs, temp_file_name, False):
+                    raise IOError("Failed to download assets")
+
+                print(f"Extracting new assets to {self.image_directory}")
+                jobs_by_name = {job['asset'].original_file_name: job for job in jobs}
+                incoming_directory = self.get_incoming_directory()
+                with zipfile.ZipFile(temp_file_name, 'r') as zip_ref, profiler.stage("extract"):
+                    file_list = zip_ref.namelist()
+                    with tqdm(total=len(file_list), 
+                              desc=f"Extracting to {self.image_directory}", 
+                              unit='file') as progress_bar:
+                        for file in file_list:
+                            self.receive_file(jobs_by_name, incoming_directory, zip_ref.extract(file, incoming_directory))
+                            progress_bar.update(1)
+            except zipfile.BadZipFile as e:
+                # a cut off archive, retried like an interrupted stream
+                raise IOError(f"Damaged archive: {e}")
+            finally:
+                os.remove(temp_file_name)
+
+            # only hand back what made it out of the archive, the rest gets retried
+            for job in list(jobs):
+                if os.path.exists(job['image_data'].file_path):
+                    yield job
+
+        yield from self.download_batches(batches, download)
 
+    # runs on a pipeline worker thread so it must not touch the database
+    def fetch_asset(self, immich : ImmichConnection, job):
+        from PIL import Image
+        asset = job['asset']
+        file_path = job['image_data'].file_path
+        if job['rendition'] is not None:
+            immich.download_asset(asset.id, file_path, job['rendition'])
+            with Image.open(file_path) as image:
+                edge = max(image.size)
+            if edge >= self.get_needed_edge(asset):
+                return asset
+            # the server makes its previews smaller than PreviewSize says
+            print(f"\tThe {job['rendition']} of {asset.original_file_name} is only {edge}px.  Downloading the original")
+        immich.download_asset(asset.id, file_path)
+        return asset
 
-                    
-        os.remove(temp_file_name)
+    def process_jobs(self, jobs, fetch = None, fetch_workers = 1):
+        from image_pipeline import ImagePipeline
+
+        # the album payload already carries the exif we need so without a download there is nothing to fetch per asset
+        pipeline = ImagePipeline(fetch=fetch or self.fetch_received,
+                                 transform=self.prepare_image,
+                                 fetch_workers=fetch_workers,
+                                 transform_workers=self.settings.get_setting("ProcessingThreads", os.cpu_count()))
+        pipeline.run(jobs,
+                     on_done=self.on_job_done,
+                     on_failed=self.on_job_failed,
+                     description="Processing new images",
+                     describe=lambda job: job['asset'].original_file_name)
+
+    def on_job_done(self, job, result):
+        # every album row wanting this photo gets the one processed file
+        image_data = job['image_data']
+        render_key = self.get_render_key()
+        for row in job['rows']:
+            row.file_path = image_data.file_path
+            row.orientation = image_data.orientation
+            row.render_key = render_key
+            self.update_image(row)
+        self.finish_job(job)
+
+    def on_job_failed(self, job, error):
+        # drop whatever a failed image left behind.  the rows stay pending so the next sync tries it again
+        image_data = job['image_data']
+        if os.path.exists(image_data.file_path):
+            self.remove_files(image_data.file_path)
+        for row in job['rows']:
+            row.file_path = None
+            self.update_image(row)
+            self.incomplete_albums.add(row.album_id)
+        self.finish_job(job)
+
+    def finish_job(self, job):
+        # checkpoint the batch once all of it is processed
+        batch = job.get('batch')
+        if batch is None:
+            return
+        batch['finished'] += 1
+        if batch['finished'] == len(batch['jobs']):
+            self.save_changes()
+
+    @profiler.timed("refresh_renders")
+    def refresh_renders(self):
+        """
+        Refit the cached photos made for other screen settings from their masters, several at once.
+
+        Photos with no master to refit from are dropped, so process_albums downloads them again.
+        Rows from before render keys were kept are taken as made for the current settings.
+        """
+        render_key = self.get_render_key()
+        stale = {}    # file_path -> rows using it
+        for key, image_data in self.data.items():
+            if image_data.file_path is None:
+                continue
+            if image_data.render_key is None:
+                image_data.render_key = render_key
+                self.dirty.add(key)
+            elif image_data.render_key != render_key:
+                stale.setdefault(image_data.file_path, []).append(image_data)
+        if len(stale) == 0:
+            return
+
+        jobs = []
+        dropped = 0
+        for file_path, rows in stale.items():
+            master_path = self.get_master_path(file_path)
+            if master_path is not None and os.path.exists(file_path) and os.path.exists(master_path):
+                jobs.append({'file_path': file_path, 'master_path': master_path, 'rows': rows})
+            else:
+                self.drop_file(file_path)
+                dropped += 1
+        if dropped > 0:
+            print(f"{dropped} photos made for other screen settings have no master and will be downloaded again")
+
+        if len(jobs) > 0:
+            from image_pipeline import ImagePipeline
+            print(f"Refitting {len(jobs)} photos for the new screen settings")
+            pipeline = ImagePipeline(fetch=lambda job: None,
+                                     transform=self.refit_image,
+                                     fetch_workers=1,
+                                     transform_workers=self.settings.get_setting("ProcessingThreads", os.cpu_count()))
+            pipeline.run(jobs,
+                         on_done=self.on_refit_done,
+                         on_failed=lambda job, error: self.drop_file(job['file_path']),
+                         description="Refitting photos",
+                         describe=lambda job: job['file_path'])
         self.save_changes()
+
+    # runs on a pipeline worker thread so it must not touch the database
+    def refit_image(self, job, fetched):
+        from image_transform import transform_image
+        image_data = job['rows'][0]
+        with profiler.stage("refit", asset=image_data.asset_id):
+            transform_image(job['master_path'], job['file_path'], self.target_resolution,
+                            lambda resolution: self.get_rotation(image_data.get_orientation(None, resolution)),
+                            preserve_aspect=self.preserve_aspect,
+                            letterbox_color=self.letterbox_color)
+        # the frame name only covers the panel, so a frame of the old fit would look current
+        if self.frame_cache is not None:
+            with profiler.stage("render_frame", asset=image_data.asset_id):
+                self.frame_cache.render(job['file_path'])
+
+    def on_refit_done(self, job, result):
+        render_key = self.get_render_key()
+        for row in job['rows']:
+            row.render_key = render_key
+            self.update_image(row)
+
+    def drop_file(self, file_path):
+        # forget a cached photo without marking it evicted, so the next process_albums fetches it again
+        for key in list(self.file_rows.get(file_path, ())):
+            image_data = self.data[key]
+            image_data.file_path = None
+            image_data.render_key = None
+            self.update_image(image_data)
+        self.remove_files(file_path)
+
+    # render any frames missing for the current screen settings and drop the ones that no longer apply
+    @profiler.timed("prepare_frames")
+    def prepare_frames(self):
+        if self.frame_cache is None:
+            return
+
+        self.frame_cache.remove_stale()
+        for image_data in self.data.values():
+            if image_data.file_path is None or not os.path.exists(image_data.file_path):
+                continue
+            if not os.path.exists(self.frame_cache.get_frame_path(image_data.file_path)):
+                print(f"Rendering frame for {image_data.file_path}")
+                self.frame_cache.render(image_data.file_path)
     
+    def get_cached_size(self, file_path):
+        size = 0
+        paths = [file_path]
+        if self.frame_cache is not None:
+            paths.append(self.frame_cache.get_frame_path(file_path))
+        if self.master_directory is not None:
+            paths.append(self.get_master_path(file_path))
+        for path in paths:
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return size
+
+    def evict_file(self, file_path):
+        for key in list(self.file_rows.get(file_path, ())):
+            image_data = self.data[key]
+            image_data.file_path = None
+            image_data.evicted = True
+            self.update_image(image_data)
+        self.remove_files(file_path)
+
+    def remove_files(self, file_path):
+        # a cached photo and everything made from it
+        paths = [file_path]
+        if self.master_directory is not None:
+            paths.append(self.get_master_path(file_path))
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+        if self.frame_cache is not None:
+            self.frame_cache.remove(file_path)
+
+    @profiler.timed("cache_budget")
+    def enforce_cache_budget(self):
+        # evict the files least likely to be picked next until the cache fits.  a file shared by
+        # several albums counts once, weighted by all the rows that use it
+        max_bytes = self.settings.get_setting("CacheMaxBytes", 0)
+        max_count = self.settings.get_setting("CacheMaxCount", 0)
+        if max_bytes <= 0 and max_count <= 0:
+            return
+
+        now_hours = to_hours(datetime.now())
+        files = []
+        total_bytes = 0
+        for file_path, keys in self.file_rows.items():
+            size = self.get_cached_size(file_path)
+            weight = sum(self.picker.weight(key, now_hours) for key in keys)
+            files.append((weight, file_path, size))
+            total_bytes += size
+        files.sort()
+
+        count = len(files)
+        evicted = 0
+        for weight, file_path, size in files:
+            if (max_bytes <= 0 or total_bytes <= max_bytes) and (max_count <= 0 or count <= max_count):
+                break
+            self.evict_file(file_path)
+            total_bytes -= size
+            count -= 1
+            evicted += 1
+
+        if evicted > 0:
+            print(f"Evicted {evicted} images to keep the cache at {count} images and {total_bytes} bytes")
+            self.save_changes()
+
+    def limit_to_budget(self, jobs, requested):
+        # new images only take the room CacheMaxCount and CacheMaxBytes have left, the rest are known
+        # but not cached until the picker asks for them.  images that were asked for always get fetched
+        max_count = self.settings.get_setting("CacheMaxCount", 0)
+        max_bytes = self.settings.get_setting("CacheMaxBytes", 0)
+        if max_count <= 0 and max_bytes <= 0:
+            return jobs
+
+        jobs.sort(key=lambda job: not any((row.album_id, row.asset_id) in requested for row in job['rows']))
+        wanted = sum(1 for job in jobs if any((row.album_id, row.asset_id) in requested for row in job['rows']))
+        room = len(jobs)
+        if max_count > 0:
+            room = min(room, max(wanted, max_count - len(self.file_rows)))
+        if max_bytes > 0:
+            # counted at the download size.  what is kept of a phone photo is far smaller, and
+            # enforce_cache_budget trims whatever a sync still goes over by
+            free = max_bytes - sum(self.get_cached_size(file_path) for file_path in self.file_rows)
+            fits = 0
+            for job in jobs:
+                free -= self.get_asset_size(job['asset'])
+                if free < 0 and fits >= wanted:
+                    break
+                fits += 1
+            room = min(room, fits)
+        for job in jobs[room:]:
+            for row in job['rows']:
+                row.evicted = True
+                self.update_image(row)
+        if len(jobs) > room:
+            print(f"Leaving {len(jobs) - room} new images uncached to stay in the cache budget")
+        return jobs[:room]
+
+    @profiler.timed("purge_missing")
     def purge_missing(self, immich : ImmichConnection):
 
-        # scan for albums and assets that are no longer in the immich data
+        # scan for albums and assets that are no longer in the immich data.  unchanged albums cant have lost anything
         to_delete = []
-        for image_data in self.data:
-            album = immich.get_album(image_data.album_id)
+        for album_id, asset_ids in self.album_index.items():
+            album = immich.get_album(album_id)
             if album is None:
-                print(f"Removing {image_data.file_path} because album {image_data.album_id} is missing")
-                to_delete.append(image_data)
+                print(f"Removing {len(asset_ids)} images because album {album_id} is missing")
+                to_delete.extend(self.data[(album_id, asset_id)] for asset_id in asset_ids)
                 continue
-            asset = album.get_asset(image_data.asset_id)
-            if asset is None:
-                print(f"Removing {image_data.file_path} because asset {image_data.asset_id} is missing from album {image_data.album_id}")
-                to_delete.append(image_data)
+            if not album.changed:
                 continue
+            for asset_id in asset_ids - album.image_assets.keys():
+                image_data = self.data[(album_id, asset_id)]
+                print(f"Removing {image_data.file_path} because asset {asset_id} is missing from album {album_id}")
+                to_delete.append(image_data)
 
-        # purge them from disk and memory
+        # purge them from memory, and from disk once no other album uses the file
         for image_data in to_delete:
-            self.data.remove(image_data)
+            self.remove_image(image_data)
+            if image_data.file_path is None or self.is_file_used(image_data.file_path):
+                continue
             if os.path.exists(image_data.file_path):
-                os.remove(image_data.file_path)
+                self.remove_files(image_data.file_path)
                 print(f"{image_data.file_path} deleted successfully.")
                 
         self.save_changes()
 
     def purge_all(self):
         # purge database from disk and memory
-        while len(self.data) > 0:
-            image_data = self.data[0]
-            if os.path.exists(image_data.file_path):
+        for image_data in self.data.values():
+            if image_data.file_path is not None and os.path.exists(image_data.file_path):
                 os.remove(image_data.file_path)
                 print(f"Deleted: {image_data.file_path}.")
             else:
                 print(f"Missing: {image_data.file_path}.")
-            self.data.remove(image_data)
+        self.data.clear()
+        self.dirty.clear()
+        self.deleted.clear()
+        self.album_index.clear()
+        self.pending.clear()
+        self.file_rows.clear()
+        self.row_files.clear()
+        self.picker.build([])
+        self.evicted_picker.build([])
+        self.store.clear()
 
         # purge all remaining files from disk
         for filename in os.listdir(self.settings.ImageCachePath):
@@ -273,41 +962,110 @@ class ImageDatabase:
                     print(f"Removed: {file_path}.")
             except Exception as e:
                 print(f"Failed to delete {file_path}. Reason: {e}")
+
+        incoming_directory = os.path.join(self.image_directory, ".incoming")
+        if os.path.isdir(incoming_directory):
+            shutil.rmtree(incoming_directory)
+        if self.master_directory is not None and os.path.isdir(self.master_directory):
+            shutil.rmtree(self.master_directory)
+            os.makedirs(self.master_directory)
+
+        if self.frame_cache is not None:
+            self.frame_cache.clear()
                 
         self.save_changes()
         
+    @profiler.timed("load_database")
     def load_data(self):
-        with open(self.database_file, 'r', newline='') as csvfile:
-            reader = csv.reader(csvfile)
-            for row in reader:
-                self.data.append(ImageData.from_list(row))
-            print("Database loaded successfully:")
+        # nothing loaded here can form a cycle, and with a big library the collector would
+        # otherwise keep rescanning every row created so far
+        gc.disable()
+        try:
+            for row in self.store.load():
+                image_data = ImageData.from_list(row)
+                key = (image_data.album_id, image_data.asset_id)
+                self.data[key] = image_data
+                self.album_index.setdefault(image_data.album_id, set()).add(image_data.asset_id)
+                if image_data.file_path is not None:
+                    # same as index_file, without the checks a fresh index doesnt need
+                    self.row_files[key] = image_data.file_path
+                    self.file_rows.setdefault(image_data.file_path, []).append(key)
+                elif not image_data.evicted:
+                    self.pending.add(key)
+            self.picker.build((key, seconds_to_hours(image_data.last_used), image_data.use_count) 
+                              for key, image_data in self.data.items() if image_data.file_path is not None)
+            self.evicted_picker.build((key, seconds_to_hours(image_data.last_used), image_data.use_count) 
+                                      for key, image_data in self.data.items() if image_data.file_path is None and image_data.evicted)
+        finally:
+            gc.enable()
+        print("Database loaded successfully:")
                 
-    def save_changes(self):
-        with open(self.database_file, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            for image_data in self.data:
-                writer.writerow(image_data.to_list())
-            print("Database changes saved to ", self.database_file)
+    def save_changes(self, force = True):
+        # only rows that changed since the last save get written.  without force the write waits
+        # until save_interval has passed, anything held back goes out with the next save or close
+        if not force and time.monotonic() - self.last_save < self.save_interval:
+            return
+        self.last_save = time.monotonic()
+        if len(self.dirty) == 0 and len(self.deleted) == 0:
+            return
+        # in key order so sqlite walks its index once instead of jumping around it
+        rows = [self.data[key].to_list() for key in sorted(self.dirty)]
+        with profiler.stage("save_database", rows=len(rows)):
+            self.store.write(rows, list(self.deleted))
+        self.dirty.clear()
+        self.deleted.clear()
+        print("Database changes saved to ", self.database_file)
+
+    def close(self):
+        self.save_changes()
+        self.store.close()
     
     def print(self):
-        print(self.data)
+        print(list(self.data.values()))
+
+    @profiler.timed("pick")
+    def pick_random_image(self, exclude = ()) -> ImageData:
+        # picks without marking the image used.  keys in exclude are rerolled a few times, and if
+        # nothing else comes up we return None rather than repeat one
+        now_hours = to_hours(datetime.now())
+        total_weight = self.picker.total_weight(now_hours)
+
+        for _ in range(PICK_ATTEMPTS):
+            # Generate a random number between 0 and the total weight and let the picker find its image
+            rand_num = random.uniform(0, total_weight)
+            key = self.picker.pick(now_hours, rand_num)
+            if key is None:
+                return None
+            if key not in exclude:
+                return self.data[key]
+        return None
+
+    def use_image(self, image : ImageData):
+        image.mark_used()
+        self.update_image(image)
+        self.request_evicted_image()
+        self.save_changes(force=False)
+
+    def request_evicted_image(self):
+        # evicted images keep their share of picks.  when a pick over everything would have landed
+        # on one of them it goes back to pending so the next sync fetches it again
+        now_hours = to_hours(datetime.now())
+        evicted_weight = self.evicted_picker.total_weight(now_hours)
+        if len(self.evicted_picker) == 0 or evicted_weight <= 0:
+            return None
+
+        rand_num = random.uniform(0, evicted_weight + self.picker.total_weight(now_hours))
+        if rand_num > evicted_weight:
+            return None
+
+        image_data = self.data[self.evicted_picker.pick(now_hours, rand_num)]
+        print(f"Requesting evicted image {image_data.asset_id} from album {image_data.album_id}")
+        image_data.evicted = False
+        self.update_image(image_data)
+        return image_data
 
     def get_random_image(self) -> ImageData:
-        now = datetime.now()
-
-        self.data = sorted(self.data, key=lambda x: x.calculate_weight(now), reverse=False)
-        weights = [image.calculate_weight(now) for image in self.data]
-        total_weight = sum(weights)
-
-        # Generate a random number between 0 and the total weight
-        rand_num = random.uniform(0, total_weight)
-        cumulative_weight = 0
-
-        # Iterate through the images and select one based on weighted probability
-        for image, weight in zip(self.data, weights):
-            cumulative_weight += weight
-            if rand_num <= cumulative_weight:
-                image.mark_used()
-                self.save_changes()
-                return image
+        image = self.pick_random_image()
+        if image is not None:
+            self.use_image(image)
+        return image
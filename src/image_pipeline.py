@@ -0,0 +1,106 @@
+import os
+import queue
+import threading
+from tqdm import tqdm
+
+# marks the end of the work in a queue
+_DONE = object()
+
+class ImagePipeline:
+    """
+    Runs jobs through two thread pools connected by bounded queues.
+
+    fetch(job) is the network bound stage (eg. asset info lookups) and transform(job, fetched)
+    is the cpu bound stage (eg. imagemagick work).  Both run on worker threads while results
+    are handed back to the calling thread through on_done(job, result) and on_failed(job, error)
+    so callers can update state that isnt thread safe, like the database.  A failing job is
+    reported and skipped.
+    """
+
+    def __init__(self, fetch, transform, fetch_workers = 4, transform_workers = None, queue_size = None):
+        self.fetch = fetch
+        self.transform = transform
+        self.fetch_workers = max(1, fetch_workers)
+        self.transform_workers = max(1, transform_workers or os.cpu_count() or 1)
+        self.queue_size = queue_size or 2 * self.transform_workers
+
+    def run(self, jobs, on_done = None, on_failed = None, description = "Processing", describe = str):
+        # jobs can be a generator, eg. files coming out of a download that is still running
+        total = len(jobs) if hasattr(jobs, '__len__') else None
+        fetch_queue = queue.Queue(maxsize=self.queue_size)
+        transform_queue = queue.Queue(maxsize=self.queue_size)
+        result_queue = queue.Queue()
+        failures = []
+
+        def feed():
+            try:
+                for job in jobs:
+                    fetch_queue.put(job)
+            except Exception as e:
+                print(f"Stopped queueing {description.lower()}: {e}")
+            finally:
+                for _ in range(self.fetch_workers):
+                    fetch_queue.put(_DONE)
+
+        def fetch_worker():
+            while True:
+                job = fetch_queue.get()
+                if job is _DONE:
+                    result_queue.put((_DONE, 'fetch', None))
+                    return
+                try:
+                    transform_queue.put((job, self.fetch(job)))
+                except Exception as e:
+                    result_queue.put((job, None, e))
+
+        def transform_worker():
+            while True:
+                item = transform_queue.get()
+                if item is _DONE:
+                    result_queue.put((_DONE, 'transform', None))
+                    return
+                job, fetched = item
+                try:
+                    result_queue.put((job, self.transform(job, fetched), None))
+                except Exception as e:
+                    result_queue.put((job, None, e))
+
+        threads = [threading.Thread(target=feed, daemon=True)]
+        threads += [threading.Thread(target=fetch_worker, daemon=True) for _ in range(self.fetch_workers)]
+        threads += [threading.Thread(target=transform_worker, daemon=True) for _ in range(self.transform_workers)]
+        for thread in threads:
+            thread.start()
+
+        fetchers_running = self.fetch_workers
+        transformers_running = self.transform_workers
+        completed = 0
+        with tqdm(total=total, desc=f"\t{description}", unit='image') as progress_bar:
+            while transformers_running > 0:
+                job, result, error = result_queue.get()
+                if job is _DONE:
+                    if result == 'fetch':
+                        fetchers_running -= 1
+                        # once every fetcher is finished nothing else will be added to the transform queue
+                        if fetchers_running == 0:
+                            for _ in range(self.transform_workers):
+                                transform_queue.put(_DONE)
+                    else:
+                        transformers_running -= 1
+                    continue
+
+                completed += 1
+                progress_bar.update(1)
+                if error is not None:
+                    failures.append((job, error))
+                    progress_bar.write(f"Failed to process {describe(job)}: {error}")
+                    if on_failed is not None:
+                        on_failed(job, error)
+                elif on_done is not None:
+                    on_done(job, result)
+
+        for thread in threads:
+            thread.join()
+
+        if len(failures) > 0:
+            print(f"{len(failures)} of {completed} images failed to process")
+        return failures
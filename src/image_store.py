@@ -0,0 +1,261 @@
+import os
+import time
+import sqlite3
+
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+CREATE_IMAGES_TABLE = """
+CREATE TABLE IF NOT EXISTS images (
+    album_id TEXT NOT NULL,
+    asset_id TEXT NOT NULL,
+    file_path TEXT,
+    last_used_date TEXT NOT NULL,
+    use_count INTEGER NOT NULL DEFAULT 0,
+    orientation INTEGER,
+    evicted INTEGER NOT NULL DEFAULT 0,
+    render_key TEXT,
+    PRIMARY KEY (album_id, asset_id)
+) WITHOUT ROWID
+"""
+
+CREATE_ALBUMS_TABLE = """
+CREATE TABLE IF NOT EXISTS albums (
+    album_id TEXT PRIMARY KEY,
+    version TEXT,
+    etag TEXT
+)
+"""
+
+CREATE_ALBUM_ASSETS_TABLE = """
+CREATE TABLE IF NOT EXISTS album_assets (
+    album_id TEXT NOT NULL,
+    asset_id TEXT NOT NULL,
+    original_file_name TEXT,
+    original_mime_type TEXT,
+    checksum TEXT,
+    file_size INTEGER,
+    orientation,
+    width INTEGER,
+    height INTEGER,
+    PRIMARY KEY (album_id, asset_id)
+) WITHOUT ROWID
+"""
+
+# last_used_date is kept as text so the file stays readable, but goes in and out as seconds.
+# sqlite does the conversion so loading a big database doesnt parse a date per row in python
+SELECT_IMAGES = """
+SELECT album_id, asset_id, file_path, CAST(strftime('%s', last_used_date) AS INTEGER), use_count, orientation, evicted,
+       render_key
+FROM images
+"""
+
+UPSERT_IMAGE = """
+INSERT INTO images (album_id, asset_id, file_path, last_used_date, use_count, orientation, evicted, render_key)
+VALUES (?, ?, ?, datetime(?, 'unixepoch'), ?, ?, ?, ?)
+ON CONFLICT (album_id, asset_id) DO UPDATE SET
+    file_path = excluded.file_path,
+    last_used_date = excluded.last_used_date,
+    use_count = excluded.use_count,
+    orientation = excluded.orientation,
+    evicted = excluded.evicted,
+    render_key = excluded.render_key
+"""
+
+# columns added after a table was first created.  older databases get them on open.
+# album_assets.orientation has no type so immich's value comes back as the same type it went in
+ADDED_COLUMNS = {
+    'images': [('orientation', 'INTEGER'), ('evicted', 'INTEGER NOT NULL DEFAULT 0'), ('render_key', 'TEXT')],
+    'album_assets': [('orientation', ''), ('width', 'INTEGER'), ('height', 'INTEGER')],
+}
+
+class ImageStore:
+    def __init__(self, database_file):
+        self.database_file = database_file
+        self.legacy_file = f"{database_file}.csv"
+
+        # older versions kept photos.db as a csv file.  move it aside so we can migrate it.  a file
+        # that is neither was damaged, and we start again without it
+        if os.path.exists(database_file) and not ImageStore.is_sqlite(database_file):
+            if ImageStore.is_legacy_csv(database_file):
+                print(f"Found legacy csv database at {database_file}")
+                os.replace(database_file, self.legacy_file)
+            else:
+                print(f"{database_file} is not a database, it was kept at {self.move_aside()}")
+
+        # sqlite removes the wal file when the last connection closes cleanly.  if one is still
+        # there the last run was cut off, eg. by a power cut, so make sure the file survived it
+        unclean = os.path.exists(f"{database_file}-wal")
+        self.connection = self.connect()
+        if unclean and not self.is_intact():
+            self.recover()
+
+        with self.connection:
+            self.connection.execute(CREATE_IMAGES_TABLE)
+            self.connection.execute(CREATE_ALBUMS_TABLE)
+            self.connection.execute(CREATE_ALBUM_ASSETS_TABLE)
+            self.add_missing_columns()
+
+        if os.path.exists(self.legacy_file):
+            # left by a version that took any file it couldnt read for a csv
+            if ImageStore.is_legacy_csv(self.legacy_file):
+                self.migrate_csv(self.legacy_file)
+            else:
+                corrupt_file = f"{self.database_file}.corrupt"
+                print(f"{self.legacy_file} is not a csv database, it was kept at {corrupt_file}")
+                os.replace(self.legacy_file, corrupt_file)
+
+    def connect(self):
+        connection = sqlite3.connect(self.database_file)
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            # in wal mode a power cut can lose the last commits but never leaves a half written one
+            connection.execute("PRAGMA synchronous=NORMAL")
+        except sqlite3.DatabaseError as e:
+            # not readable at all.  is_intact will say so
+            print(f"Unable to open {self.database_file}: {e}")
+        return connection
+
+    def is_intact(self):
+        try:
+            result = self.connection.execute("PRAGMA quick_check").fetchone()[0]
+        except sqlite3.DatabaseError as e:
+            result = str(e)
+        if result != "ok":
+            print(f"Database check failed: {result}")
+        return result == "ok"
+
+    def recover(self):
+        # move the damaged file aside and start a new one with whatever rows can still be read.
+        # keeping the rows means the cached photos dont have to be downloaded again
+        self.connection.close()
+        corrupt_file = self.move_aside()
+
+        rows = []
+        source = sqlite3.connect(corrupt_file)
+        try:
+            for row in source.execute(SELECT_IMAGES):
+                rows.append(row)
+        except sqlite3.DatabaseError as e:
+            print(f"Stopped reading {corrupt_file}: {e}")
+        finally:
+            source.close()
+
+        self.connection = self.connect()
+        with self.connection:
+            self.connection.execute(CREATE_IMAGES_TABLE)
+            self.connection.executemany(UPSERT_IMAGE, rows)
+        print(f"Recovered {len(rows)} images, the damaged database was kept at {corrupt_file}")
+
+    def move_aside(self):
+        # the damaged file and its wal are kept beside the new one in case anything can be saved from them
+        corrupt_file = f"{self.database_file}.corrupt"
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.exists(f"{self.database_file}{suffix}"):
+                os.replace(f"{self.database_file}{suffix}", f"{corrupt_file}{suffix}")
+        return corrupt_file
+
+    @staticmethod
+    def is_sqlite(file_path):
+        with open(file_path, 'rb') as file:
+            header = file.read(len(SQLITE_HEADER))
+        # an empty file is fine for sqlite to take over
+        return len(header) == 0 or header == SQLITE_HEADER
+
+    @staticmethod
+    def is_legacy_csv(file_path):
+        # the csv store was text with album, asset, path, last used date and use count on every row
+        import csv
+        try:
+            with open(file_path, 'r', newline='', encoding='utf-8') as file:
+                for row in csv.reader(file):
+                    if len(row) == 0:
+                        continue
+                    if len(row) != 5:
+                        return False
+                    time.strptime(row[3], '%Y-%m-%d %H:%M:%S')
+                    int(row[4])
+        except (UnicodeDecodeError, csv.Error, ValueError):
+            return False
+        return True
+
+    def add_missing_columns(self):
+        for table, columns in ADDED_COLUMNS.items():
+            existing = [row[1] for row in self.connection.execute(f"PRAGMA table_info({table})")]
+            for name, column_type in columns:
+                if name not in existing:
+                    self.connection.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+    def migrate_csv(self, csv_file):
+        import csv
+        import calendar
+        print(f"Migrating {csv_file} into {self.database_file}")
+        rows = []
+        with open(csv_file, 'r', newline='') as csvfile:
+            reader = csv.reader(csvfile)
+            for row in reader:
+                if len(row) < 5:
+                    continue
+                album_id, asset_id, file_path, last_used_date, use_count = row[:5]
+                last_used = calendar.timegm(time.strptime(last_used_date, '%Y-%m-%d %H:%M:%S'))
+                rows.append((album_id, asset_id, file_path or None, last_used, int(use_count), None, 0, None))
+
+        # the insert is a single transaction so an interrupted migration just runs again next time
+        with self.connection:
+            self.connection.executemany(UPSERT_IMAGE, rows)
+        os.replace(csv_file, f"{csv_file}.migrated")
+        print(f"Migrated {len(rows)} rows")
+
+    def load(self):
+        # a cursor rather than a list so a big database is never in memory twice
+        return self.connection.execute(SELECT_IMAGES)
+
+    def write(self, rows, deleted_keys):
+        with self.connection:
+            if len(deleted_keys) > 0:
+                self.connection.executemany(
+                    "DELETE FROM images WHERE album_id = ? AND asset_id = ?", deleted_keys)
+            if len(rows) > 0:
+                self.connection.executemany(UPSERT_IMAGE, rows)
+
+    def load_albums(self):
+        # album_id -> (version, etag, [asset rows])
+        albums = {}
+        for album_id, version, etag in self.connection.execute("SELECT album_id, version, etag FROM albums"):
+            albums[album_id] = (version, etag, [])
+        cursor = self.connection.execute(
+            "SELECT album_id, asset_id, original_file_name, original_mime_type, checksum, file_size, orientation, width, height "
+            "FROM album_assets")
+        for row in cursor:
+            album = albums.get(row[0])
+            if album is not None:
+                album[2].append(row[1:])
+        return albums
+
+    def write_album(self, album_id, version, etag, asset_rows):
+        # asset_rows replaces everything we had for the album
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO albums (album_id, version, etag) VALUES (?, ?, ?)", (album_id, version, etag))
+            self.connection.execute("DELETE FROM album_assets WHERE album_id = ?", (album_id,))
+            self.connection.executemany(
+                "INSERT INTO album_assets (album_id, asset_id, original_file_name, original_mime_type, checksum, file_size, "
+                "orientation, width, height) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", 
+                [(album_id, *row) for row in asset_rows])
+
+    def prune_albums(self, album_ids):
+        # forget every album that isnt in album_ids
+        with self.connection:
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS keep_albums (album_id TEXT PRIMARY KEY)")
+            self.connection.execute("DELETE FROM keep_albums")
+            self.connection.executemany("INSERT OR IGNORE INTO keep_albums VALUES (?)", [(album_id,) for album_id in album_ids])
+            self.connection.execute("DELETE FROM albums WHERE album_id NOT IN (SELECT album_id FROM keep_albums)")
+            self.connection.execute("DELETE FROM album_assets WHERE album_id NOT IN (SELECT album_id FROM keep_albums)")
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute("DELETE FROM images")
+            self.connection.execute("DELETE FROM albums")
+            self.connection.execute("DELETE FROM album_assets")
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,89 @@
+import os
+from PIL import Image, ImageOps, ImageColor
+
+from screen import ScreenResolution
+
+# pillow only reads heic with the pillow-heif plugin.  without it those images fall back to imagemagick
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    pass
+
+# imagemagick rotates clockwise for positive angles, pillow rotates counter clockwise
+ROTATIONS = {
+    "90": Image.Transpose.ROTATE_270,
+    "-90": Image.Transpose.ROTATE_90,
+}
+
+def get_fit_size(width, height, target_resolution : ScreenResolution, shrink_only):
+    # matches imagemagick "-resize WxH" and "-resize WxH>" geometry
+    scale = min(target_resolution.width / width, target_resolution.height / height)
+    if shrink_only and scale >= 1:
+        return (width, height)
+    return (max(1, round(width * scale)), max(1, round(height * scale)))
+
+def fit_image(image : Image, target_resolution : ScreenResolution, rotation, preserve_aspect = True, background = None) -> Image:
+    # rotate, resize and letterbox an upright image for the screen.  background is an rgb tuple or None
+    if rotation in ROTATIONS:
+        image = image.transpose(ROTATIONS[rotation])
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    size = get_fit_size(image.width, image.height, target_resolution, preserve_aspect)
+    if size != image.size:
+        image = image.resize(size, Image.Resampling.LANCZOS)
+
+    if background is not None and image.size != tuple(target_resolution.resolution):
+        letterboxed = Image.new('RGB', tuple(target_resolution.resolution), background)
+        letterboxed.paste(image, ((target_resolution.width - image.width) // 2,
+                                  (target_resolution.height - image.height) // 2))
+        image = letterboxed
+    return image
+
+def save_image(image : Image, output_path, **params):
+    # write next to the output and swap it in so a crash never leaves half an image behind
+    root, extension = os.path.splitext(output_path)
+    temp_path = f"{root}.tmp{extension}"
+    image.save(temp_path, **params)
+    os.replace(temp_path, output_path)
+
+def transform_image(input_path, output_path, target_resolution : ScreenResolution, get_rotation,
+                    preserve_aspect = True, letterbox_color = None, master_path = None, master_edge = None) -> ScreenResolution:
+    """
+    Decode, orient, rotate, resize and letterbox an image in a single pass with pillow.
+
+    :param input_path: The image to read.
+    :param output_path: Where to write the result.  Can be the same as input_path.
+    :param target_resolution: The resolution of the screen.
+    :param get_rotation: Called with the upright image resolution and returns the imagemagick style rotation ("90", "-90" or None).
+    :param preserve_aspect: Only shrink images, never enlarge them.
+    :param letterbox_color: Pad the image to the full target resolution with this color.  None to disable.
+    :param master_path: Also write the upright image here as a jpeg, shrunk to fit in master_edge.  None to skip.
+    :param master_edge: Longest edge of the master.
+    :return: The upright resolution of the source image.
+    """
+    # resolve the color first so a bad color name fails before we decode anything
+    background = ImageColor.getrgb(letterbox_color) if letterbox_color is not None else None
+
+    with Image.open(input_path) as image:
+        # let jpeg decode straight to a smaller size.  it stays at least as big as the longest screen edge,
+        # or the master when there is one
+        longest_edge = max(target_resolution.width, target_resolution.height)
+        if master_path is not None:
+            longest_edge = max(longest_edge, master_edge)
+        image.draft('RGB', (longest_edge, longest_edge))
+
+        image = ImageOps.exif_transpose(image)
+        source_resolution = ScreenResolution([image.width, image.height])
+        if master_path is not None:
+            # the screen image is fitted from the master so it comes out the same as a later refit
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            image.thumbnail((master_edge, master_edge), Image.Resampling.LANCZOS)
+            save_image(image, master_path, quality=90)
+        image = fit_image(image, target_resolution, get_rotation(source_resolution), preserve_aspect, background)
+        save_image(image, output_path, quality=95)
+
+    return source_resolution
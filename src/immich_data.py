@@ -1,52 +1,155 @@
 
-import requests
 import json
 import os
 
-from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
+
+from profiler import profiler
+
+# requests and tqdm are imported where they are used so offline runs never load the network stack
 
 API_ADDR = "/api"
 GET_ALBUMS_API = f"/albums"
-GET_ASSETINFO_API = f"/assets"
 POST_DOWNLOADARCHIVE_API = f"/download/archive"
+GET_THUMBNAIL_API = "/assets/{}/thumbnail"
+GET_ORIGINAL_API = "/assets/{}/original"
+
+# the renditions immich makes of every photo, by the longest edge it makes them at out of the box.
+# the preview size can be changed in immich's image settings, see PreviewSize
+RENDITION_SIZES = {"thumbnail": 250, "preview": 1440}
+
+# the album fields kept from the payload, everything but the assets is only needed for the version
+ALBUM_FIELDS = ["id", "updatedAt", "lastModifiedAssetTimestamp", "assetCount"]
 
 class ImmichAssetData:
-    def __init__(self, asset_dict):
-        self.asset_dict = asset_dict
+    # just the fields we use out of immich's asset.  an album can hold tens of thousands of these
+    # so the rest of the payload is dropped as soon as it is parsed
+    __slots__ = ['id', 'original_file_name', 'original_mime_type', 'checksum', 'file_size', 'orientation', 'width', 'height']
+
+    def __init__(self, asset_id, original_file_name = None, original_mime_type = None, checksum = None,
+                 file_size = None, orientation = None, width = None, height = None):
+        self.id = asset_id
+        self.original_file_name = original_file_name
+        self.original_mime_type = original_mime_type
+        self.checksum = checksum
+        self.file_size = file_size
+        self.orientation = orientation
+        self.width = width
+        self.height = height
 
-    def __getattr__(self, name):
-        return self.asset_dict.get(name)
+    @classmethod
+    def from_dict(cls, asset_dict):
+        exif_info = asset_dict.get("exifInfo") or {}
+        return cls(asset_dict.get("id"), 
+                   asset_dict.get("originalFileName"), 
+                   asset_dict.get("originalMimeType"), 
+                   asset_dict.get("checksum"),
+                   exif_info.get("fileSizeInByte"), 
+                   exif_info.get("orientation"),
+                   exif_info.get("exifImageWidth"), 
+                   exif_info.get("exifImageHeight"))
     
-class ImmichAlbum(ImmichAssetData):
-    def __init__(self, asset_dict):
-        super().__init__(asset_dict)
-        self.album_id = self.id
+class ImmichAlbum:
+    def __init__(self, album_id):
+        self.album_id = album_id
         self.image_assets = {}
 
-        for asset_data in self.assets:
-            asset = ImmichAssetData(asset_data)
-            if asset.type== "IMAGE":
-                self.add_asset(asset)
-            else:
-                print(f"Ignoring asset {asset.id} from Album {self.album_id} - we dont handle \"{asset.type}\" types")
+        # version and etag let the next sync skip the album when nothing changed.
+        # changed is False when the album came from our local manifest as is
+        self.version = None
+        self.etag = None
+        self.changed = True
+
+    @classmethod
+    def from_stream(cls, chunks):
+        # builds the album while the response is still arriving, one asset at a time, so peak
+        # memory doesnt grow with the size of the album payload
+        from json_stream import iter_members
+        album = cls(None)
+        fields = {}
+        ignored = []
+        for key, value in iter_members(chunks, stream_keys={"assets"}):
+            if key == "assets":
+                if value.get("type") == "IMAGE":
+                    album.add_asset(ImmichAssetData.from_dict(value))
+                else:
+                    ignored.append((value.get("id"), value.get("type")))
+            elif key in ALBUM_FIELDS:
+                fields[key] = value
+
+        album.album_id = fields.get("id")
+        album.version = ImmichAlbum.get_version(fields)
+        for asset_id, asset_type in ignored:
+            print(f"Ignoring asset {asset_id} from Album {album.album_id} - we dont handle \"{asset_type}\" types")
+        return album
 
     def add_asset(self, asset : ImmichAssetData):
         self.image_assets[asset.id] = asset
 
     def get_asset(self, asset_id) -> ImmichAssetData:
         return self.image_assets.get(asset_id)
+
+    @staticmethod
+    def get_version(album_dict):
+        if album_dict.get("updatedAt") is None:
+            return None
+        return f"{album_dict.get('updatedAt')}/{album_dict.get('lastModifiedAssetTimestamp')}/{album_dict.get('assetCount')}"
+
+    @classmethod
+    def from_manifest(cls, album_id, version, etag, asset_rows):
+        album = cls(album_id)
+        for row in asset_rows:
+            album.add_asset(ImmichAssetData(*row))
+        album.version = version
+        album.etag = etag
+        album.changed = False
+        return album
+
+    def to_manifest(self):
+        return [(asset.id, asset.original_file_name, asset.original_mime_type, asset.checksum, 
+                 asset.file_size, asset.orientation, asset.width, asset.height)
+                for asset in self.image_assets.values()]
             
 
+def make_session(pool_size, retries, allowed_methods = ("GET",)):
+    # one keep-alive session for every request so we only pay for the tcp and tls handshake once.
+    # allowed_methods are retried with backoff, they should be the idempotent ones
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(total=retries, 
+                  backoff_factor=0.5, 
+                  status_forcelist=[429, 500, 502, 503, 504],
+                  allowed_methods=list(allowed_methods))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
 class ImmichConnection:
-    def __init__(self, server_url, api_key):
+    def __init__(self, server_url, api_key, timeout = 30, retries = 3, pool_size = 8):
         self.server_url = f"{server_url}{API_ADDR}"
         self.api_key = api_key
         self.albums = {}
+
+        # (connect, read) timeouts.  the read timeout is per chunk so it also works for big downloads
+        self.timeout = (min(10, timeout), timeout)
+        self.pool_size = pool_size
+
+        # the archive download is a POST and handles its own retries
+        self.session = make_session(pool_size, retries)
+        self.session.headers.update({'x-api-key': self.api_key})
     
     def get_album(self, album_id) -> ImmichAlbum:
         return self.albums.get(album_id)
     
-    def sync_album(self, album_id) -> ImmichAlbum:
+    def sync_album(self, album_id, cached : ImmichAlbum = None) -> ImmichAlbum:
+        with profiler.stage("sync_album", album=album_id):
+            return self.fetch_album(album_id, cached)
+
+    def fetch_album(self, album_id, cached : ImmichAlbum = None) -> ImmichAlbum:
         url = f"{self.server_url}{GET_ALBUMS_API}/{album_id}"
 
         payload = {}
@@ -55,42 +158,58 @@ class ImmichConnection:
         'x-api-key': self.api_key
         }
 
+        # a cheap look at the album without its assets tells us if our copy is still current
+        version = None
+        if cached is not None and cached.version is not None:
+            response = self.session.request("GET", url, headers=headers, params={'withoutAssets': 'true'}, timeout=self.timeout)
+            if response.status_code == 200:
+                version = ImmichAlbum.get_version(json.loads(response.text))
+                if version == cached.version:
+                    print(f"Album {album_id} is unchanged")
+                    self.albums[album_id] = cached
+                    return cached
+
+        if cached is not None and cached.etag is not None:
+            headers['If-None-Match'] = cached.etag
+
         print(f"Fetching album {album_id}")
-        response = requests.request("GET", url, headers=headers, data=payload)
-        if response.status_code == 200:
-            album_info = ImmichAlbum(json.loads(response.text))
-            self.albums[album_id] = album_info
-            return album_info            
-        else:
-            print(f"Failed to fetch album. Status code: {response.status_code}")
+        with self.session.request("GET", url, headers=headers, data=payload, timeout=self.timeout, stream=True) as response:
+            if response.status_code == 304 and cached is not None:
+                print(f"Album {album_id} assets are unchanged")
+                cached.version = version
+                cached.changed = True
+                self.albums[album_id] = cached
+                return cached
+            elif response.status_code == 200:
+                album_info = ImmichAlbum.from_stream(profiler.count_bytes("album_bytes", response.iter_content(chunk_size=65536)))
+                album_info.etag = response.headers.get('ETag')
+                self.albums[album_id] = album_info
+                return album_info            
+            else:
+                print(f"Failed to fetch album. Status code: {response.status_code}")
 
         return None
-    
-    def get_asset_info(self, asset_id):
-        url = f"{self.server_url}{GET_ASSETINFO_API}/{asset_id}"
 
-        payload = {}
-        headers = {
-        'Accept': 'application/json',
-        'x-api-key': self.api_key
-        }
-
-        print(f"Fetching asset info {asset_id}")
-        response = requests.request("GET", url, headers=headers, data=payload)
-        if response.status_code == 200:
-            asset_info = ImmichAssetData(json.loads(response.text))
-            return asset_info            
-        else:
-            print(f"Failed to fetch asset info. Status code: {response.status_code}")
+    @profiler.timed("sync_albums")
+    def sync_albums(self, album_ids, manifest = None):
+        # fetch albums concurrently over the shared session.  returns album_id -> album (None on failure)
+        # manifest is album_id -> ImmichAlbum from the last sync so unchanged albums are skipped
+        album_ids = list(album_ids)
+        manifest = manifest or {}
+        with ThreadPoolExecutor(max_workers=max(1, min(len(album_ids), self.pool_size))) as executor:
+            albums = list(executor.map(lambda album_id: self.try_sync_album(album_id, manifest.get(album_id)), album_ids))
+        return dict(zip(album_ids, albums))
 
-        return None
+    def try_sync_album(self, album_id, cached = None):
+        import requests
+        try:
+            return self.sync_album(album_id, cached)
+        except (requests.RequestException, ValueError) as e:
+            print(f"Failed to fetch album {album_id}: {e}")
+            return None
     
-    def download_assets(self, assets_to_download, output_file, force = False):
-
-        if len(assets_to_download) == 0:
-            print(f"Downloading 0 assets.... dumbass")
-            return False
-        
+    def stream_assets(self, assets_to_download):
+        # generator yielding the archive in chunks as it arrives
         url = f"{self.server_url}{POST_DOWNLOADARCHIVE_API}"
         payload = json.dumps({
             "assetIds": [d['asset_id'] for d in assets_to_download]
@@ -101,25 +220,60 @@ class ImmichConnection:
             'x-api-key': self.api_key
         }
 
-        with requests.post(url, headers=headers, data=payload, stream=True) as response:
-            if response.status_code == 200:
-                total_size = int(response.headers.get('content-length', 0))
-                with open(output_file, 'wb') as f, tqdm( desc=f"\tDownloading {len(assets_to_download)} assets", 
-                                                         total=total_size,
-                                                         unit='B',
-                                                         unit_scale=True,
-                                                         unit_divisor=1024) as progress_bar:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        f.write(chunk)
-                        progress_bar.update(len(chunk))
-
-                print(f"Assets downloaded to: {output_file}")
-                return True
-            else:
-                print(f"Failed to download assets. Status code: {response.status_code}:\n{response.text}")
+        with self.session.post(url, headers=headers, data=payload, stream=True, timeout=self.timeout) as response, \
+             profiler.stage("download", assets=len(assets_to_download)):
+            if response.status_code != 200:
+                raise IOError(f"Failed to download assets. Status code: {response.status_code}:\n{response.text}")
 
-        return False
+            from tqdm import tqdm
+            total_size = int(response.headers.get('content-length', 0))
+            with tqdm( desc=f"\tDownloading {len(assets_to_download)} assets", 
+                       total=total_size,
+                       unit='B',
+                       unit_scale=True,
+                       unit_divisor=1024) as progress_bar:
+                for chunk in profiler.count_bytes("download_bytes", response.iter_content(chunk_size=65536)):
+                    progress_bar.update(len(chunk))
+                    yield chunk
 
+    def download_asset(self, asset_id, output_file, rendition = None):
+        # a single asset straight to output_file.  rendition is one of RENDITION_SIZES, or None for the original
+        if rendition is None:
+            url = f"{self.server_url}{GET_ORIGINAL_API.format(asset_id)}"
+            params = None
+        else:
+            url = f"{self.server_url}{GET_THUMBNAIL_API.format(asset_id)}"
+            params = {'size': rendition}
+
+        with self.session.get(url, params=params, stream=True, timeout=self.timeout) as response, \
+             profiler.stage("download_asset", asset=asset_id, rendition=rendition or "original"):
+            if response.status_code != 200:
+                raise IOError(f"Failed to download asset {asset_id}. Status code: {response.status_code}")
+            # written beside output_file and swapped in so a dropped connection never leaves half a photo
+            temp_file = f"{output_file}.part"
+            try:
+                with open(temp_file, 'wb') as file:
+                    for chunk in profiler.count_bytes("download_bytes", response.iter_content(chunk_size=65536)):
+                        file.write(chunk)
+                os.replace(temp_file, output_file)
+            except BaseException:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+                raise
 
+    def download_assets(self, assets_to_download, output_file, force = False):
 
+        if len(assets_to_download) == 0:
+            print(f"Downloading 0 assets.... dumbass")
+            return False
+
+        try:
+            with open(output_file, 'wb') as f:
+                for chunk in self.stream_assets(assets_to_download):
+                    f.write(chunk)
+        except IOError as e:
+            print(e)
+            return False
 
+        print(f"Assets downloaded to: {output_file}")
+        return True
@@ -0,0 +1,95 @@
+import json
+import codecs
+
+WHITESPACE = ' \t\n\r'
+# what can follow a value.  anything else means a number was cut off by the end of a chunk
+DELIMITERS = WHITESPACE + ',]}:'
+
+class JsonStreamError(ValueError):
+    pass
+
+class JsonChunkReader:
+    """
+    Reads JSON values out of a stream of utf-8 chunks.  Only the text of the value being read
+    is kept, everything before it is dropped as soon as it has been decoded.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.decoder = json.JSONDecoder()
+        self.text = ''
+        self.position = 0
+        self.finished = False
+
+    def fill(self):
+        if self.finished:
+            raise JsonStreamError("JSON ended early")
+        try:
+            data = self.utf8.decode(next(self.chunks))
+        except StopIteration:
+            data = self.utf8.decode(b'', final=True)
+            self.finished = True
+        self.text = self.text[self.position:] + data
+        self.position = 0
+
+    def skip_whitespace(self):
+        while True:
+            while self.position < len(self.text) and self.text[self.position] in WHITESPACE:
+                self.position += 1
+            if self.position < len(self.text):
+                return
+            self.fill()
+
+    def next_is(self, character):
+        # consumes character if it is up next
+        self.skip_whitespace()
+        if self.text[self.position] == character:
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, characters):
+        self.skip_whitespace()
+        character = self.text[self.position]
+        if character not in characters:
+            raise JsonStreamError(f"Expected one of {characters!r} but found {character!r}")
+        self.position += 1
+        return character
+
+    def value(self):
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.text, self.position)
+                if self.finished or (end < len(self.text) and self.text[end] in DELIMITERS):
+                    self.position = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.finished:
+                    raise JsonStreamError(str(e))
+            self.fill()
+
+def iter_members(chunks, stream_keys = ()):
+    """
+    Walks the members of a top level JSON object as its text arrives, yielding (key, value).
+    Arrays under stream_keys are yielded an element at a time under their key instead of as
+    one list, so a huge list is never held in memory.
+    """
+    reader = JsonChunkReader(chunks)
+    reader.expect('{')
+    if reader.next_is('}'):
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key in stream_keys and reader.next_is('['):
+            if not reader.next_is(']'):
+                while True:
+                    yield key, reader.value()
+                    if reader.expect(',]') == ']':
+                        break
+        else:
+            yield key, reader.value()
+        if reader.expect(',}') == '}':
+            return
@@ -0,0 +1,68 @@
+import json
+import hashlib
+
+from helpers import Orientation, get_rotation
+from screen import ScreenResolution
+from quantizer import DITHER_MODES
+
+# largest panel edge a render server will render for
+MAX_EDGE = 4096
+
+class PanelProfile:
+    """
+    Everything that decides how a photo ends up on one kind of panel: its resolution and palette,
+    the dither mode, and how photos are rotated and fitted to it.  A render server keeps a set of
+    frames per profile, so panels with the same settings share them.
+    """
+
+    def __init__(self, resolution, palette, saturation, dither = "floyd-steinberg", preferred_orientation = "landscape",
+                 force_orientation = False, preserve_aspect = True, letterbox_color = None):
+        self.resolution = ScreenResolution([int(edge) for edge in resolution])
+        self.palette = [int(value) for value in palette]
+        self.saturation = float(saturation)
+        self.dither = dither
+        self.preferred_orientation = preferred_orientation
+        self.force_orientation = bool(force_orientation)
+        self.preserve_aspect = bool(preserve_aspect)
+        self.letterbox_color = letterbox_color
+        self.key = hashlib.sha1(json.dumps(self.to_dict(), sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+    @classmethod
+    def from_settings(cls, settings, screen):
+        return cls(screen.resolution.resolution, screen.get_palette(), screen.saturation,
+                   settings.get_setting("Dither", "floyd-steinberg"),
+                   settings.get_setting("PreferredOrientation", "landscape"),
+                   settings.ForceOrientation, settings.PreserveAspect,
+                   settings.LetterboxColor if settings.Letterbox else None)
+
+    def to_dict(self):
+        return {'resolution': self.resolution.resolution, 'palette': self.palette, 'saturation': self.saturation,
+                'dither': self.dither, 'preferred_orientation': self.preferred_orientation,
+                'force_orientation': self.force_orientation, 'preserve_aspect': self.preserve_aspect,
+                'letterbox_color': self.letterbox_color}
+
+    @classmethod
+    def from_dict(cls, profile_dict):
+        # comes from the network, so anything odd is a ValueError rather than a render that fails later
+        from PIL import ImageColor
+        resolution = [int(edge) for edge in profile_dict['resolution']]
+        if len(resolution) != 2 or not all(0 < edge <= MAX_EDGE for edge in resolution):
+            raise ValueError(f"Bad resolution {resolution}")
+        palette = [int(value) for value in profile_dict['palette']]
+        if len(palette) % 3 != 0 or not 3 <= len(palette) <= 768 or not all(0 <= value <= 255 for value in palette):
+            raise ValueError("Bad palette")
+        if profile_dict.get('dither', "floyd-steinberg") not in DITHER_MODES:
+            raise ValueError(f"Unknown dither mode {profile_dict.get('dither')}")
+        Orientation.from_string(profile_dict.get('preferred_orientation', "landscape"))
+        if profile_dict.get('letterbox_color') is not None:
+            ImageColor.getrgb(profile_dict['letterbox_color'])
+        return cls(resolution, palette, profile_dict['saturation'],
+                   profile_dict.get('dither', "floyd-steinberg"),
+                   profile_dict.get('preferred_orientation', "landscape"),
+                   profile_dict.get('force_orientation', False),
+                   profile_dict.get('preserve_aspect', True),
+                   profile_dict.get('letterbox_color'))
+
+    def get_rotation(self, asset_orientation : Orientation):
+        return get_rotation(asset_orientation, self.resolution.orientation,
+                            Orientation.from_string(self.preferred_orientation), self.force_orientation)
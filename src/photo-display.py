@@ -1,18 +1,20 @@
 
+import time
+script_start_time = time.perf_counter()
+
 import os
 import sys
-import time
+import json
 import fcntl
 import atexit
 import argparse
 import subprocess
-from PIL import Image
 from urllib.parse import urlparse
 
-from immich_data import ImmichConnection
-from image_database import ImageDatabase
 from settings import Settings
 from screen import Screen
+from daemon import PhotoDaemon, send_command
+from profiler import profiler
 
 def sanitize_host(url):
     """
@@ -28,6 +30,7 @@ def sanitize_host(url):
         host = host[4:]
     return host
 
+@profiler.timed("ping")
 def ping_server(url, count=4, timeout=2):
     """
     Ping a server to check if a connection can be made.
@@ -41,6 +44,7 @@ def ping_server(url, count=4, timeout=2):
     print(f"Checking connection to {host}")
     try:
         # Perform the ping command
+        profiler.count("subprocesses")
         output = subprocess.run(
             ["ping", "-c", str(count), "-W", str(timeout), host],
             stdout=subprocess.PIPE,
@@ -59,63 +63,314 @@ def ping_server(url, count=4, timeout=2):
         print(f"An error occurred while pinging {host}: {e}")
         return False
     
-def OpenImage(image, resolution):    
-    print(f"Opening {image.file_path}")
-    resizedimage = Image.open(image.file_path).resize(resolution.resolution)
-    return resizedimage    
+def create_frame_cache(settings, screen):
+    from frame_cache import FrameCache
+    frame_directory = settings.get_setting("FrameCachePath", os.path.join(settings.DataPath, "frames"))
+    return FrameCache(frame_directory, screen.resolution, screen.get_palette(), screen.saturation,
+                      settings.get_setting("Dither", "floyd-steinberg"))
+
+def get_process_age():
+    """
+    Seconds since the process was started by the OS, so interpreter startup and imports are included.
+
+    :return: Seconds since the process started.
+    """
+    try:
+        with open("/proc/self/stat", 'r') as file:
+            # the command name can have spaces so skip past it before splitting
+            fields = file.read().rsplit(')', 1)[1].split()
+        with open("/proc/uptime", 'r') as file:
+            uptime = float(file.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, IndexError, ValueError):
+        return time.perf_counter() - script_start_time
+
+@profiler.timed("sync")
+def sync(settings, immich, database, force_refresh = False):
+    """
+    Sync the local database with immich.
+
+    :param settings: The loaded settings.
+    :param immich: The immich connection.
+    :param database: The image database.
+    :param force_refresh: Wipe everything local before syncing.
+    :return: True if the sync ran, False if immich couldnt be reached.
+    """
+    # ping hte server to ensure we have a connection
+    if not ping_server(settings.ImmichServerUrl):
+        print("Unable to connect to Immich server.  Running offline.")
+        return False
+
+    # wipe everything local before we start
+    if force_refresh:
+        database.purge_all()
+
+    # bit of a hack so we dont purge everything if we fail to get an album
+    # TODO: fix this up so we only attempt to purge successful albums
+    albums = immich.sync_albums(settings.Albums, database.load_album_manifest())
+    if None in albums.values():
+        return False
+
+    database.purge_missing(immich)
+    # refit what is cached after a change to the screen settings, and drop what cant be so it is downloaded again
+    database.refresh_renders()
+    database.process_albums(immich)
+    database.enforce_cache_budget()
+
+    # catch up frames after a change to the screen settings
+    database.prepare_frames()
+    return True
+
+@profiler.timed("sync")
+def sync_render_server(settings, client, database, force_refresh = False):
+    """
+    Sync the local database and frames with a render server.
+
+    :param settings: The loaded settings.
+    :param client: The render client.
+    :param database: The image database.
+    :param force_refresh: Wipe everything local before syncing.
+    :return: True if the sync ran, False if the server couldnt be reached.
+    """
+    if not ping_server(settings.RenderServerUrl):
+        print("Unable to connect to the render server.  Running offline.")
+        return False
+
+    if force_refresh:
+        database.purge_all()
+    return client.sync(database)
+
+def create_immich_connection(settings):
+    from immich_data import ImmichConnection
+    return ImmichConnection(settings.ImmichServerUrl, settings.ApiKey,
+                            timeout=settings.get_setting("HttpTimeout", 30),
+                            retries=settings.get_setting("HttpRetries", 3),
+                            pool_size=settings.get_setting("HttpPoolSize", 8))
+
+def create_render_client(settings, screen):
+    from render_client import RenderClient
+    from panel_profile import PanelProfile
+    return RenderClient(settings.RenderServerUrl, PanelProfile.from_settings(settings, screen),
+                        os.path.join(settings.DataPath, "render_client.json"),
+                        timeout=settings.get_setting("HttpTimeout", 30),
+                        retries=settings.get_setting("HttpRetries", 3),
+                        pool_size=settings.get_setting("HttpPoolSize", 8))
+
+def show_next_image(prefetcher, screen):
+    """
+    Show the next image and start preparing the one after it.
+
+    :param prefetcher: The prefetcher holding the upcoming frames.
+    :param screen: The screen to show the frame on.
+    """
+    with profiler.stage("next_frame"):
+        target_image, frame = prefetcher.next()
+    if target_image is not None:
+        print(f"Displaying {target_image.file_path}")
+        with profiler.stage("set_image", asset=target_image.asset_id):
+            screen.set_image(frame)
+    profiler.export()
+
+def sync_prefetched(run_sync, prefetcher):
+    # anything picked ahead may be gone after the sync, so start the lookahead over
+    prefetcher.clear()
+    result = run_sync()
+    prefetcher.fill()
+    return result
+
+def fetch_requested(settings, immich, database, prefetcher):
+    """
+    Fetch the evicted images the picker has asked for since the last sync, using the albums from that sync.
+
+    :return: True if anything was fetched.
+    """
+    if len(database.pending) == 0 or len(immich.albums) == 0:
+        return False
+    if not ping_server(settings.ImmichServerUrl):
+        print("Unable to connect to Immich server.  Fetching next time.")
+        return False
+
+    prefetcher.clear()
+    database.process_albums(immich)
+    database.enforce_cache_budget()
+    prefetcher.fill()
+    return True
+
+def start_buttons(settings, daemon):
+    """
+    Listen for the panel buttons and hand their presses to the daemon.
+
+    :param settings: The loaded settings.
+    :param daemon: The running daemon the presses are posted to.
+    :return: The started ButtonListener, or None if there are no buttons to listen for.
+    """
+    from buttons import ButtonListener, start_network, DEFAULT_BUTTON_PATH, DEFAULT_BUTTONS
+    button_path = settings.get_setting("ButtonPath", DEFAULT_BUTTON_PATH)
+    actions = {button: action for button, action in settings.get_setting("Buttons", DEFAULT_BUTTONS).items() if action}
+    for button, action in actions.items():
+        if action != "network" and action not in PhotoDaemon.COMMANDS:
+            print(f"Unknown action {action} for button {button}")
+    if len(actions) == 0 or not os.path.isdir(button_path):
+        return None
+
+    network_service = settings.get_setting("NetworkService", "NetworkManager")
+    def on_press(button, detected_at):
+        action = actions[button]
+        print(f"Button {button} pressed: {action}")
+        if action == "network":
+            start_network(network_service)
+        elif action in PhotoDaemon.COMMANDS:
+            daemon.post(action, detected_at)
+
+    listener = ButtonListener(button_path, list(actions), on_press)
+    return listener if listener.start() else None
+
+def start_profiler(args, settings):
+    """
+    Turn on stage timings for --profile, or when a prometheus textfile is set up for the metrics.
+
+    :param args: The command line arguments.
+    :param settings: The loaded settings.
+    """
+    textfile = settings.get_setting("PrometheusTextfile", None)
+    if args.profile is None and textfile is None:
+        return
+    json_file = None
+    if args.profile == "json":
+        json_file = settings.get_setting("ProfileFile", os.path.join(settings.DataPath, "profile.jsonl"))
+        print(f"Writing stage timings to {json_file}")
+    profiler.enable(json_file=json_file, textfile=textfile)
+
+def stop_profiler(args):
+    if args.profile == "table":
+        profiler.print_table()
+    elif args.profile == "json":
+        profiler.write_event({'summary': profiler.summary()})
+    profiler.export()
+
+def serve(args, settings):
+    """
+    Run as a render server: sync the albums once for every panel on the network and serve them frames.
+
+    :param args: The command line arguments.
+    :param settings: The loaded settings.
+    """
+    from render_server import MasterDatabase, RenderServer
+
+    database = MasterDatabase(settings)
+    immich = create_immich_connection(settings)
+    server = RenderServer(os.path.join(settings.DataPath, "render"), settings.get_setting("ProcessingThreads", os.cpu_count()))
+    if args.force_refresh:
+        database.purge_all()
+
+    def sync_and_publish():
+        sync(settings, immich, database)
+        server.publish(database)
+
+    # panels get what is already here while the first sync runs
+    server.publish(database)
+    try:
+        server.run(settings.get_setting("RenderServerHost", "0.0.0.0"), settings.get_setting("RenderServerPort", 8420),
+                   sync_and_publish, settings.get_setting("SyncInterval", 86400))
+    finally:
+        database.close()
 
 def main(args):
+    # the database and frames bring in sqlite and pillow.  keep them off the --command path
+    from image_database import ImageDatabase
+    from prefetcher import FramePrefetcher
+
     settings = Settings(args.config)    
+    start_profiler(args, settings)
+
+    if args.serve:
+        try:
+            serve(args, settings)
+        finally:
+            stop_profiler(args)
+        return
+
     screen = Screen(settings)
 
     if args.clean:
-        database = ImageDatabase(settings, screen.resolution)
+        database = ImageDatabase(settings, screen.resolution, create_frame_cache(settings, screen))
         database.purge_all()
+        database.close()
         return
 
     if not args.no_screen:
         screen.init_inky()
 
-    immich = ImmichConnection(settings.ImmichServerUrl, settings.ApiKey)
-    database = ImageDatabase(settings, screen.resolution)
+    frame_cache = create_frame_cache(settings, screen)
+    database = ImageDatabase(settings, screen.resolution, frame_cache)
 
+    # the network stack only gets loaded when we are going to use it.  with a render server the
+    # frames come from there and immich is never contacted
+    immich = None
+    run_sync = None
     if not args.offline:
-
-        # ping hte server to ensure we have a connection
-        if not ping_server(settings.ImmichServerUrl):
-            print("Unable to connect to Immich server.  Running offline.")
+        if settings.RenderServerUrl:
+            client = create_render_client(settings, screen)
+            run_sync = lambda force_refresh = False: sync_render_server(settings, client, database, force_refresh)
         else:
-            no_connection = False
+            immich = create_immich_connection(settings)
+            run_sync = lambda force_refresh = False: sync(settings, immich, database, force_refresh)
+        run_sync(args.force_refresh)
 
-            # wipe everything local before we start
-            if args.force_refresh:
-                database.purge_all()
+    # a single run has no time to use frames prepared ahead
+    run_once = settings.SleepTime <= 0 and not args.daemon
+    prefetcher = FramePrefetcher(database, frame_cache, 0 if run_once else settings.get_setting("PrefetchDepth", 2))
 
-            for album_id in settings.Albums:
+    try:
+        show_next_image(prefetcher, screen)
+        first_frame = get_process_age()
+        profiler.gauge("first_frame_seconds", round(first_frame, 3))
+        print(f"First frame shown {first_frame:.3f}s after process start")
 
-                # bit of a hack so we dont purge everything if we fail to get an album
-                # TODO: fix this up so we only attempt to purge successful albums
-                if immich.sync_album(album_id) is None:
-                    no_connection = True
-                    break
-            
-            if not no_connection:
-                database.purge_missing(immich)
-                database.process_albums(immich)
-      
-    while True:            
-        target_image = database.get_random_image()
-        if target_image is not None:          
-            image = OpenImage(target_image, screen.resolution)
-            print(f"Displaying {target_image.file_path}")
-            screen.set_image(image)
-
-        if settings.SleepTime > 0:
+        if args.daemon:
+            # everything stays loaded and the scheduler takes over the display and sync ticks
+            sleep_time = settings.SleepTime if settings.SleepTime > 0 else 3600
+            daemon = PhotoDaemon(settings.get_setting("SocketPath", default_socket_path),
+                                 display=lambda: show_next_image(prefetcher, screen),
+                                 sync=None if run_sync is None else lambda: sync_prefetched(run_sync, prefetcher),
+                                 display_interval=sleep_time,
+                                 sync_interval=settings.get_setting("SyncInterval", 86400))
+            if immich is not None:
+                fetch_interval = settings.get_setting("FetchInterval", 3600)
+                daemon.scheduler.add_job("fetch", fetch_interval, lambda: fetch_requested(settings, immich, database, prefetcher),
+                                         delay=fetch_interval)
+            buttons = start_buttons(settings, daemon)
+            try:
+                daemon.run()
+            finally:
+                if buttons is not None:
+                    buttons.stop()
+            return
+
+        while settings.SleepTime > 0:
             print(f"Sleeping for {settings.SleepTime} seconds...")
             time.sleep(settings.SleepTime)
-        else:
-            print(f"Sleep time set for {settings.SleepTime} seconds... Exiting")
-            break
+            show_next_image(prefetcher, screen)
+        print(f"Sleep time set for {settings.SleepTime} seconds... Exiting")
+    finally:
+        # writes out usage still held back by SaveInterval
+        prefetcher.close()
+        database.close()
+        stop_profiler(args)
+
+def run_command(args):
+    # talk to a running daemon.  this only needs the socket path so settings, the database and the screen are skipped
+    socket_path = default_socket_path
+    if os.path.exists(args.config):
+        with open(args.config, 'r') as file:
+            socket_path = json.load(file).get('Settings', {}).get('SocketPath') or default_socket_path
+    try:
+        reply = send_command(socket_path, args.command)
+    except OSError as e:
+        print(f"Unable to reach the daemon on {socket_path}: {e}")
+        return False
+    print(reply)
+    return reply.startswith("ok")
     
 parser = argparse.ArgumentParser(description='Display photos from an Immich album onto an Inky Screen.')
 parser.add_argument('--config', help='config json file', default="./config.json", required=False)
@@ -123,9 +378,17 @@ parser.add_argument('--offline', help='dont connect to the network and use what
 parser.add_argument('--no-screen', help='dont init inky screen. useful for debugging', action='store_true', required=False)
 parser.add_argument('--force-refresh', help='Force refresh by clearing everything local and redownloading all photos. Must be online.', action='store_true', required=False)
 parser.add_argument('--clean', help='Clear everything local', action='store_true', required=False)
+parser.add_argument('--daemon', help='stay running and show photos and sync on a schedule. takes commands over a unix socket', action='store_true', required=False)
+parser.add_argument('--serve', help='run as a render server, syncing with immich once and serving ready frames to panels over http', action='store_true', required=False)
+parser.add_argument('--command', help='send a command to a running daemon and exit', choices=PhotoDaemon.COMMANDS, required=False)
+parser.add_argument('--profile', help='time every stage of the run. table prints a summary at exit, json appends each stage to ProfileFile', 
+                    nargs='?', const='table', choices=['table', 'json'], required=False)
 
 
 lock_file_path = "/tmp/photo_display.lock"
+# a render server has its own lock so a panel can run on the same machine
+server_lock_file_path = "/tmp/photo_display_server.lock"
+default_socket_path = "/tmp/photo_display.sock"
 lock_file = None
 
 def release_lock():
@@ -141,7 +404,13 @@ def release_lock():
 if __name__ == "__main__":
     args = parser.parse_args()
 
+    # commands go to the daemon that holds the lock, so they never take it themselves
+    if args.command is not None:
+        sys.exit(0 if run_command(args) else 1)
+
     # handle the file lock
+    if args.serve:
+        lock_file_path = server_lock_file_path
     atexit.register(release_lock) # ensure we release the lock
     try:
         lock_file = open(lock_file_path, "w")
@@ -0,0 +1,77 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from image_database import ImageDatabase
+from frame_cache import FrameCache
+
+class FramePrefetcher:
+    """
+    Picks the next few images ahead of time and loads their frames on a background thread, so
+    showing the next photo doesnt have to wait on a decode or render.
+
+    Picking stays on the calling thread so the database is only ever touched from there, and an
+    image is only marked used once it is actually shown.  With a depth of 0 everything happens
+    when next is called.
+    """
+
+    def __init__(self, database : ImageDatabase, frame_cache : FrameCache, depth = 2):
+        self.database = database
+        self.frame_cache = frame_cache
+        self.depth = depth
+        self.queue = deque()    # (image_data, future) in the order they will be shown
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch") if depth > 0 else None
+
+    def get_queued_keys(self):
+        return {(image_data.album_id, image_data.asset_id) for image_data, _ in self.queue}
+
+    def fill(self):
+        while len(self.queue) < self.depth:
+            image_data = self.database.pick_random_image(exclude=self.get_queued_keys())
+            if image_data is None:
+                break
+            self.queue.append((image_data, self.executor.submit(self.frame_cache.get, image_data.file_path)))
+
+    def next(self):
+        """
+        Take the next image and its frame, mark it used and start preparing the one after.
+
+        :return: (image_data, frame), or (None, None) if there is nothing to show.
+        """
+        # an image that fails to load is skipped.  give up once a full queue worth have failed
+        for _ in range(self.depth + 1):
+            if len(self.queue) > 0:
+                image_data, future = self.queue.popleft()
+            else:
+                image_data = self.database.pick_random_image()
+                future = None
+            if image_data is None:
+                break
+
+            try:
+                frame = future.result() if future is not None else self.frame_cache.get(image_data.file_path)
+            except Exception as e:
+                print(f"Unable to load a frame for {image_data.file_path}: {e}")
+                continue
+
+            self.database.use_image(image_data)
+            self.fill()
+            return image_data, frame
+
+        self.fill()
+        return None, None
+
+    def clear(self):
+        # drop everything queued, eg. before a sync changes what is in the database.  waits for
+        # the frame being loaded so nothing else touches the frame cache while the caller does
+        while len(self.queue) > 0:
+            _, future = self.queue.popleft()
+            if not future.cancel():
+                try:
+                    future.result()
+                except Exception:
+                    pass
+
+    def close(self):
+        self.clear()
+        if self.executor is not None:
+            self.executor.shutdown()
@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import resource
+import threading
+import functools
+from contextlib import contextmanager
+
+METRIC_PREFIX = "photo_display"
+
+class Profiler:
+    """
+    Times the stages of a run and counts what they did (bytes downloaded, subprocesses started).
+
+    Stages are timed with the stage context manager and can be nested or run on worker threads.
+    Until enable is called nothing is recorded, so the calls can stay in place on every run.
+    When json_file is given every finished stage is appended to it as a line of JSON, and a
+    textfile path gets the totals written in the prometheus textfile format by export.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.json_file = None
+        self.textfile = None
+        self.lock = threading.Lock()
+        self.stages = {}    # name -> [count, total seconds, max seconds]
+        self.counters = {}  # name -> total
+        self.gauges = {}    # name -> last value
+
+    def enable(self, json_file = None, textfile = None):
+        self.enabled = True
+        self.json_file = json_file
+        self.textfile = textfile
+
+    @contextmanager
+    def stage(self, name, **fields):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, **fields)
+
+    def timed(self, name):
+        # decorator, times every call of the function as stage name
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record(self, name, seconds, **fields):
+        if not self.enabled:
+            return
+        with self.lock:
+            stage = self.stages.setdefault(name, [0, 0.0, 0.0])
+            stage[0] += 1
+            stage[1] += seconds
+            stage[2] = max(stage[2], seconds)
+            self.write_event({'stage': name, 'seconds': round(seconds, 6), **fields})
+
+    def count(self, name, value = 1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def count_bytes(self, name, chunks):
+        # passes chunks through, counting their size
+        for chunk in chunks:
+            self.count(name, len(chunk))
+            yield chunk
+
+    def gauge(self, name, value):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.gauges[name] = value
+
+    def write_event(self, event):
+        if self.json_file is None:
+            return
+        event = {'time': round(time.time(), 3), 'pid': os.getpid(), **event}
+        with open(self.json_file, 'a') as file:
+            file.write(json.dumps(event) + "\n")
+
+    @staticmethod
+    def get_peak_rss():
+        # bytes.  children covers the imagemagick and ping subprocesses
+        return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024)
+
+    def summary(self):
+        peak_rss, peak_child_rss = Profiler.get_peak_rss()
+        with self.lock:
+            return {
+                'stages': {name: {'count': count, 'seconds': round(total, 6), 'max_seconds': round(longest, 6)}
+                           for name, (count, total, longest) in self.stages.items()},
+                'counters': dict(self.counters),
+                'gauges': {**self.gauges, 'peak_rss_bytes': peak_rss, 'peak_child_rss_bytes': peak_child_rss},
+            }
+
+    def print_table(self):
+        summary = self.summary()
+        print(f"{'stage':24} {'count':>7} {'total':>10} {'mean':>10} {'max':>10}")
+        for name, stage in sorted(summary['stages'].items(), key=lambda x: -x[1]['seconds']):
+            print(f"{name:24} {stage['count']:7} {stage['seconds']:9.3f}s "
+                  f"{stage['seconds'] / stage['count']:9.3f}s {stage['max_seconds']:9.3f}s")
+        for name, value in sorted({**summary['counters'], **summary['gauges']}.items()):
+            print(f"{name:24} {value:>7}")
+
+    def export(self):
+        # writes the totals so far.  node exporter may read at any time so swap the whole file in at once
+        if not self.enabled or self.textfile is None:
+            return
+        summary = self.summary()
+        lines = []
+        # every sample of a metric has to follow its TYPE line as one group
+        for metric, field, metric_type in [("stage_seconds_total", "seconds", "counter"),
+                                           ("stage_runs_total", "count", "counter"),
+                                           ("stage_max_seconds", "max_seconds", "gauge")]:
+            lines.append(f"# TYPE {METRIC_PREFIX}_{metric} {metric_type}")
+            for name, stage in sorted(summary['stages'].items()):
+                lines.append(f'{METRIC_PREFIX}_{metric}{{stage="{name}"}} {stage[field]}')
+        for name, value in sorted(summary['counters'].items()):
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name}_total counter")
+            lines.append(f"{METRIC_PREFIX}_{name}_total {value}")
+        for name, value in sorted(summary['gauges'].items()):
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} gauge")
+            lines.append(f"{METRIC_PREFIX}_{name} {value}")
+
+        temp_file = f"{self.textfile}.{os.getpid()}.tmp"
+        try:
+            with open(temp_file, 'w') as file:
+                file.write("\n".join(lines) + "\n")
+            os.replace(temp_file, self.textfile)
+        except OSError as e:
+            print(f"Unable to write metrics to {self.textfile}: {e}")
+
+# shared by every module so a stage can be timed wherever it happens
+profiler = Profiler()
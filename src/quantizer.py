@@ -0,0 +1,51 @@
+from PIL import Image
+
+DITHER_MODES = ["floyd-steinberg", "ordered", "none"]
+
+# 4x4 bayer matrix for ordered dithering
+BAYER_MATRIX = [[0, 8, 2, 10], [12, 4, 14, 6], [3, 11, 1, 9], [15, 7, 13, 5]]
+# how far ordered dithering pushes a pixel.  the panel colours are far apart, so it has to be wide
+# to reach from one to the next
+ORDERED_SPREAD = 192
+
+class Quantizer:
+    """
+    Maps RGB images onto the panel colours as a "P" image the inky driver takes as is.
+
+    Only the real panel colours can come out.  The clear entry is left out, and the rest of the
+    256 entry palette is padded with the first colour instead of black, otherwise very dark
+    pixels land on an index the panel doesnt have.  The nearest colour search and the error
+    diffusion stay in pillow's C loops.  Ordered dithering, which pillow only has for 1 bit
+    images, is a bayer threshold added with numpy before the search.
+    """
+
+    def __init__(self, palette, dither = "floyd-steinberg", colours = 7):
+        if dither not in DITHER_MODES:
+            raise ValueError(f"Unknown dither mode {dither}, expected one of {', '.join(DITHER_MODES)}")
+        self.palette = list(palette)
+        self.dither = dither
+        self.palette_image = Image.new("P", (1, 1))
+        self.palette_image.putpalette(self.palette[:colours * 3] + self.palette[:3] * (256 - colours))
+        self.thresholds = None
+
+    def get_thresholds(self, width, height):
+        # the tiled matrix for the whole image, kept for the next image of the same size.  centred
+        # on 0 so ordered dithering doesnt brighten or darken the image
+        import numpy
+        if self.thresholds is None or self.thresholds.shape[:2] != (height, width):
+            matrix = (numpy.array(BAYER_MATRIX, dtype=numpy.float32) + 0.5) / 16 - 0.5
+            tiled = numpy.tile(matrix, (height // 4 + 1, width // 4 + 1))[:height, :width]
+            self.thresholds = numpy.rint(tiled * ORDERED_SPREAD).astype(numpy.int16)[:, :, None]
+        return self.thresholds
+
+    def quantize(self, image : Image) -> Image:
+        image = image.convert('RGB')
+        dither = Image.Dither.FLOYDSTEINBERG if self.dither == "floyd-steinberg" else Image.Dither.NONE
+        if self.dither == "ordered":
+            # numpy is only loaded for the one mode that needs it
+            import numpy
+            pixels = numpy.asarray(image, dtype=numpy.int16) + self.get_thresholds(image.width, image.height)
+            image = Image.fromarray(numpy.clip(pixels, 0, 255).astype(numpy.uint8), 'RGB')
+        frame = image.quantize(palette=self.palette_image, dither=dither)
+        frame.putpalette(self.palette)
+        return frame
@@ -0,0 +1,166 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from image_database import ImageDatabase, ImageData
+from immich_data import make_session
+from panel_profile import PanelProfile
+from profiler import profiler
+
+API_ADDR = "/api"
+
+class RenderClient:
+    """
+    Fills the database and frame cache from a render server instead of immich.
+
+    Only finished frames come down.  The photos stay on the server, so a row's file_path names
+    the photo its frame was rendered from and that file is never there.  The manifest etag is
+    kept in state_file so a sync where nothing changed is a single small request.
+    """
+
+    def __init__(self, server_url, profile : PanelProfile, state_file, timeout = 30, retries = 3, pool_size = 4):
+        self.server_url = f"{server_url.rstrip('/')}{API_ADDR}"
+        self.profile = profile
+        self.state_file = state_file
+        self.timeout = (min(10, timeout), timeout)
+        self.pool_size = pool_size
+        # registering a profile is idempotent so the POST is retried too
+        self.session = make_session(pool_size, retries, allowed_methods=("GET", "POST"))
+
+    def load_state(self):
+        try:
+            with open(self.state_file, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def save_state(self, state):
+        with open(f"{self.state_file}.tmp", 'w') as file:
+            json.dump(state, file)
+        os.replace(f"{self.state_file}.tmp", self.state_file)
+
+    def register(self):
+        # registering again is harmless, and covers a server that lost its profiles
+        response = self.session.post(f"{self.server_url}/profiles", json=self.profile.to_dict(), timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()['key']
+
+    def fetch_manifest(self, key, etag = None):
+        # [album_id, asset_id, frame name] for every image, or None when it hasnt changed since etag
+        headers = {'If-None-Match': etag} if etag is not None else {}
+        response = self.session.get(f"{self.server_url}/profiles/{key}/manifest", headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            return None, etag
+        response.raise_for_status()
+        return response.json()['images'], response.headers.get('ETag')
+
+    def fetch_frame(self, key, name, frame_path):
+        # runs on a download thread.  written beside the frame and swapped in so a frame is never half there
+        temp_path = f"{frame_path}.tmp"
+        with self.session.get(f"{self.server_url}/profiles/{key}/frames/{name}", timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            with open(temp_path, 'wb') as file:
+                for chunk in profiler.count_bytes("frame_bytes", response.iter_content(chunk_size=65536)):
+                    file.write(chunk)
+        os.replace(temp_path, frame_path)
+
+    @profiler.timed("sync_frames")
+    def sync(self, database : ImageDatabase):
+        """
+        Bring the database and frame cache in line with the server.
+
+        :param database: The image database, with the frame cache to fill.
+        :return: True if every frame is now here.
+        """
+        import requests
+        frame_cache = database.frame_cache
+        state = self.load_state()
+        try:
+            key = self.register()
+            if state.get('profile') != key:
+                # the frame names only carry the resolution, saturation, dither and palette, so
+                # frames from before a change to the rotation or letterbox would look current
+                if state.get('profile') is not None:
+                    print("Panel settings changed.  Dropping the frames from the old settings")
+                frame_cache.clear()
+                state = {'profile': key}
+            # an empty database was purged (--clean, --force-refresh) or lost, so the frames the etag
+            # stands for arent here any more
+            if len(database.data) == 0:
+                state.pop('etag', None)
+            images, etag = self.fetch_manifest(key, state.get('etag'))
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print(f"Unable to sync with the render server: {e}")
+            return False
+
+        if images is None:
+            print("Frames are up to date")
+            return True
+
+        complete = self.apply_manifest(database, key, images)
+        database.save_changes()
+        # without every frame the etag isnt kept, so the next sync gets the manifest again and retries
+        self.save_state({'profile': key, 'etag': etag if complete else None})
+        return complete
+
+    def apply_manifest(self, database : ImageDatabase, key, images):
+        from tqdm import tqdm
+        import requests
+        frame_cache = database.frame_cache
+        wanted = {(album_id, asset_id): name for album_id, asset_id, name in images}
+
+        # rows the server no longer has, and their frame once no other album uses it
+        for row_key in [row_key for row_key in database.data if row_key not in wanted]:
+            image_data = database.data[row_key]
+            database.remove_image(image_data)
+            if image_data.file_path is not None and not database.is_file_used(image_data.file_path):
+                frame_cache.remove(image_data.file_path)
+
+        # frame name -> rows waiting on it.  a photo in several albums is fetched once
+        missing = {}
+        for (album_id, asset_id), name in wanted.items():
+            file_path = os.path.join(database.image_directory, name)
+            image_data = database.get_image(album_id, asset_id)
+            if image_data is None:
+                image_data = ImageData(album_id, asset_id)
+                database.add_image(image_data)
+            if os.path.exists(frame_cache.get_frame_path(file_path)):
+                if image_data.file_path != file_path or image_data.evicted:
+                    image_data.file_path = file_path
+                    image_data.evicted = False
+                    database.update_image(image_data)
+                continue
+            if image_data.file_path is not None:
+                # dont let the picker land on it until the frame is here
+                image_data.file_path = None
+                database.update_image(image_data)
+            missing.setdefault(name, []).append(image_data)
+
+        if len(missing) == 0:
+            print("No new frames to fetch")
+            return True
+
+        failed = 0
+        with ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="frames") as executor, \
+             tqdm(total=len(missing), desc="Fetching frames", unit="frame") as progress_bar:
+            futures = {}
+            for name in missing:
+                frame_path = frame_cache.get_frame_path(os.path.join(database.image_directory, name))
+                futures[executor.submit(self.fetch_frame, key, name, frame_path)] = name
+            for future in as_completed(futures):
+                name = futures[future]
+                progress_bar.update(1)
+                try:
+                    future.result()
+                except (requests.RequestException, OSError) as e:
+                    print(f"Unable to fetch the frame for {name}: {e}")
+                    failed += 1
+                    continue
+                for image_data in missing[name]:
+                    image_data.file_path = os.path.join(database.image_directory, name)
+                    image_data.evicted = False
+                    database.update_image(image_data)
+
+        if failed > 0:
+            print(f"{failed} frames will be fetched on the next sync")
+        return failed == 0
@@ -0,0 +1,284 @@
+import os
+import sys
+import json
+import time
+import signal
+import hashlib
+import threading
+from urllib.parse import unquote
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from PIL import Image, ImageColor
+
+from image_database import ImageDatabase
+from image_transform import fit_image
+from frame_cache import FrameCache, FRAME_EXTENSION
+from panel_profile import PanelProfile
+from screen import ScreenResolution
+from daemon import Scheduler, MAX_WAIT
+from profiler import profiler
+
+PROFILES_FILE = "profiles.json"
+
+class MasterDatabase(ImageDatabase):
+    """
+    The render server's copy of the albums.  Photos are kept upright at MasterResolution with no
+    rotation or letterbox, each panel profile gets its own when its frames are rendered.  They are
+    masters already, so none are kept beside them.
+    """
+
+    KEEP_MASTERS = False
+
+    def __init__(self, settings):
+        super().__init__(settings, ScreenResolution(settings.get_setting("MasterResolution", [1600, 1600])))
+        self.preserve_aspect = True
+        self.letterbox_color = None
+
+    def get_render_key(self):
+        return f"{self.target_resolution.resolution_string}-master"
+
+    def get_rotation(self, asset_orientation):
+        return None
+
+class RenderServer:
+    """
+    Serves ready frames to the panels on a network from one synced copy of the albums.
+
+    Panels register their PanelProfile, then poll a manifest of every photo and fetch the frames
+    they lack.  Requests are answered from a snapshot taken after each sync so the handler threads
+    never touch the database.  Frames for every profile are rendered ahead after a sync, and a
+    frame asked for before then is rendered once however many panels are waiting on it.
+    """
+
+    def __init__(self, directory, workers):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.profiles = {}    # key -> (PanelProfile, FrameCache)
+        self.masters = {}     # frame name -> master file path
+        self.manifest = json.dumps({'images': []}).encode('utf-8')
+        self.etag = None
+        self.rendering = {}   # (key, name) -> future
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render")
+        self.http = None
+        self.load_profiles()
+
+    def load_profiles(self):
+        # panels dont register again until their next sync, so remember them across restarts
+        try:
+            with open(os.path.join(self.directory, PROFILES_FILE), 'r') as file:
+                for profile_dict in json.load(file):
+                    self.add_profile(PanelProfile.from_dict(profile_dict))
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Ignoring damaged {PROFILES_FILE}: {e}")
+
+    def save_profiles(self):
+        profiles_file = os.path.join(self.directory, PROFILES_FILE)
+        with open(f"{profiles_file}.tmp", 'w') as file:
+            json.dump([profile.to_dict() for profile, _ in self.profiles.values()], file)
+        os.replace(f"{profiles_file}.tmp", profiles_file)
+
+    def add_profile(self, profile : PanelProfile):
+        frame_cache = FrameCache(os.path.join(self.directory, profile.key), profile.resolution, profile.palette,
+                                 profile.saturation, profile.dither)
+        self.profiles[profile.key] = (profile, frame_cache)
+
+    def register(self, profile : PanelProfile):
+        with self.lock:
+            if profile.key in self.profiles:
+                return profile.key
+            print(f"New panel profile {profile.key} at {profile.resolution.resolution_string}")
+            self.add_profile(profile)
+            self.save_profiles()
+        self.prerender(profile.key)
+        return profile.key
+
+    def has_profile(self, key):
+        return key in self.profiles
+
+    def get_manifest(self):
+        with self.lock:
+            return self.manifest, self.etag
+
+    def publish(self, database : ImageDatabase):
+        # every row with a master, as [album_id, asset_id, frame name].  a photo in several albums
+        # is one master and one frame name
+        masters = {}
+        images = []
+        for (album_id, asset_id), image_data in database.data.items():
+            if image_data.file_path is None or not os.path.exists(image_data.file_path):
+                continue
+            name = os.path.basename(image_data.file_path)
+            masters[name] = image_data.file_path
+            images.append([album_id, asset_id, name])
+        images.sort()
+        manifest = json.dumps({'images': images}).encode('utf-8')
+
+        with self.lock:
+            self.masters = masters
+            self.manifest = manifest
+            self.etag = f'"{hashlib.sha1(manifest).hexdigest()[:16]}"'
+            keys = list(self.profiles.keys())
+        print(f"Publishing {len(images)} images from {len(masters)} masters to {len(keys)} panel profiles")
+
+        for key in keys:
+            self.remove_stale(key)
+            self.prerender(key)
+
+    def remove_stale(self, key):
+        # frames of masters that are gone.  frames for other settings are left to FrameCache
+        _, frame_cache = self.profiles[key]
+        frame_cache.remove_stale()
+        suffix = f".{frame_cache.key}{FRAME_EXTENSION}"
+        for filename in os.listdir(frame_cache.directory):
+            if filename.endswith(suffix) and filename[:-len(suffix)] not in self.masters:
+                os.remove(os.path.join(frame_cache.directory, filename))
+
+    def prerender(self, key):
+        _, frame_cache = self.profiles[key]
+        with self.lock:
+            masters = list(self.masters.items())
+        for name, master_path in masters:
+            if not os.path.exists(frame_cache.get_frame_path(master_path)):
+                self.render(key, name, master_path)
+
+    def render(self, key, name, master_path):
+        # a future for the frame.  a frame already being rendered hands back the same future
+        with self.lock:
+            future = self.rendering.get((key, name))
+            if future is None:
+                profile, frame_cache = self.profiles[key]
+                future = self.executor.submit(self.render_frame, key, name, profile, frame_cache, master_path)
+                self.rendering[(key, name)] = future
+            return future
+
+    def render_frame(self, key, name, profile : PanelProfile, frame_cache : FrameCache, master_path):
+        try:
+            with profiler.stage("render_frame", asset=name):
+                background = ImageColor.getrgb(profile.letterbox_color) if profile.letterbox_color is not None else None
+                with Image.open(master_path) as image:
+                    longest_edge = max(profile.resolution.width, profile.resolution.height)
+                    image.draft('RGB', (longest_edge, longest_edge))
+                    # masters are already upright, so the pixels give the orientation
+                    rotation = profile.get_rotation(ScreenResolution([image.width, image.height]).orientation)
+                    image = fit_image(image, profile.resolution, rotation, profile.preserve_aspect, background)
+                frame_cache.render(master_path, image)
+        except Exception as e:
+            # frames rendered ahead have nobody waiting on them to see the error
+            print(f"Unable to render {name} for panel profile {key}: {e}")
+            raise
+        finally:
+            with self.lock:
+                self.rendering.pop((key, name), None)
+
+    def get_frame(self, key, name):
+        # path of a ready frame, rendering it first if need be.  None when there is no such frame
+        with self.lock:
+            entry = self.profiles.get(key)
+            master_path = self.masters.get(name)
+        if entry is None or master_path is None:
+            return None
+        frame_path = entry[1].get_frame_path(master_path)
+        if not os.path.exists(frame_path):
+            self.render(key, name, master_path).result()
+        return frame_path
+
+    def start(self, host, port):
+        self.http = RenderHTTPServer((host, port), RenderRequestHandler)
+        self.http.render_server = self
+        threading.Thread(target=self.http.serve_forever, daemon=True).start()
+        print(f"Serving frames on http://{host}:{self.http.server_port}")
+
+    def stop(self, signum = None, frame = None):
+        # systemd stops us with SIGTERM.  exiting through the main thread closes the database
+        sys.exit(0)
+
+    def run(self, host, port, sync, sync_interval):
+        # serves what the database already has straight away and syncs in the background of that
+        signal.signal(signal.SIGTERM, self.stop)
+        self.start(host, port)
+        scheduler = Scheduler()
+        scheduler.add_job("sync", sync_interval, sync)
+        try:
+            while True:
+                wait = scheduler.time_until_next()
+                time.sleep(MAX_WAIT if wait is None else min(wait, MAX_WAIT))
+                scheduler.run_pending()
+        finally:
+            self.http.shutdown()
+            self.http.server_close()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+class RenderHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # a room of panels waking together shouldnt be turned away
+    request_queue_size = 128
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    # keep-alive so a panel fetches all its frames over one connection
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body = b'', content_type = 'application/json', headers = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_message(self, status, message):
+        self.send(status, json.dumps({'message': message}).encode('utf-8'))
+
+    def do_POST(self):
+        server = self.server.render_server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path != "/api/profiles":
+            return self.send_error_message(404, "not found")
+        try:
+            profile = PanelProfile.from_dict(json.loads(body))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return self.send_error_message(400, f"bad profile: {e}")
+        self.send(200, json.dumps({'key': server.register(profile)}).encode('utf-8'))
+
+    def do_GET(self):
+        server = self.server.render_server
+        # /api/profiles/{key}/manifest and /api/profiles/{key}/frames/{name}
+        parts = [unquote(part) for part in self.path.split('?')[0].strip('/').split('/')]
+        if len(parts) < 4 or parts[:2] != ["api", "profiles"] or not server.has_profile(parts[2]):
+            return self.send_error_message(404, "not found")
+
+        if len(parts) == 4 and parts[3] == "manifest":
+            manifest, etag = server.get_manifest()
+            if etag is not None and self.headers.get('If-None-Match') == etag:
+                return self.send(304, headers={'ETag': etag})
+            return self.send(200, manifest, headers={'ETag': etag} if etag is not None else None)
+
+        if len(parts) == 5 and parts[3] == "frames":
+            try:
+                frame_path = server.get_frame(parts[2], parts[4])
+            except Exception:
+                return self.send_error_message(500, "render failed")
+            if frame_path is None:
+                return self.send_error_message(404, "not found")
+            try:
+                file = open(frame_path, 'rb')
+            except FileNotFoundError:
+                # removed by a sync between finding it and opening it
+                return self.send_error_message(404, "not found")
+            with file:
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(os.fstat(file.fileno()).st_size))
+                self.end_headers()
+                # frames go from the page cache to the socket without passing through python
+                self.connection.sendfile(file)
+            return
+
+        self.send_error_message(404, "not found")
@@ -1,10 +1,11 @@
 
-from inky.auto import auto
-from PIL import Image
-
 from settings import Settings
 from helpers import Orientation
 
+# the 7 colour impression palette, used to prepare frames when there is no inky driver to ask
+DESATURATED_PALETTE = [[0, 0, 0], [255, 255, 255], [0, 255, 0], [0, 0, 255], [255, 0, 0], [255, 255, 0], [255, 140, 0], [255, 255, 255]]
+SATURATED_PALETTE = [[57, 48, 57], [255, 255, 255], [58, 91, 70], [61, 59, 94], [156, 72, 75], [208, 190, 71], [177, 106, 73], [255, 255, 255]]
+
 class ScreenResolution:
     def __init__(self, resolution_tuple):
         self.update_resolution(resolution_tuple)
@@ -21,13 +22,26 @@ class Screen:
         self.resolution = ScreenResolution(resolution_tuple = [600, 448])
 
         self.settings = settings        
-        self.saturation = settings.get("Saturation", 0.5)
+        self.saturation = settings.get_setting("Saturation", 0.5)
         
     def init_inky(self):
+        # the driver pulls in the gpio and spi stack, so only load it when there is a screen to drive
+        from inky.auto import auto
         self.inky = auto()
         self.resolution = ScreenResolution(self.inky.resolution)
 
-    def set_image(self, image : Image):
+    def get_palette(self):
+        if self.inky is not None and hasattr(self.inky, "_palette_blend"):
+            return self.inky._palette_blend(self.saturation)
+
+        # same blend the inky driver does
+        palette = []
+        for saturated, desaturated in zip(SATURATED_PALETTE[:7], DESATURATED_PALETTE[:7]):
+            palette += [int(s * self.saturation + d * (1.0 - self.saturation)) for s, d in zip(saturated, desaturated)]
+        return palette + [255, 255, 255]
+
+    # a "P" image is pushed as is.  anything else gets quantized by the driver
+    def set_image(self, image):
         if self.inky is not None:
             self.inky.set_image(image, saturation=self.saturation)
             self.inky.show()
@@ -13,6 +13,10 @@ class Settings:
 
     def get(self, name, default):
         return self.settings_dict.get(name, default)
+
+    def get_setting(self, name, default):
+        value = self.settings_dict['Settings'].get(name)
+        return default if value is None else value
     
     def load_settings(self, file_path):
         try:
@@ -0,0 +1,164 @@
+import calendar
+from array import array
+from datetime import datetime
+
+# all times are stored as hours since this date.  it matches the default last_used of a new image
+EPOCH = datetime(1993, 12, 29)
+EPOCH_SECONDS = calendar.timegm(EPOCH.timetuple())
+
+def to_hours(date : datetime):
+    return (date - EPOCH).total_seconds() / 3600
+
+def seconds_to_hours(seconds):
+    # seconds count local time as if it were utc, the same as the naive datetimes to_hours takes
+    return (seconds - EPOCH_SECONDS) / 3600
+
+class WeightedPicker:
+    """
+    Weighted random selection over a set of keys using a pair of Fenwick trees.
+
+    An image weight is (1 + hours since last use) / (1 + use_count).  With hours measured from
+    EPOCH that is (1 + now) * a - b where a = 1 / (1 + use_count) and b = last_used / (1 + use_count),
+    so we keep prefix sums of a and b and can evaluate the cumulative weight for any "now"
+    without touching every entry.  Sampling and single entry updates are both O(log n).
+
+    The per slot values and both trees are arrays of doubles rather than lists of float objects,
+    which keeps a picker over a large library a fraction of the size.
+    """
+
+    def __init__(self):
+        self.keys = []              # slot -> key (None when the slot is free)
+        self.slots = {}             # key -> slot
+        self.values_a = array('d')  # slot -> a
+        self.values_b = array('d')  # slot -> b
+        self.free = []
+        self.tree_a = array('d', [0.0])
+        self.tree_b = array('d', [0.0])
+        self.updates = 0
+
+    def __len__(self):
+        return len(self.slots)
+
+    def build(self, entries):
+        # entries is an iterable of (key, last_used_hours, use_count)
+        self.keys = []
+        self.slots = {}
+        self.values_a = array('d')
+        self.values_b = array('d')
+        self.free = []
+        for key, last_used_hours, use_count in entries:
+            self.slots[key] = len(self.keys)
+            self.keys.append(key)
+            a, b = WeightedPicker.components(last_used_hours, use_count)
+            self.values_a.append(a)
+            self.values_b.append(b)
+        self.rebuild(len(self.keys))
+
+    def rebuild(self, capacity):
+        # O(n) fenwick construction.  also used to flush accumulated float error from updates
+        capacity = max(capacity, 1)
+        self.tree_a = array('d', [0.0]) + self.values_a + array('d', [0.0]) * (capacity - len(self.values_a))
+        self.tree_b = array('d', [0.0]) + self.values_b + array('d', [0.0]) * (capacity - len(self.values_b))
+        for i in range(1, capacity + 1):
+            parent = i + (i & -i)
+            if parent <= capacity:
+                self.tree_a[parent] += self.tree_a[i]
+                self.tree_b[parent] += self.tree_b[i]
+        self.updates = 0
+
+    @staticmethod
+    def components(last_used_hours, use_count):
+        divisor = 1 + use_count
+        return (1 / divisor, last_used_hours / divisor)
+
+    def set(self, key, last_used_hours, use_count):
+        a, b = WeightedPicker.components(last_used_hours, use_count)
+        slot = self.slots.get(key)
+        if slot is None:
+            if len(self.free) > 0:
+                slot = self.free.pop()
+                self.keys[slot] = key
+            else:
+                slot = len(self.keys)
+                self.keys.append(key)
+                self.values_a.append(0.0)
+                self.values_b.append(0.0)
+                if slot + 1 >= len(self.tree_a):
+                    self.values_a[slot] = a
+                    self.values_b[slot] = b
+                    self.slots[key] = slot
+                    self.rebuild(2 * len(self.keys))
+                    return
+            self.slots[key] = slot
+
+        delta_a = a - self.values_a[slot]
+        delta_b = b - self.values_b[slot]
+        self.values_a[slot] = a
+        self.values_b[slot] = b
+        self.add(slot, delta_a, delta_b)
+
+    def remove(self, key):
+        slot = self.slots.pop(key, None)
+        if slot is None:
+            return
+        old_a = self.values_a[slot]
+        old_b = self.values_b[slot]
+        self.keys[slot] = None
+        self.values_a[slot] = 0.0
+        self.values_b[slot] = 0.0
+        self.free.append(slot)
+        self.add(slot, -old_a, -old_b)
+
+    def add(self, slot, delta_a, delta_b):
+        capacity = len(self.tree_a) - 1
+        i = slot + 1
+        while i <= capacity:
+            self.tree_a[i] += delta_a
+            self.tree_b[i] += delta_b
+            i += i & -i
+
+        self.updates += 1
+        if self.updates > capacity:
+            self.rebuild(capacity)
+
+    def weight(self, key, now_hours):
+        slot = self.slots[key]
+        return (1 + now_hours) * self.values_a[slot] - self.values_b[slot]
+
+    def total_weight(self, now_hours):
+        capacity = len(self.tree_a) - 1
+        total_a = 0.0
+        total_b = 0.0
+        i = capacity
+        while i > 0:
+            total_a += self.tree_a[i]
+            total_b += self.tree_b[i]
+            i -= i & -i
+        return (1 + now_hours) * total_a - total_b
+
+    def pick(self, now_hours, rand_num):
+        # returns the first key whose cumulative weight reaches rand_num
+        if len(self.slots) == 0:
+            return None
+
+        scale = 1 + now_hours
+        capacity = len(self.tree_a) - 1
+        position = 0
+        remaining = rand_num
+        step = 1 << (capacity.bit_length() - 1)
+        while step > 0:
+            next_position = position + step
+            if next_position <= capacity:
+                node_weight = scale * self.tree_a[next_position] - self.tree_b[next_position]
+                if node_weight < remaining:
+                    position = next_position
+                    remaining -= node_weight
+            step >>= 1
+
+        # float error can push us past the last real entry.  walk back to one that exists
+        slot = min(position, len(self.keys) - 1)
+        while slot > 0 and self.keys[slot] is None:
+            slot -= 1
+        while self.keys[slot] is None:
+            slot += 1
+        return self.keys[slot]
@@ -0,0 +1,223 @@
+import os
+import zlib
+import struct
+
+LOCAL_FILE_HEADER = b'PK\x03\x04'
+DATA_DESCRIPTOR = b'PK\x07\x08'
+LOCAL_HEADER = struct.Struct('<HHHHHIIIHH')
+ZIP64_EXTRA_ID = 0x0001
+ZIP64_LIMIT = 0xFFFFFFFF
+
+FLAG_ENCRYPTED = 0x01
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+METHOD_STORED = 0
+METHOD_DEFLATED = 8
+
+class ZipStreamError(Exception):
+    pass
+
+class ChunkReader:
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = bytearray()
+
+    def fill(self, size):
+        while len(self.buffer) < size:
+            try:
+                self.buffer += next(self.chunks)
+            except StopIteration:
+                return False
+        return True
+
+    def read(self, size):
+        if not self.fill(size):
+            raise ZipStreamError(f"Archive ended early, wanted {size} bytes and got {len(self.buffer)}")
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def read_some(self, limit):
+        # whatever is buffered up to limit, pulling another chunk if the buffer is empty
+        if not self.fill(1):
+            raise ZipStreamError("Archive ended in the middle of a file")
+        data = bytes(self.buffer[:limit])
+        del self.buffer[:limit]
+        return data
+
+    def peek(self, size):
+        self.fill(size)
+        return bytes(self.buffer[:size])
+
+    def unread(self, data):
+        self.buffer[:0] = data
+
+class ZipStreamExtractor:
+    """
+    Extracts a zip archive while it is still downloading.
+
+    Local file headers are parsed straight out of the chunk stream and every member is written
+    to output_directory as soon as its data has arrived, so there is never a copy of the whole
+    archive on disk.  Handles stored and deflated members, zip64 sizes and data descriptors.
+    """
+
+    def __init__(self, output_directory, read_size = 64 * 1024):
+        self.output_directory = output_directory
+        self.read_size = read_size
+
+    def extract(self, chunks):
+        # generator yielding the path of each file once it is fully written
+        reader = ChunkReader(chunks)
+        while True:
+            signature = reader.peek(4)
+            if signature != LOCAL_FILE_HEADER:
+                # the central directory (or the end of the stream).  every file has been seen
+                return
+            reader.read(4)
+
+            output_path = self.extract_member(reader)
+            if output_path is not None:
+                yield output_path
+
+    def get_output_path(self, name):
+        # never let a member name escape the output directory
+        parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+        if len(parts) == 0:
+            return None
+        return os.path.join(self.output_directory, *parts)
+
+    def extract_member(self, reader : ChunkReader):
+        (version, flags, method, mod_time, mod_date, crc, compressed_size,
+         file_size, name_length, extra_length) = LOCAL_HEADER.unpack(reader.read(LOCAL_HEADER.size))
+        raw_name = reader.read(name_length)
+        extra = reader.read(extra_length)
+        name = raw_name.decode('utf-8' if flags & FLAG_UTF8 else 'cp437')
+
+        if flags & FLAG_ENCRYPTED:
+            raise ZipStreamError(f"{name} is encrypted")
+        if method not in (METHOD_STORED, METHOD_DEFLATED):
+            raise ZipStreamError(f"{name} uses unsupported compression method {method}")
+
+        is_zip64, file_size, compressed_size = ZipStreamExtractor.read_zip64_extra(extra, file_size, compressed_size)
+        has_descriptor = (flags & FLAG_DATA_DESCRIPTOR) != 0
+
+        output_path = self.get_output_path(name)
+        if output_path is None or name.endswith('/'):
+            if output_path is not None:
+                os.makedirs(output_path, exist_ok=True)
+            self.skip_data(reader, method, compressed_size, has_descriptor, is_zip64)
+            return None
+
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        temp_path = f"{output_path}.part"
+        with open(temp_path, 'wb') as file:
+            written_crc = self.copy_data(reader, file, method, compressed_size, has_descriptor, is_zip64)
+
+        if has_descriptor:
+            crc = self.read_descriptor(reader, is_zip64)[0]
+        if written_crc != crc:
+            os.remove(temp_path)
+            raise ZipStreamError(f"CRC mismatch for {name}")
+
+        os.replace(temp_path, output_path)
+        return output_path
+
+    @staticmethod
+    def read_zip64_extra(extra, file_size, compressed_size):
+        position = 0
+        while position + 4 <= len(extra):
+            header_id, size = struct.unpack_from('<HH', extra, position)
+            if header_id == ZIP64_EXTRA_ID:
+                values = extra[position + 4:position + 4 + size]
+                offset = 0
+                if file_size == ZIP64_LIMIT and offset + 8 <= len(values):
+                    file_size = struct.unpack_from('<Q', values, offset)[0]
+                    offset += 8
+                if compressed_size == ZIP64_LIMIT and offset + 8 <= len(values):
+                    compressed_size = struct.unpack_from('<Q', values, offset)[0]
+                return True, file_size, compressed_size
+            position += 4 + size
+        return False, file_size, compressed_size
+
+    def read_descriptor(self, reader : ChunkReader, is_zip64):
+        # the signature is optional
+        if reader.peek(4) == DATA_DESCRIPTOR:
+            reader.read(4)
+        if is_zip64:
+            return struct.unpack('<IQQ', reader.read(20))
+        return struct.unpack('<III', reader.read(12))
+
+    def copy_data(self, reader : ChunkReader, file, method, compressed_size, has_descriptor, is_zip64):
+        crc = 0
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS) if method == METHOD_DEFLATED else None
+
+        if has_descriptor and method == METHOD_STORED and compressed_size == 0:
+            # no size up front and nothing marks the end of the data besides the descriptor
+            return self.copy_stored_until_descriptor(reader, file, is_zip64)
+
+        if has_descriptor and method == METHOD_DEFLATED:
+            # deflate knows where it ends.  whatever it didnt use belongs to the descriptor
+            while not decompressor.eof:
+                data = decompressor.decompress(reader.read_some(self.read_size))
+                crc = zlib.crc32(data, crc)
+                file.write(data)
+            reader.unread(decompressor.unused_data)
+            return crc
+
+        remaining = compressed_size
+        while remaining > 0:
+            data = reader.read_some(min(remaining, self.read_size))
+            remaining -= len(data)
+            if decompressor is not None:
+                data = decompressor.decompress(data)
+            crc = zlib.crc32(data, crc)
+            file.write(data)
+        if decompressor is not None:
+            data = decompressor.flush()
+            crc = zlib.crc32(data, crc)
+            file.write(data)
+        return crc
+
+    def copy_stored_until_descriptor(self, reader : ChunkReader, file, is_zip64):
+        descriptor_size = 20 if is_zip64 else 12
+        size_format = '<IQ' if is_zip64 else '<II'
+        crc = 0
+        written = 0
+        pending = bytearray()
+        search_from = 0
+
+        while True:
+            position = pending.find(DATA_DESCRIPTOR, search_from)
+            if position == -1:
+                # keep enough of the tail that a signature split across chunks is still found
+                keep = len(DATA_DESCRIPTOR) - 1
+                flush = max(0, len(pending) - keep)
+                crc = zlib.crc32(pending[:flush], crc)
+                file.write(pending[:flush])
+                written += flush
+                del pending[:flush]
+                search_from = 0
+                pending += reader.read_some(self.read_size)
+                continue
+
+            end = position + len(DATA_DESCRIPTOR) + descriptor_size
+            while len(pending) < end:
+                pending += reader.read_some(self.read_size)
+
+            # a real descriptor matches the crc and size of everything before it
+            candidate_crc = zlib.crc32(pending[:position], crc)
+            descriptor_crc, descriptor_size_value = struct.unpack_from(size_format, pending, position + len(DATA_DESCRIPTOR))
+            if descriptor_crc == candidate_crc and descriptor_size_value == written + position:
+                file.write(pending[:position])
+                # put the descriptor back so the caller reads it like any other
+                reader.unread(pending[position:])
+                return candidate_crc
+
+            search_from = position + 1
+
+    def skip_data(self, reader : ChunkReader, method, compressed_size, has_descriptor, is_zip64):
+        with open(os.devnull, 'wb') as file:
+            self.copy_data(reader, file, method, compressed_size, has_descriptor, is_zip64)
+        if has_descriptor:
+            self.read_descriptor(reader, is_zip64)